@@ -1,7 +1,8 @@
 from .solver import Solver, load, load_results
 from .result_file import get_stacks, Result
 from .get_deformations import get_displacements_from_stacks
-from .solver import subtract_reference_state, interpolate_mesh
+from .solver import subtract_reference_state, interpolate_mesh, solve_regularized_series
+from .solver_profiler import SolverProfiler
 from .examples import load_example
 import importlib.metadata
 from .gui.solver.modules.exporter.Exporter import render_image
@@ -1,4 +1,6 @@
+import itertools
 import numpy as np
+from typing import Tuple
 
 
 def make_from_polar(r: float, theta: float, phi: float) -> np.ndarray:
@@ -45,3 +47,109 @@ def build_beams(n: int) -> np.ndarray:
 
     # return all the vectors
     return np.array(beams)
+
+
+def fold_antipodal_beams(beams: np.ndarray, weights: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge the beams s and -s into one beam with the sum of their weights. A fibre has the same energy in both
+    directions, so the merged beams give the same result with fewer beams.
+    """
+    from scipy.spatial import cKDTree
+    if weights is None:
+        weights = np.ones(beams.shape[0]) / beams.shape[0]
+    distance, antipode = cKDTree(beams).query(-beams)
+    keep = np.ones(beams.shape[0], dtype=bool)
+    weights = weights.copy()
+    for b in range(beams.shape[0]):
+        # merge each pair once, into the beam with the smaller index
+        if keep[b] and distance[b] < 1e-8 and antipode[b] > b:
+            weights[b] += weights[antipode[b]]
+            keep[antipode[b]] = False
+    return beams[keep], weights[keep]
+
+
+def build_beams_gauss(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a product quadrature with about N beams: Gauss-Legendre points in the z coordinate times equally spaced
+    angles in the xy plane. Integrates polynomials of the beam coordinates up to a degree of about sqrt(2 N) exactly.
+    """
+    n_z = max(int(np.round(np.sqrt(n / 2))), 1)
+    n_phi = 2 * n_z
+    z, weights_z = np.polynomial.legendre.leggauss(n_z)
+    phi = (2 * np.pi / n_phi) * (np.arange(n_phi) + 0.5)
+
+    z, phi = np.meshgrid(z, phi, indexing="ij")
+    r = np.sqrt(1 - z ** 2)
+    beams = np.array([r * np.cos(phi), r * np.sin(phi), z]).reshape(3, -1).T
+    weights = np.repeat(weights_z / 2 / n_phi, n_phi)
+    return beams, weights
+
+
+def build_beams_lebedev(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the Lebedev quadrature with N (6, 14, 26, 38 or 50) beams, which integrates polynomials of the beam
+    coordinates up to a degree of 3, 5, 7, 9 or 11 exactly.
+    """
+    def orbit(vector):
+        # all permutations and sign changes of the vector
+        points = set()
+        for permutation in itertools.permutations(vector):
+            for signs in itertools.product([1, -1], repeat=3):
+                points.add(tuple(float(s * p) for s, p in zip(signs, permutation)))
+        return np.array(sorted(points))
+
+    a1 = orbit((1, 0, 0))
+    a2 = orbit((0, np.sqrt(0.5), np.sqrt(0.5)))
+    a3 = orbit((np.sqrt(1 / 3),) * 3)
+    rules = {
+        6: [(a1, 1 / 6)],
+        14: [(a1, 1 / 15), (a3, 3 / 40)],
+        26: [(a1, 1 / 21), (a2, 4 / 105), (a3, 9 / 280)],
+        38: [(a1, 1 / 105), (a3, 9 / 280), (orbit((0.4597008433809831, 0.8880738339771153, 0)), 1 / 35)],
+        50: [(a1, 4 / 315), (a2, 64 / 2835), (a3, 27 / 1280),
+             (orbit((1 / np.sqrt(11), 1 / np.sqrt(11), 3 / np.sqrt(11))), 14641 / 725760)],
+    }
+    if n not in rules:
+        raise ValueError(f"No Lebedev quadrature with {n} beams, use one of {list(rules.keys())}")
+    beams = np.concatenate([points for points, weight in rules[n]])
+    weights = np.concatenate([np.full(points.shape[0], weight) for points, weight in rules[n]])
+    return beams, weights
+
+
+def build_beam_set(n: int = 300, kind: str = "grid", hemisphere: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a set of beams and their weights (summing to 1) for the integration over the whole solid angle.
+
+    Parameters
+    ----------
+    n : int, optional
+        The number of beams (on the whole sphere). Default 300
+    kind : str, optional
+        The distribution of the beams:
+            "grid" (the equally spaced beams of :py:func:`build_beams` with equal weights)
+            "gauss" (a Gauss-Legendre product quadrature, see :py:func:`build_beams_gauss`)
+            "lebedev" (a Lebedev quadrature, see :py:func:`build_beams_lebedev`)
+        Default "grid"
+    hemisphere : bool, optional
+        Whether to merge the beams s and -s into one beam with twice the weight. Gives the same result with up to half
+        the beams. Default True
+
+    Returns
+    -------
+    beams : ndarray
+        The unit vectors of the beams, dimensions N_b x 3
+    weights : ndarray
+        The weight of each beam, dimensions N_b
+    """
+    if kind == "grid":
+        beams = build_beams(n)
+        weights = np.ones(beams.shape[0]) / beams.shape[0]
+    elif kind == "gauss":
+        beams, weights = build_beams_gauss(n)
+    elif kind == "lebedev":
+        beams, weights = build_beams_lebedev(n)
+    else:
+        raise ValueError(f"Unknown beam set {kind}, use one of ['grid', 'gauss', 'lebedev']")
+    if hemisphere:
+        beams, weights = fold_antipodal_beams(beams, weights)
+    return beams, weights
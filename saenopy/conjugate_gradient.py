@@ -1,52 +1,664 @@
 import numpy as np
+import scipy.sparse as ssp
+from concurrent.futures import ThreadPoolExecutor
+from numba import njit, prange, get_num_threads
+from saenopy.numba_helper import NUMBA_CACHE
 
 
-def cg(A: np.ndarray, b: np.ndarray, maxiter: int = 1000, tol: float = 0.00001, verbose: bool = False):
-    """ solve the equation Ax=b with the conjugate gradient method """
+def cg(A: np.ndarray, b: np.ndarray, maxiter: int = 1000, tol: float = 0.00001, verbose: bool = False, M=None,
+       x0: np.ndarray = None, W: np.ndarray = None, info: dict = None):
+    """ solve the equation Ax=b with the (preconditioned) conjugate gradient method, M is the preconditioner, x0 the
+    start value and the columns of W span a subspace (e.g. of previous solutions) in which the start value is
+    corrected first. If a dictionary is given as info, the number of iterations and the relative residual are stored
+    in it. In single precision, the inner products are accumulated in double precision. """
+    if b.dtype == np.float32:
+        def inner(x, y):
+            return np.einsum("i,i->", x, y, dtype=np.float64)
+    else:
+        inner = np.inner
+
     def norm(x):
-        return np.inner(x.flatten(), x.flatten())
+        return inner(x.ravel(), x.ravel())
 
     # calculate the total force "amplitude"
     normb = norm(b)
 
     # if it is not 0 (always has to be positive)
     if normb == 0:
-        return 0
+        if info is not None:
+            info.update(iterations=0, residual=0.0)
+        return np.zeros_like(b)
+
+    x = np.zeros_like(b) if x0 is None else np.array(x0, dtype=b.dtype)
 
-    x = np.zeros_like(b)
+    # solve the equation in the subspace W and start from there
+    if W is not None and W.shape[1] > 0:
+        x = deflate_start_value(A, b, x, W)
 
     # the difference between the desired force deviations and the current force deviations
     r = b - A @ x
 
-    # and store it also in pp
-    p = r
+    # apply the preconditioner and store it in pp
+    z = r if M is None else M @ r
+    p = z
 
     # calculate the total force deviation "amplitude"
-    resid = norm(p)
+    resid = inner(r, z)
 
     # iterate maxiter iterations
+    i = 0
     for i in range(1, maxiter + 1):
         Ap = A @ p
 
-        alpha = resid / np.sum(p * Ap)
+        # the step sizes are cast to the precision of the vectors
+        alpha = b.dtype.type(resid / inner(p, Ap))
 
         x = x + alpha * p
         r = r - alpha * Ap
 
-        rsnew = norm(r)
-
         # check if we are already below the convergence tolerance
-        if rsnew < tol * normb:
+        if norm(r) < tol * normb:
             break
 
-        beta = rsnew / resid
+        z = r if M is None else M @ r
+        rsnew = inner(r, z)
+
+        beta = b.dtype.type(rsnew / resid)
 
         # update pp and resid
-        p = r + beta * p
+        p = z + beta * p
         resid = rsnew
 
         # print status every 100 frames
         if i % 100 == 0 and verbose:
             print(i, ":", resid, "alpha=", alpha, "du=", np.sum(x ** 2))  # , end="\r")
 
+    if info is not None:
+        info.update(iterations=i, residual=float(np.sqrt(norm(r) / normb)))
+    return x
+
+
+def solve_direct(A, b: np.ndarray, info: dict = None) -> np.ndarray:
+    """ solve the equation Ax=b with the sparse LU factorisation of the assembled matrix (scipy.sparse.linalg.splu).
+    Rows and columns without entries (e.g. of fixed nodes) keep the value of b. If a dictionary is given as info, the
+    number of iterations (0) and the relative residual are stored in it. """
+    x = LUPreconditioner(A) @ b
+    if info is not None:
+        normb = np.linalg.norm(b)
+        residual = np.linalg.norm(b - A @ x) / normb if normb > 0 else 0.0
+        info.update(iterations=0, residual=float(residual))
     return x
+
+
+def deflate_start_value(A, b: np.ndarray, x: np.ndarray, W: np.ndarray) -> np.ndarray:
+    """ correct x by the Galerkin projection of the equation A x = b onto the subspace spanned by the columns of W """
+    # an orthonormal basis of the subspace
+    W = np.linalg.qr(W)[0]
+    AW = np.stack([A @ w for w in W.T], axis=1)
+    r = b - A @ x
+    y = np.linalg.lstsq(W.T @ AW, W.T @ r, rcond=None)[0]
+    return x + W @ y
+
+
+class JacobiPreconditioner:
+    """ The diagonal preconditioner, multiplies with the inverse diagonal of the matrix """
+    def __init__(self, A):
+        diagonal = A.diagonal()
+        # rows without entries (e.g. of fixed nodes) are left untouched
+        diagonal[diagonal == 0] = 1
+        self.inverse_diagonal = 1 / diagonal
+
+    def __matmul__(self, r: np.ndarray) -> np.ndarray:
+        return self.inverse_diagonal * r
+
+
+class BlockJacobiPreconditioner:
+    """ The nodal block preconditioner, multiplies with the inverse of the 3x3 blocks of each node """
+    def __init__(self, A):
+        blocks = get_block_diagonal(A)
+        # nodes without entries (e.g. fixed nodes) are left untouched
+        empty = np.all(blocks == 0, axis=(1, 2))
+        blocks[empty] = np.eye(3)
+        self.inverse_blocks = np.linalg.inv(blocks)
+
+    def __matmul__(self, r: np.ndarray) -> np.ndarray:
+        return np.einsum("nij,nj->ni", self.inverse_blocks, r.reshape(-1, 3)).ravel()
+
+
+def get_assembled_matrix(A) -> ssp.csc_matrix:
+    """ get A as a sparse matrix, operators need to provide a tocsr method """
+    if not ssp.issparse(A):
+        if getattr(A, "tocsr", None) is None:
+            raise ValueError("The preconditioner needs an assembled matrix.")
+        A = A.tocsr()
+    return ssp.csc_matrix(A)
+
+
+class IncompleteLUPreconditioner:
+    """ The incomplete LU factorisation preconditioner (scipy.sparse.linalg.spilu) """
+    def __init__(self, A, drop_tol: float = 1e-4, fill_factor: float = 10):
+        from scipy.sparse.linalg import spilu
+        A = get_assembled_matrix(A)
+        # only factorize the rows and columns that have entries (e.g. not the fixed nodes)
+        self.active = np.where(A.diagonal() != 0)[0]
+        self.ilu = spilu(A[self.active][:, self.active].tocsc(), drop_tol=drop_tol, fill_factor=fill_factor)
+
+    def __matmul__(self, r: np.ndarray) -> np.ndarray:
+        z = r.copy()
+        z[self.active] = self.ilu.solve(r[self.active])
+        return z
+
+
+class LUPreconditioner:
+    """ The (complete) sparse LU factorisation (scipy.sparse.linalg.splu), only feasible for small matrices """
+    def __init__(self, A):
+        from scipy.sparse.linalg import splu
+        A = get_assembled_matrix(A)
+        # only factorize the rows and columns that have entries (e.g. not the fixed nodes)
+        self.active = np.where(A.diagonal() != 0)[0]
+        self.lu = splu(A[self.active][:, self.active].tocsc())
+
+    def __matmul__(self, r: np.ndarray) -> np.ndarray:
+        z = r.copy()
+        z[self.active] = self.lu.solve(r[self.active])
+        return z
+
+
+class AdditiveSchwarzPreconditioner:
+    """
+    The additive Schwarz preconditioner, sums the solutions of the subdomains (extended by overlap layers of
+    neighbouring nodes) with the sparse LU factorisations of their part of the matrix. The subdomains are solved in
+    parallel threads, which are started once and stopped by close (or when the preconditioner is deleted).
+
+    Parameters
+    ----------
+    A : matrix or operator
+        The matrix of the linear equation, needs to be assembled.
+    subdomains : ndarray, optional
+        The subdomain of each node, see :py:func:`~.multigrid_helper.get_subdomains`. Default blocks of 1000
+        consecutive nodes
+    overlap : int, optional
+        The number of layers of neighbouring nodes that are added to each subdomain. Default 1
+    """
+    _executor = None
+
+    def __init__(self, A, subdomains: np.ndarray = None, overlap: int = 1):
+        from scipy.sparse.linalg import splu
+        A = get_assembled_matrix(A)
+        if subdomains is None:
+            subdomains = np.arange(A.shape[0] // 3) // 1000
+        # the rows and columns that have entries (e.g. not the fixed nodes)
+        active = A.diagonal() != 0
+        self.active = np.where(active)[0]
+        # the nodes that are coupled by the matrix
+        A = A.tocoo()
+        graph = ssp.csr_matrix((np.ones(A.nnz, dtype=bool), (A.row // 3, A.col // 3)),
+                               shape=(A.shape[0] // 3, A.shape[1] // 3))
+        A = A.tocsr()
+        self.dofs = []
+        self.lus = []
+        for s in range(np.max(subdomains) + 1):
+            mask = subdomains == s
+            for _ in range(overlap):
+                mask = mask | graph @ mask
+            dofs = (np.where(mask)[0][:, None] * 3 + np.arange(3)).ravel()
+            dofs = dofs[active[dofs]]
+            if dofs.shape[0] == 0:
+                continue
+            self.dofs.append(dofs)
+            self.lus.append(splu(A[dofs][:, dofs].tocsc()))
+        # the threads that solve the subdomains
+        num_threads = min(get_num_threads(), len(self.lus))
+        if num_threads > 1:
+            self._executor = ThreadPoolExecutor(num_threads)
+
+    def close(self):
+        """ stop the threads """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __del__(self):
+        self.close()
+
+    def __matmul__(self, r: np.ndarray) -> np.ndarray:
+        def solve(s):
+            return self.lus[s].solve(r[self.dofs[s]])
+
+        if self._executor is None:
+            solutions = [solve(s) for s in range(len(self.lus))]
+        else:
+            solutions = list(self._executor.map(solve, range(len(self.lus))))
+        z = r.copy()
+        z[self.active] = 0
+        for dofs, solution in zip(self.dofs, solutions):
+            z[dofs] += solution
+        return z
+
+
+preconditioners = {
+    "jacobi": JacobiPreconditioner,
+    "block_jacobi": BlockJacobiPreconditioner,
+    "ilu": IncompleteLUPreconditioner,
+    "lu": LUPreconditioner,
+    "schwarz": AdditiveSchwarzPreconditioner,
+}
+
+
+def get_preconditioner(A, method: str = None, subdomains: np.ndarray = None):
+    """
+    Create a preconditioner for the matrix A.
+
+    Parameters
+    ----------
+    A : matrix or operator
+        The matrix of the linear equation.
+    method : str, optional
+        The preconditioner to use:
+            None (no preconditioning)
+            "jacobi" (the inverse diagonal)
+            "block_jacobi" (the inverse of the 3x3 blocks of each node)
+            "ilu" (an incomplete LU factorisation, needs an assembled matrix)
+            "lu" (the complete LU factorisation, needs an assembled matrix)
+            "schwarz" (the additive Schwarz method with LU factorisations of overlapping subdomains, needs an
+            assembled matrix)
+    subdomains : ndarray, optional
+        The subdomain of each node for the "schwarz" preconditioner.
+    """
+    if method is None or method == "none":
+        return None
+    if method not in preconditioners:
+        raise ValueError(f"Unknown preconditioner {method}, use one of {list(preconditioners.keys())}")
+    if method == "schwarz":
+        return AdditiveSchwarzPreconditioner(A, subdomains)
+    return preconditioners[method](A)
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_csr_block_diagonal(indptr, indices, data, out):  # pragma: no cover
+    """ get the 3x3 blocks on the diagonal of a CSR matrix """
+    for row in range(indptr.shape[0] - 1):
+        node = row // 3
+        for k in range(indptr[row], indptr[row + 1]):
+            if indices[k] // 3 == node:
+                out[node, row % 3, indices[k] % 3] += data[k]
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_csr_block_diagonal_product(indptr, indices, data, t_indptr, t_indices, t_data, weight, out):  # pragma: no cover
+    """ get the 3x3 blocks on the diagonal of the product K W K, with t_* the CSR arrays of K transposed """
+    for row in range(indptr.shape[0] - 1):
+        node = row // 3
+        for b in range(3):
+            col = node * 3 + b
+            # the sparse dot product of the row of K with the column of K (both have sorted indices)
+            k1 = indptr[row]
+            k2 = t_indptr[col]
+            value = 0.0
+            while k1 < indptr[row + 1] and k2 < t_indptr[col + 1]:
+                if indices[k1] == t_indices[k2]:
+                    value += data[k1] * weight[indices[k1]] * t_data[k2]
+                    k1 += 1
+                    k2 += 1
+                elif indices[k1] < t_indices[k2]:
+                    k1 += 1
+                else:
+                    k2 += 1
+            out[node, row % 3, b] = value
+
+
+def get_block_diagonal(A) -> np.ndarray:
+    """ get the 3x3 blocks on the diagonal of A, dimensions N_c x 3 x 3 """
+    if getattr(A, "block_diagonal", None) is not None:
+        return A.block_diagonal()
+    A = ssp.csr_matrix(A)
+    A.sort_indices()
+    out = np.zeros((A.shape[0] // 3, 3, 3), dtype=A.dtype)
+    numba_csr_block_diagonal(A.indptr, A.indices, A.data, out)
+    return out
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_element_matvec(tetrahedra, block_offset, K_data, x, out):  # pragma: no cover
+    """ multiply the stiffness matrix given by the 4x4x3x3 blocks of each tetrahedron with x """
+    out[:] = 0
+    for t in range(tetrahedra.shape[0]):
+        tet = tetrahedra[t]
+        for m in range(4):
+            offset = block_offset[t, m]
+            if offset < 0:
+                continue
+            c1 = tet[m]
+            for r in range(4):
+                c2 = tet[r]
+                for i in range(3):
+                    value = 0.0
+                    for l in range(3):
+                        value += K_data[offset + (r * 3 + i) * 3 + l] * x[c2 * 3 + l]
+                    out[c1 * 3 + i] += value
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def numba_subdomain_element_matvec(tetrahedra, block_offset, K_data, tet_order, tet_ptr, target, halo_nodes, x, out,
+                                   halo):  # pragma: no cover
+    """ multiply the stiffness matrix given by the 4x4x3x3 blocks of each tetrahedron with x, the subdomains in
+    parallel. Each subdomain adds its own nodes to out and the nodes of other subdomains to its part of the halo, which
+    is added to out afterwards (see get_element_partition) """
+    out[:] = 0
+    halo[:] = 0
+    for s in prange(tet_ptr.shape[0] - 1):
+        for k in range(tet_ptr[s], tet_ptr[s + 1]):
+            t = tet_order[k]
+            tet = tetrahedra[t]
+            for m in range(4):
+                offset = block_offset[t, m]
+                if offset < 0:
+                    continue
+                c1 = target[t, m]
+                for r in range(4):
+                    c2 = tet[r]
+                    for i in range(3):
+                        value = 0.0
+                        for l in range(3):
+                            value += K_data[offset + (r * 3 + i) * 3 + l] * x[c2 * 3 + l]
+                        if c1 >= 0:
+                            out[c1 * 3 + i] += value
+                        else:
+                            halo[(-1 - c1) * 3 + i] += value
+    # combine the halo contributions
+    for h in range(halo_nodes.shape[0]):
+        for i in range(3):
+            out[halo_nodes[h] * 3 + i] += halo[h * 3 + i]
+
+
+def get_element_partition(tetrahedra: np.ndarray, subdomains: np.ndarray) -> tuple:
+    """
+    Assign each tetrahedron to the subdomain of its first corner for the parallel element by element product.
+
+    Parameters
+    ----------
+    tetrahedra : ndarray
+        The node indices of the 4 corners. Dimensions N_T x 4
+    subdomains : ndarray
+        The subdomain of each node. Dimensions N_c
+
+    Returns
+    -------
+    tet_order : ndarray
+        The tetrahedra sorted by their subdomain.
+    tet_ptr : ndarray
+        The start of each subdomain in tet_order.
+    target : ndarray
+        Where the product of each corner is added to: the node if it belongs to the subdomain of the tetrahedron,
+        otherwise -1 - the index of the node in the halo of the subdomain. Dimensions N_T x 4
+    halo_nodes : ndarray
+        The node of each halo entry.
+    """
+    number_nodes = subdomains.shape[0]
+    tet_subdomain = subdomains[tetrahedra[:, 0]]
+    tet_order = np.argsort(tet_subdomain, kind="stable")
+    tet_ptr = np.concatenate([[0], np.cumsum(np.bincount(tet_subdomain, minlength=np.max(subdomains) + 1))])
+    # the corners that belong to another subdomain, one halo entry for each pair of subdomain and node
+    halo = subdomains[tetrahedra] != tet_subdomain[:, None]
+    keys = (tet_subdomain[:, None] * number_nodes + tetrahedra)[halo]
+    halo_keys, halo_index = np.unique(keys, return_inverse=True)
+    target = tetrahedra.astype(np.int64)
+    target[halo] = -1 - halo_index
+    return tet_order, tet_ptr, target, halo_keys % number_nodes
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_element_diagonal(tetrahedra, block_offset, K_data, out):  # pragma: no cover
+    """ get the diagonal of the stiffness matrix given by the 4x4x3x3 blocks of each tetrahedron """
+    out[:] = 0
+    for t in range(tetrahedra.shape[0]):
+        for m in range(4):
+            offset = block_offset[t, m]
+            if offset < 0:
+                continue
+            for i in range(3):
+                out[tetrahedra[t, m] * 3 + i] += K_data[offset + (m * 3 + i) * 3 + i]
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_element_block_diagonal(tetrahedra, block_offset, K_data, out):  # pragma: no cover
+    """ get the 3x3 diagonal blocks of the stiffness matrix given by the 4x4x3x3 blocks of each tetrahedron """
+    for t in range(tetrahedra.shape[0]):
+        for m in range(4):
+            offset = block_offset[t, m]
+            if offset < 0:
+                continue
+            for i in range(3):
+                for l in range(3):
+                    out[tetrahedra[t, m], i, l] += K_data[offset + (m * 3 + i) * 3 + l]
+
+
+class ElementStiffnessOperator:
+    """
+    The global stiffness matrix K applied element by element from the stiffness blocks of the tetrahedra, without
+    assembling a sparse matrix.
+
+    Parameters
+    ----------
+    tetrahedra : ndarray
+        The node indices of the 4 corners. Dimensions N_T x 4
+    block_offset : ndarray
+        The position of the 4x3x3 block of each tetrahedron corner in K_data, -1 for corners that are not assembled.
+        Dimensions N_T x 4
+    K_data : ndarray
+        The values of the stiffness blocks.
+    shape : tuple
+        The shape of the matrix (3 N_c x 3 N_c).
+    partition : tuple, optional
+        The partition of the tetrahedra into subdomains from :py:func:`get_element_partition`, the subdomains are
+        multiplied in parallel. Default None (serial)
+    """
+    def __init__(self, tetrahedra: np.ndarray, block_offset: np.ndarray, K_data: np.ndarray, shape: tuple,
+                 partition: tuple = None):
+        self.tetrahedra = tetrahedra
+        self.block_offset = block_offset
+        self.K_data = K_data
+        self.shape = shape
+        self.dtype = K_data.dtype
+        self.partition = partition
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        out = np.zeros(self.shape[0], dtype=np.result_type(self.dtype, x.dtype))
+        if self.partition is None:
+            numba_element_matvec(self.tetrahedra, self.block_offset, self.K_data, np.ascontiguousarray(x.ravel()),
+                                 out)
+        else:
+            tet_order, tet_ptr, target, halo_nodes = self.partition
+            halo = np.zeros(halo_nodes.shape[0] * 3, dtype=out.dtype)
+            numba_subdomain_element_matvec(self.tetrahedra, self.block_offset, self.K_data, tet_order, tet_ptr, target,
+                                           halo_nodes, np.ascontiguousarray(x.ravel()), out, halo)
+        return out.reshape(x.shape)
+
+    dot = __matmul__
+
+    def diagonal(self) -> np.ndarray:
+        out = np.zeros(self.shape[0], dtype=self.dtype)
+        numba_element_diagonal(self.tetrahedra, self.block_offset, self.K_data, out)
+        return out
+
+    def block_diagonal(self) -> np.ndarray:
+        out = np.zeros((self.shape[0] // 3, 3, 3), dtype=self.dtype)
+        numba_element_block_diagonal(self.tetrahedra, self.block_offset, self.K_data, out)
+        return out
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def numba_subdomain_csr_matvec(indptr, indices, data, rows, row_ptr, x, out):  # pragma: no cover
+    """ multiply the CSR matrix with x, the rows of each subdomain (rows[row_ptr[s]:row_ptr[s + 1]]) in parallel """
+    for s in prange(row_ptr.shape[0] - 1):
+        for k0 in range(row_ptr[s], row_ptr[s + 1]):
+            row = rows[k0]
+            value = 0.0
+            for k in range(indptr[row], indptr[row + 1]):
+                value += data[k] * x[indices[k]]
+            out[row] = value
+
+
+class SubdomainStiffnessOperator:
+    """
+    The assembled global stiffness matrix K, multiplied with the rows of the subdomains in parallel.
+
+    Parameters
+    ----------
+    K : sparse matrix
+        The stiffness matrix in CSR format.
+    subdomains : ndarray
+        The subdomain of each node, see :py:func:`~.multigrid_helper.get_subdomains`. Dimensions N_c
+    """
+    def __init__(self, K: ssp.csr_matrix, subdomains: np.ndarray):
+        self.K = K
+        self.shape = K.shape
+        self.dtype = K.dtype
+        # the rows of the nodes sorted by subdomain
+        self.rows = np.argsort(np.repeat(subdomains, 3), kind="stable")
+        self.row_ptr = np.concatenate([[0], np.cumsum(np.bincount(subdomains) * 3)])
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        out = np.zeros(self.shape[0], dtype=np.result_type(self.dtype, x.dtype))
+        numba_subdomain_csr_matvec(self.K.indptr, self.K.indices, self.K.data, self.rows, self.row_ptr,
+                                   np.ascontiguousarray(x.ravel()), out)
+        return out.reshape(x.shape)
+
+    dot = __matmul__
+
+    def diagonal(self) -> np.ndarray:
+        return self.K.diagonal()
+
+    def block_diagonal(self) -> np.ndarray:
+        out = np.zeros((self.shape[0] // 3, 3, 3), dtype=self.dtype)
+        numba_csr_block_diagonal(self.K.indptr, self.K.indices, self.K.data, out)
+        return out
+
+    def tocsr(self) -> ssp.csr_matrix:
+        return self.K
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_symmetric_csr_matvec(indptr, indices, data, x, out):  # pragma: no cover
+    """ multiply the symmetric matrix given by the CSR arrays of its upper block triangle (the 3x3 node blocks with
+    row node <= column node) with x """
+    out[:] = 0
+    for row in range(indptr.shape[0] - 1):
+        value = 0.0
+        x_row = x[row]
+        for k in range(indptr[row], indptr[row + 1]):
+            col = indices[k]
+            value += data[k] * x[col]
+            # the mirrored entry of the lower block triangle
+            if col // 3 != row // 3:
+                out[col] += data[k] * x_row
+        out[row] += value
+
+
+class SymmetricStiffnessOperator:
+    """
+    The global stiffness matrix K stored as the upper block triangle of the symmetric matrix of all tetrahedra, with
+    the rows of the fixed nodes set to 0 after each product. Needs about half the memory of the full matrix.
+
+    Parameters
+    ----------
+    upper : sparse matrix
+        The 3x3 node blocks of the symmetric stiffness matrix with row node <= column node, in CSR format.
+    row_mask : ndarray
+        1 for the rows that are kept, 0 for the rows that are set to 0. Dimensions 3 N_c
+    """
+    def __init__(self, upper: ssp.csr_matrix, row_mask: np.ndarray):
+        self.upper = upper
+        self.row_mask = row_mask.astype(upper.dtype, copy=False)
+        self.shape = upper.shape
+        self.dtype = upper.dtype
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        out = np.zeros(self.shape[0], dtype=np.result_type(self.dtype, x.dtype))
+        numba_symmetric_csr_matvec(self.upper.indptr, self.upper.indices, self.upper.data,
+                                   np.ascontiguousarray(x.ravel()), out)
+        out *= self.row_mask
+        return out.reshape(x.shape)
+
+    dot = __matmul__
+
+    def diagonal(self) -> np.ndarray:
+        return self.upper.diagonal() * self.row_mask
+
+    def block_diagonal(self) -> np.ndarray:
+        out = np.zeros((self.shape[0] // 3, 3, 3), dtype=self.dtype)
+        numba_csr_block_diagonal(self.upper.indptr, self.upper.indices, self.upper.data, out)
+        return out * self.row_mask.reshape(-1, 3, 1)
+
+    def tocsr(self) -> ssp.csr_matrix:
+        # add the transposed blocks that are not on the diagonal
+        upper = self.upper.tocoo()
+        off_diagonal = upper.row // 3 != upper.col // 3
+        lower = ssp.coo_matrix((upper.data[off_diagonal], (upper.col[off_diagonal], upper.row[off_diagonal])),
+                               shape=self.shape)
+        return (ssp.diags(self.row_mask) @ (self.upper + lower)).tocsr()
+
+
+class RegularizationOperator:
+    """
+    The matrix of the regularisation step A = I_mask + K W K applied as K (W (K x)) without forming the product.
+
+    Parameters
+    ----------
+    K : matrix or operator
+        The stiffness matrix, anything that supports K @ x.
+    weight : ndarray
+        The diagonal of the weight matrix W. Dimensions 3 N_c
+    mask : ndarray
+        The diagonal of the masking matrix I_mask. Dimensions 3 N_c
+    """
+    def __init__(self, K, weight: np.ndarray, mask: np.ndarray):
+        self.K = K
+        # in the precision of K, so that K is not converted when multiplied with the vectors
+        self.weight = weight.astype(K.dtype, copy=False)
+        self.mask = mask.astype(K.dtype, copy=False)
+        self.shape = K.shape
+        self.dtype = K.dtype
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        return self.mask * x + self.K @ (self.weight * (self.K @ x))
+
+    dot = __matmul__
+
+    def _get_sparse_stiffness(self):
+        """ K as a sparse matrix, None if it is only applied element by element """
+        if ssp.issparse(self.K):
+            return self.K
+        if getattr(self.K, "tocsr", None) is not None:
+            return self.K.tocsr()
+        return None
+
+    def tocsr(self) -> ssp.csr_matrix:
+        K = self._get_sparse_stiffness()
+        if K is None:
+            raise ValueError("The regularisation matrix can only be assembled from an assembled stiffness matrix.")
+        return (ssp.diags(self.mask) + K @ ssp.diags(self.weight) @ K).tocsr()
+
+    def diagonal(self) -> np.ndarray:
+        K = self._get_sparse_stiffness()
+        if K is not None:
+            # diag(K W K)_i = K_ik W_k K_ki
+            return self.mask + K.multiply(K.T.tocsr()) @ self.weight
+        # without an assembled matrix only the contribution of the diagonal of K is used (k = i)
+        return self.mask + self.K.diagonal() ** 2 * self.weight
+
+    def block_diagonal(self) -> np.ndarray:
+        mask = self.mask.reshape(-1, 3)[:, :, None] * np.eye(3)
+        K = self._get_sparse_stiffness()
+        if K is not None:
+            K = ssp.csr_matrix(K)
+            K.sort_indices()
+            KT = K.T.tocsr()
+            KT.sort_indices()
+            out = np.zeros((self.shape[0] // 3, 3, 3), dtype=self.dtype)
+            numba_csr_block_diagonal_product(K.indptr, K.indices, K.data, KT.indptr, KT.indices, KT.data,
+                                             self.weight, out)
+            return mask + out
+        # without an assembled matrix only the contribution of the diagonal blocks of K is used
+        blocks = self.K.block_diagonal()
+        return mask + np.einsum("nij,nj,njl->nil", blocks, self.weight.reshape(-1, 3), blocks)
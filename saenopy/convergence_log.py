@@ -0,0 +1,122 @@
+import json
+import time
+import collections
+import numpy as np
+
+
+class ConvergenceLog:
+    """
+    The convergence values of the iterations of a solver. The rows are appended to a file in chunks instead of
+    rewriting the whole history every iteration, and the statistics for the convergence criterion are computed from a
+    ring buffer of the last rows.
+
+    Parameters
+    ----------
+    filename : str, optional
+        The file to write the rows to. The format is chosen by the extension: ".csv" (with a header line), ".npy" (a
+        numpy array, the header is updated on every flush), ".jsonl" (one JSON object per row) and all other
+        extensions as whitespace separated text, like numpy.savetxt.
+    columns : list of str, optional
+        The names of the columns for the csv header and the jsonl keys.
+    window : int, optional
+        The number of the last rows kept for the convergence statistics. Default 5
+    flush_rows : int, optional
+        Write the buffered rows to the file when this many rows have been buffered. Default 10
+    flush_interval : float, optional
+        Write the buffered rows to the file when this many seconds have passed since the last write. Default 5
+
+    Used as a context manager, the remaining rows are written and the file is closed when the context is left, also
+    if an exception is raised.
+    """
+    # the fixed length of the npy header, so that the shape can be updated in place
+    npy_header_length = 128
+
+    def __init__(self, filename: str = None, columns: list = None, window: int = 5, flush_rows: int = 10,
+                 flush_interval: float = 5):
+        self.filename = filename
+        self.columns = columns
+        self.rows = []
+        self.last_rows = collections.deque(maxlen=window)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._file = None
+        self._last_flush = time.time()
+        self._written_rows = 0
+        self.format = None
+        if filename is not None:
+            extension = str(filename).rsplit(".", 1)[-1].lower()
+            self.format = extension if extension in ["csv", "npy", "jsonl"] else "txt"
+
+    def append(self, row):
+        """ add the values of an iteration """
+        self.rows.append(row)
+        self.last_rows.append(row)
+        if self.filename is not None:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.flush_rows or time.time() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def coefficient_of_variation(self, column: int) -> float:
+        """ the standard deviation divided by the mean of a column of the last rows """
+        values = np.array([row[column] for row in self.last_rows])
+        return np.std(values) / np.mean(values)
+
+    def flush(self):
+        """ write the buffered rows to the file """
+        self._last_flush = time.time()
+        if self.filename is None or len(self._buffer) == 0:
+            return
+        if self._file is None:
+            self._open()
+        rows = np.array(self._buffer, dtype=float).reshape(len(self._buffer), -1)
+        self._buffer = []
+
+        if self.format == "npy":
+            self._file.seek(0, 2)
+            self._file.write(rows.astype("<f8").tobytes())
+            self._written_rows += rows.shape[0]
+            self._write_npy_header(rows.shape[1])
+        elif self.format == "jsonl":
+            columns = self.columns or [str(i) for i in range(rows.shape[1])]
+            for row in rows:
+                self._file.write(json.dumps(dict(zip(columns, row.tolist()))) + "\n")
+        else:
+            np.savetxt(self._file, rows, delimiter="," if self.format == "csv" else " ")
+        self._file.flush()
+
+    def _open(self):
+        if self.format == "npy":
+            self._file = open(self.filename, "wb")
+            self._write_npy_header(len(self.columns) if self.columns is not None else 0)
+        else:
+            self._file = open(self.filename, "w")
+            if self.format == "csv" and self.columns is not None:
+                self._file.write(",".join(self.columns) + "\n")
+
+    def _write_npy_header(self, column_count: int):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (self._written_rows, column_count)
+        # magic string, version 1.0, the length of the header dictionary (padded with spaces and ending in a newline)
+        prefix = b"\x93NUMPY\x01\x00"
+        header_length = self.npy_header_length - len(prefix) - 2
+        header = header.ljust(header_length - 1) + "\n"
+        self._file.seek(0)
+        self._file.write(prefix + np.uint16(header_length).astype("<u2").tobytes() + header.encode("latin1"))
+
+    def close(self):
+        """ write the remaining rows and close the file """
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the rows of an interrupted solve are written as well
+        self.close()
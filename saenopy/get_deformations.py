@@ -47,6 +47,29 @@ def get_displacements_from_stacks(stack_relaxed: Stack, stack_deformed: Stack, w
     return piv_mesh
 
 
+def estimate_piv_resources(shape: tuple, voxel_size: tuple, window_size: float, element_size: float) -> dict:
+    """
+    A rough estimate of the peak memory in bytes and the runtime in seconds of get_displacements_from_stacks for two
+    stacks of the given shape (y, x, z in voxels) and voxel size (in μm).
+
+    Returns
+    -------
+    estimate : dict
+        The "memory", the "runtime" and the "field_shape" (the number of windows along each axis).
+    """
+    shape = np.array(shape[:3])
+    window = (window_size / np.array(voxel_size)).astype(int)
+    overlap = ((1 - element_size / window_size) * window).astype(int)
+    field_shape = np.maximum((shape - window) // np.maximum(window - overlap, 1) + 1, 0)
+    # the loaded and the averaged float stacks, the correlation of a window pair is computed with FFTs of twice the
+    # window size
+    fft_size = np.prod(2 * window)
+    memory = 2 * np.prod(shape) * (8 + 4) + 8 * fft_size * 16
+    # about 1e-8 s per FFT point and its logarithm and 1e-4 s for the peak search of each window
+    runtime = np.prod(field_shape) * (1e-8 * fft_size * np.log2(max(fft_size, 2)) + 1e-4)
+    return dict(memory=int(memory), runtime=float(runtime), field_shape=tuple(int(i) for i in field_shape))
+
+
 def sig2noise_filtering(u, v, sig2noise, w=None, threshold=1.3):
     """
     As integrated into OpenPiv Jun 19, 2020.
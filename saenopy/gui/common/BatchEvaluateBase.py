@@ -14,6 +14,7 @@ import traceback
 from saenopy import Result
 from saenopy.gui.common import QtShortCuts
 from saenopy.gui.common.gui_classes import ListWidget
+from saenopy.gui.common.code_export import get_main_code
 from saenopy.gui.spheroid.modules.result import ResultSpheroid
 from saenopy.gui.tfm2d.modules.result import Result2D
 from saenopy.gui.orientation.modules.result import ResultOrientation
@@ -250,7 +251,8 @@ class BatchEvaluateBase(QtWidgets.QWidget):
                 code1, code2 = module.get_code()
                 import_code += code1
                 run_code += code2 +"\n"
-            run_code = import_code + "\n\n" + run_code
+            # the run code is guarded, as the worker processes of the regularisation import the script
+            run_code = get_main_code(import_code, run_code)
             #print(run_code)
             with open(new_path, "w") as fp:
                 fp.write(run_code)
@@ -25,3 +25,10 @@ def get_code(code, data):
         else:
             code = code.replace(key, str(value))
     return code
+
+
+def get_main_code(import_code, run_code):
+    """ the script of the imports and the run code, which only runs when the script is executed (not when it is
+    imported by the worker processes of e.g. solve_regularized_series) """
+    run_code = "\n".join("    " + line if line.strip() else line for line in run_code.split("\n"))
+    return import_code + "\n\nif __name__ == \"__main__\":\n" + run_code
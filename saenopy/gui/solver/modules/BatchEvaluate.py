@@ -50,6 +50,9 @@ class BatchEvaluate(BatchEvaluateBase):
         # self.sub_module_fiber = FiberViewer(self, layout0)
         self.sub_module_export = ExportViewer(self, layout0)
         self.modules = [self.sub_module_initializer, self.sub_module_deformation, self.sub_module_mesh, self.sub_module_regularize]
+        # the resource estimate of the regularizer also depends on the piv and the mesh parameters
+        self.sub_module_regularize.connect_resource_estimate(self.sub_module_deformation.parameter_mappings +
+                                                             self.sub_module_mesh.parameter_mappings)
 
     def path_editor(self):
         result = self.list.data[self.list.currentRow()][2]
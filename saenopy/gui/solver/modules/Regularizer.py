@@ -55,6 +55,12 @@ class Regularizer(PipelineModule):
                         with QtShortCuts.QHBoxLayout(None) as layout:
                             self.input_imax = QtShortCuts.QInputNumber(None, "max iterations", 100, float=False, tooltip="the maximum number of iterations after which to abort the iteration algorithm")
                             self.input_conv_crit = QtShortCuts.QInputString(None, "rel. conv. crit.", 0.01, type=float, tooltip="the convergence criterion of the iteration algorithm")
+                        with QtShortCuts.QHBoxLayout(None) as layout:
+                            self.input_n_workers = QtShortCuts.QInputNumber(None, "parallel time steps", 1, float=False, min=1,
+                                                                            tooltip="the number of time steps that are fitted at the same time in separate processes")
+                            self.input_memory_budget = QtShortCuts.QInputNumber(None, "memory budget", 0, min=0, unit="GB",
+                                                                                tooltip="the memory that the parallel time steps may use together, reduces the number of parallel time steps if needed (0 for no limit)")
+                        self.label = QtWidgets.QLabel().addToLayout()
 
                     self.input_button = QtShortCuts.QPushButton(None, "calculate forces", self.start_process, tooltip="run the force calculation")
 
@@ -75,7 +81,11 @@ class Regularizer(PipelineModule):
             "max_iterations": self.input_imax,
             "rel_conv_crit": self.input_conv_crit,
             "prev_t_as_start": self.input_previous_t_as_start,
+            "n_workers": self.input_n_workers,
+            "memory_budget_gb": self.input_memory_budget,
         })
+        # connected after the parameter mappings, so that the estimate uses the updated parameters
+        self.connect_resource_estimate(self.parameter_mappings)
 
         self.initialize_plot()
         self.iteration_finished.connect(self.iteration_callback)
@@ -87,6 +97,26 @@ class Regularizer(PipelineModule):
         except (AttributeError, IndexError, TypeError):
             return False
 
+    def connect_resource_estimate(self, parameter_mappings):
+        # update the resource estimate when any of the parameters of the mappings changes
+        for mapping in parameter_mappings:
+            for widget in mapping.parameter_dict.values():
+                widget.valueChanged.connect(lambda *args: self.valueChanged())
+
+    def valueChanged(self):
+        # the predicted resources of the pipeline with the current parameters of the modules
+        try:
+            estimate = self.result.estimate_resources(
+                getattr(self.result, "piv_parameters_tmp", None),
+                getattr(self.result, "mesh_parameters_tmp", None),
+                self.result.solve_parameters_tmp)
+        except (AttributeError, KeyError, TypeError, ValueError, OSError):
+            self.label.setText("")
+            return
+        self.label.setText(f"Estimated peak memory {estimate['memory'] / 1e9:.2f} GB and at most "
+                           f"{estimate['runtime'] / 60:.0f} min\nfor {estimate['number_nodes']} nodes and "
+                           f"{estimate['number_tetrahedra']} tetrahedra.")
+
     def initialize_plot(self):
         self.canvas.figure.axes[0].cla()
         self.canvas_text = self.canvas.figure.axes[0].text(0.5, 0.5, "no fit yet", ha="center",
@@ -145,36 +175,36 @@ class Regularizer(PipelineModule):
             result.solvers[0].regularisation_results = result.solver_relrec_demo
             return
 
-        for i in range(len(result.solvers)):
-            self.parent.signal_process_status_update.emit(f"{i + 1}/{len(result.solvers)} fitting forces", f"{Path(result.output).name}")
-
-            print(f"Current Timstep: {i}")
-            M = result.solvers[i]
-
-            if i > 0 and solve_parameters["prev_t_as_start"]:
-                M.mesh.displacements[:] = result.solvers[i-1].mesh.displacements.copy()
-
-            def callback(M, relrec, i, imax):
-                self.iteration_finished.emit(result, relrec, i, imax)
-
-            M.set_material_model(saenopy.materials.SemiAffineFiberMaterial(
-                               material_parameters["k"],
-                               material_parameters["d_0"] if material_parameters["d_0"] != "None" else None,
-                               material_parameters["lambda_s"] if material_parameters["lambda_s"] != "None" else None,
-                               material_parameters["d_s"] if material_parameters["d_s"] != "None" else None,
-                               ))
-
-            M.solve_regularized(step_size=solve_parameters["step_size"], max_iterations=solve_parameters["max_iterations"],
-                                alpha=solve_parameters["alpha"], rel_conv_crit=solve_parameters["rel_conv_crit"],
-                                callback=callback, verbose=True)
+        def callback(M, relrec, i, imax):
+            self.iteration_finished.emit(result, relrec, i, imax)
 
+        finished = []
+        def finished_callback(i, M):
+            finished.append(i)
+            self.parent.signal_process_status_update.emit(f"{len(finished)}/{len(result.solvers)} fitting forces", f"{Path(result.output).name}")
             # clear the cache of the solver
             result.clear_cache(i)
             result.save()
 
+        self.parent.signal_process_status_update.emit(f"0/{len(result.solvers)} fitting forces", f"{Path(result.output).name}")
+        material = saenopy.materials.SemiAffineFiberMaterial(
+                           material_parameters["k"],
+                           material_parameters["d_0"] if material_parameters["d_0"] != "None" else None,
+                           material_parameters["lambda_s"] if material_parameters["lambda_s"] != "None" else None,
+                           material_parameters["d_s"] if material_parameters["d_s"] != "None" else None,
+                           )
+        saenopy.solve_regularized_series(result.solvers, material, n_workers=solve_parameters.get("n_workers", 1),
+                                         memory_budget=(solve_parameters.get("memory_budget_gb") or 0) * 1e9 or None,
+                                         prev_t_as_start=solve_parameters["prev_t_as_start"],
+                                         finished_callback=finished_callback,
+                                         step_size=solve_parameters["step_size"], max_iterations=solve_parameters["max_iterations"],
+                                         alpha=solve_parameters["alpha"], rel_conv_crit=solve_parameters["rel_conv_crit"],
+                                         callback=callback, verbose=True)
+
     def setResult(self, result: Result):
         super().setResult(result)
         self.update_plot()
+        self.valueChanged()
 
     def update_plot(self):
         if self.check_evaluated(self.result):
@@ -199,26 +229,27 @@ class Regularizer(PipelineModule):
             for result in results:
                 result.material_parameters = material_parameters
                 result.solve_parameters = solve_parameters
-                for index, M in enumerate(result.solvers):
-                    # optionally copy the displacement field from the previous time step as a starting value
-                    if index > 0 and solve_parameters["prev_t_as_start"]:
-                        M.mesh.displacements[:] = result.solvers[index - 1].mesh.displacements.copy()
-
-                    # set the material model
-                    M.set_material_model(saenopy.materials.SemiAffineFiberMaterial(
-                        material_parameters["k"],
-                        material_parameters["d_0"],
-                        material_parameters["lambda_s"],
-                        material_parameters["d_s"],
-                    ))
-                    # find the regularized force solution
-                    M.solve_regularized(alpha=solve_parameters["alpha"], step_size=solve_parameters["step_size"],
-                                        max_iterations=solve_parameters["max_iterations"], rel_conv_crit=solve_parameters["rel_conv_crit"],
-                                        verbose=True)
-                    # save the forces
-                    result.save()
+
+                # save the forces after every time step
+                def finished_callback(index, M):
                     # clear the cache of the solver
                     result.clear_cache(index)
+                    result.save()
+
+                # find the regularized force solution of all time steps, with n_workers > 1 the time steps are
+                # solved in parallel processes, which use together at most memory_budget_gb GB (0 for no limit)
+                saenopy.solve_regularized_series(result.solvers, saenopy.materials.SemiAffineFiberMaterial(
+                                                     material_parameters["k"],
+                                                     material_parameters["d_0"],
+                                                     material_parameters["lambda_s"],
+                                                     material_parameters["d_s"],
+                                                 ), n_workers=solve_parameters.get("n_workers", 1),
+                                                 memory_budget=(solve_parameters.get("memory_budget_gb") or 0) * 1e9 or None,
+                                                 prev_t_as_start=solve_parameters["prev_t_as_start"],
+                                                 finished_callback=finished_callback,
+                                                 alpha=solve_parameters["alpha"], step_size=solve_parameters["step_size"],
+                                                 max_iterations=solve_parameters["max_iterations"],
+                                                 rel_conv_crit=solve_parameters["rel_conv_crit"], verbose=True)
 
         # params with convert text Nones to real Nones
         data = {
@@ -1,56 +1,191 @@
+import collections
 import numpy as np
 from numba import njit
-import numba
 from saenopy.saveable import Saveable
+from saenopy.numba_helper import NUMBA_CACHE
 
+# the kinds of look ups that numba_look_up can evaluate
+LOOK_UP_TABLE = 0
+LOOK_UP_SEMI_AFFINE_FIBER = 1
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_semi_affine_fiber(x, k, d_0, lambda_s, d_s, buckling, strain_stiffening):  # pragma: no cover
+    """
+    The energy, force and stiffness of the semi-affine fiber material with the strain x.
+    """
+    if buckling and x < 0:
+        e = np.exp(x / d_0)
+        return k * d_0 ** 2 * e - k * d_0 * x - k * d_0 ** 2, k * d_0 * e - d_0 * k, k * e
+    if strain_stiffening and x >= lambda_s:
+        e = np.exp((x - lambda_s) / d_s)
+        d2k = d_s * d_s * k
+        return (- 0.5 * lambda_s ** 2 * k + d_s * k * lambda_s - d2k + d2k * e - d_s * k * x + lambda_s * k * x,
+                k * lambda_s - d_s * k + d_s * k * e,
+                k * e)
+    return 0.5 * k * x ** 2, k * x, k
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_look_up(x, kind, parameters, table):  # pragma: no cover
+    """
+    The energy, force and stiffness of a fiber with the strain x. For a LOOK_UP_TABLE the parameters are
+    (min, max, step) of the table with the rows (energy, force, stiffness). For LOOK_UP_SEMI_AFFINE_FIBER the
+    parameters are (k, d_0, lambda_s, d_s, buckling, strain_stiffening, min, max, maximal_value). The strain is
+    clamped to [min, max] and the stiffness is capped at maximal_value, the energy and the force are the integrals of
+    the capped stiffness. With the range (-inf, inf) and maximal_value inf, the material is evaluated without limits.
+    """
+    if kind == LOOK_UP_SEMI_AFFINE_FIBER:
+        k = parameters[0]
+        d_0 = parameters[1]
+        lambda_s = parameters[2]
+        d_s = parameters[3]
+        buckling = parameters[4] != 0
+        strain_stiffening = parameters[5] != 0
+        maximal_value = parameters[8]
+
+        # if we are at the border of the range of the table, we stick to the end
+        if x < parameters[6]:
+            x = parameters[6]
+        elif x > parameters[7]:
+            x = parameters[7]
+
+        # above the strain where the stiffening reaches the maximal value, the stiffness stays constant
+        if strain_stiffening and k < maximal_value < np.inf:
+            x_cap = lambda_s + d_s * np.log(maximal_value / k)
+            if x > x_cap:
+                energy, force, stiffness = numba_semi_affine_fiber(x_cap, k, d_0, lambda_s, d_s, buckling,
+                                                                   strain_stiffening)
+                d = x - x_cap
+                return energy + force * d + maximal_value * d ** 2 / 2, force + maximal_value * d, maximal_value
+        return numba_semi_affine_fiber(x, k, d_0, lambda_s, d_s, buckling, strain_stiffening)
+
+    # we now have to pass this though the non-linearity function w (material model)
+    # the stiffness has been discretized and is interpolated linearly between these discretisation steps, the force
+    # and the energy are the exact integrals of this interpolation
+    x_min = parameters[0]
+    x_max = parameters[1]
+    step = parameters[2]
+
+    # if we are at the border of the discretisation, we stick to the end
+    if x < x_min:
+        x = x_min
+    elif x > x_max:
+        x = x_max
+
+    # the discretisation step and the distance to it
+    li = int((x - x_min) / step)
+    if li > table.shape[1] - 2:
+        li = table.shape[1] - 2
+    d = x - (x_min + li * step)
+
+    # the slope of the stiffness in this discretisation step
+    y = table[2, li]
+    dy = (table[2, li + 1] - y) / step
+
+    return (table[0, li] + table[1, li] * d + y * d ** 2 / 2 + dy * d ** 3 / 6,
+            table[1, li] + y * d + dy * d ** 2 / 2,
+            y + dy * d)
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_look_up_array(x, kind, parameters, table):  # pragma: no cover
+    """
+    The energy, force and stiffness for an array of strains, see numba_look_up.
+    """
+    shape = x.shape
+    x = x.flatten()
+    energy = np.empty_like(x)
+    force = np.empty_like(x)
+    stiff = np.empty_like(x)
+    for i in range(x.shape[0]):
+        energy[i], force[i], stiff[i] = numba_look_up(x[i], kind, parameters, table)
+    return energy.reshape(shape), force.reshape(shape), stiff.reshape(shape)
 
-def sample_and_integrate_function(func, min, max, step, zero_point=0, maximal_value=10e10):
-    def xToI(x):
-        return np.ceil((x - min) / step).astype(int)
 
-    x = np.arange(min, max, step)
-    y = func(x)
+def integrate_function(func, min, max, step, zero_point=0, maximal_value=10e10):
+    """
+    Sample the stiffness function and integrate its linear interpolation twice to obtain the parameters and the table
+    with the rows (energy, force, stiffness) for a LOOK_UP_TABLE.
+    """
+    # the discretisation steps start from the zero point
+    n_below = int(np.ceil((zero_point - min) / step))
+    x = zero_point + np.arange(-n_below, int(np.ceil((max - zero_point) / step)) + 1) * step
+    y = np.array(func(x), dtype=np.float64)
 
     if maximal_value is not None:
         y[y > maximal_value] = maximal_value
 
     # integrate
-    int_y = np.cumsum(y * step)
-    int_y -= int_y[xToI(zero_point)]
+    dy = np.diff(y)
+    int_y = np.zeros_like(y)
+    np.cumsum((y[:-1] + dy / 2) * step, out=int_y[1:])
 
     # integrate again
-    int_int_y = np.cumsum(int_y * step)
-    int_int_y -= int_int_y[xToI(zero_point)]
+    int_int_y = np.zeros_like(y)
+    np.cumsum(int_y[:-1] * step + y[:-1] * step ** 2 / 2 + dy * step ** 2 / 6, out=int_int_y[1:])
 
-    @njit()
-    def look_up_y(x):
-        shape = x.shape
-        x = x.flatten()
-        # we now have to pass this though the non-linearity function w (material model)
-        # this function has been discretized and we interpolate between these discretisation steps
+    # the energy and the force vanish at the zero point
+    parameters = np.array([x[0], x[-1], step], dtype=np.float64)
+    table = np.array([int_int_y, int_y, y])
+    energy_zero, force_zero, _ = numba_look_up(zero_point, LOOK_UP_TABLE, parameters, table)
+    table[0] -= energy_zero + force_zero * (x - zero_point)
+    table[1] -= force_zero
 
-        # the discretisation step
-        li = np.floor((x - min) / step)
+    return parameters, table
 
-        # the part between the two steps
-        dli = (x - min) / step - li
 
-        # if we are at the border of the discretisation, we stick to the end
-        max_index = li > ((max - min) / step) - 2
-        li[max_index] = int(((max - min) / step) - 2)
-        dli[max_index] = 0
+def integrate_function_adaptive(func, min, max, min_step, tolerance, zero_point=0, maximal_value=10e10):
+    """
+    Like integrate_function, but with the largest step (down to min_step) for which the linear interpolation of the
+    stiffness deviates from the function by at most tolerance (relative to the stiffness, but at least relative to the
+    stiffness at the zero point). As the force and the energy are integrals of the interpolation, their relative error
+    is bounded by the same tolerance.
+    """
+    def sample(x):
+        y = np.array(func(x), dtype=np.float64)
+        if maximal_value is not None:
+            y[y > maximal_value] = maximal_value
+        return y
+
+    scale_zero = np.abs(sample(np.array([zero_point], dtype=np.float64))[0])
+    # start with about 1000 steps, powers of two keep the discretisation steps at round numbers
+    step = 2.0 ** np.floor(np.log2((max - min) / 1024))
+    while step / 2 >= min_step:
+        # compare the interpolation with the function in the middle of every discretisation step
+        x = zero_point + np.arange(-int(np.ceil((zero_point - min) / step)),
+                                   int(np.ceil((max - zero_point) / step)) + 1) * step
+        y = sample(x)
+        y_mid = sample(x[:-1] + step / 2)
+        error = np.abs((y[:-1] + y[1:]) / 2 - y_mid)
+        # the steps where the stiffness reaches the maximal value are not refined
+        if maximal_value is not None:
+            error[(y[:-1] >= maximal_value) | (y[1:] >= maximal_value)] = 0
+        if np.all(error <= tolerance * np.maximum(np.abs(y_mid), scale_zero)):
+            break
+        step /= 2
+
+    return integrate_function(func, min, max, step, zero_point, maximal_value)
+
+
+def make_look_up_function(kind, parameters, table):
+    """
+    A numba function that returns the energy, force and stiffness for an array of strains.
+    """
+    @njit()
+    def look_up(x):
+        return numba_look_up_array(x, kind, parameters, table)
+
+    return look_up
 
-        # convert now to int after fixing the maximum
-        lii = li.astype(np.int64)
 
-        # interpolate between the two discretisation steps
-        res0 = (1 - dli) * int_int_y[lii] + dli * int_int_y[lii + 1]
-        res1 = (1 - dli) * int_y[lii] + dli * int_y[lii + 1]
-        res2 = (1 - dli) * y[lii] + dli * y[lii + 1]
+def sample_and_integrate_function(func, min, max, step, zero_point=0, maximal_value=10e10):
+    return make_look_up_function(LOOK_UP_TABLE, *integrate_function(func, min, max, step, zero_point, maximal_value))
 
-        return res0.reshape(shape), res1.reshape(shape), res2.reshape(shape)
 
-    return look_up_y
+# the most recently used look up tables of the materials
+_look_up_cache = collections.OrderedDict()
+look_up_cache_size = 32
 
 
 class Material:
@@ -60,7 +195,9 @@ class Material:
     parameters = {}
     min = -1.0
     max = 4.0
-    step = 0.000001
+    step = 0.000001  # the smallest step of the look up table
+    tolerance = 0.0001  # the maximal relative error of the look up table
+    maximal_value = 10e10  # the stiffness is capped at this value
 
     def stiffness(self, s):
         # to be overloaded by a material implementation
@@ -74,8 +211,32 @@ class Material:
         # to be overloaded by a material implementation
         raise NotImplementedError
 
+    def generate_look_up_parameters(self):
+        """
+        The arguments (kind, parameters, table) for numba_look_up. The solver kernels take these as arguments, so
+        that they are compiled only once for all materials.
+        """
+        # materials with the same parameters share the table, materials without parameters cannot be told apart
+        key = None
+        if self.parameters:
+            key = (type(self), str(sorted(self.parameters.items())), self.min, self.max, self.step, self.tolerance,
+                   self.maximal_value)
+        if key in _look_up_cache:
+            _look_up_cache.move_to_end(key)
+            return _look_up_cache[key]
+
+        parameters, table = integrate_function_adaptive(self.stiffness, self.min, self.max, self.step, self.tolerance,
+                                                        maximal_value=self.maximal_value)
+        look_up = (LOOK_UP_TABLE, parameters, table)
+
+        if key is not None:
+            _look_up_cache[key] = look_up
+            if len(_look_up_cache) > look_up_cache_size:
+                _look_up_cache.popitem(last=False)
+        return look_up
+
     def generate_look_up_table(self):
-        return sample_and_integrate_function(self.stiffness, self.min, self.max, self.step)
+        return make_look_up_function(*self.generate_look_up_parameters())
 
     def __str__(self):
         return self.__class__.__name__+"("+", ".join(key+"="+str(value) for key, value in self.parameters.items())+")"
@@ -105,6 +266,9 @@ class SemiAffineFiberMaterial(Material, Saveable):
     d_0: float = None
     lambda_s: float = None
     d_s: float = None
+    # whether the analytic evaluation clamps the strain to [min, max] and caps the stiffness at maximal_value like a
+    # look up table, by default the material is evaluated without limits
+    limit_like_table: bool = False
 
     def __init__(self, k, d_0=None, lambda_s=None, d_s=None):
         super().__init__()
@@ -210,121 +374,18 @@ class SemiAffineFiberMaterial(Material, Saveable):
         # return the resulting energy
         return y.reshape(x0.shape)
 
-    def generate_look_up_table(self):
-        d_0 = self.d_0
-        lambda_s = self.lambda_s
-        d_s = self.d_s
-        k = self.k
-
+    def generate_look_up_parameters(self):
         buckling = self.d_0 is not None
         strain_stiffening = (self.lambda_s is not None and self.d_s is not None)
-
-        # no buckling but strain stiffening
-        if not buckling and strain_stiffening:
-            @njit(numba.core.types.containers.UniTuple(numba.float64[:, :], 3)(numba.float64[:, :]))
-            def get_all(s):
-                shape = s.shape
-                s = s.flatten()
-
-                stiff = np.zeros_like(s)
-                force = np.zeros_like(s)
-                energy = np.zeros_like(s)
-
-                dk = d_s * k
-                sk = lambda_s * k
-                d2k = d_s * dk
-
-                for i, x in enumerate(s):
-                    if x < lambda_s:
-                        stiff[i] = k
-                        force[i] = k * x
-                        energy[i] = 0.5 * k * x ** 2
-                    else:
-                        stiff[i] = k * np.exp((x - lambda_s) / d_s)
-                        force[i] = k * lambda_s - d_s * k + d_s * k * np.exp((x - lambda_s) / d_s)
-                        energy[i] = - 0.5 * lambda_s ** 2 * k + d_s * k * lambda_s - d2k + d2k * np.exp(
-                            (x - lambda_s) / d_s) - dk * x + sk * x
-
-                return energy.reshape(shape), force.reshape(shape), stiff.reshape(shape)
-
-            return get_all
-
-        # buckling but no strain stiffening
-        if buckling and not strain_stiffening:
-            @njit(numba.core.types.containers.UniTuple(numba.float64[:, :], 3)(numba.float64[:, :]))
-            def get_all(s):
-                shape = s.shape
-                s = s.flatten()
-
-                stiff = np.zeros_like(s)
-                force = np.zeros_like(s)
-                energy = np.zeros_like(s)
-
-                for i, x in enumerate(s):
-                    if x < 0:
-                        stiff[i] = k * np.exp(x / d_0)
-                        force[i] = k * d_0 * np.exp(x / d_0) - d_0 * k
-                        energy[i] = k * d_0 ** 2 * np.exp(x / d_0) - k * d_0 * x - k * d_0 ** 2
-                    else:
-                        stiff[i] = k
-                        force[i] = k * x
-                        energy[i] = 0.5 * k * x ** 2
-
-                return energy.reshape(shape), force.reshape(shape), stiff.reshape(shape)
-
-            return get_all
-
-        # no buckling and no strain stiffening
-        if not buckling and not strain_stiffening:
-            @njit(numba.core.types.containers.UniTuple(numba.float64[:, :], 3)(numba.float64[:, :]))
-            def get_all(s):
-                shape = s.shape
-                s = s.flatten()
-
-                stiff = np.zeros_like(s)
-                force = np.zeros_like(s)
-                energy = np.zeros_like(s)
-
-                for i, x in enumerate(s):
-                    stiff[i] = k
-                    force[i] = k * x
-                    energy[i] = 0.5 * k * x ** 2
-
-                return energy.reshape(shape), force.reshape(shape), stiff.reshape(shape)
-
-            return get_all
-
-        @njit(numba.core.types.containers.UniTuple(numba.float64[:, :], 3)(numba.float64[:, :]))
-        def get_all(s):
-            shape = s.shape
-            s = s.flatten()
-
-            stiff = np.zeros_like(s)
-            force = np.zeros_like(s)
-            energy = np.zeros_like(s)
-
-            dk = d_s * k
-            sk = lambda_s * k
-            d2k = d_s * dk
-
-            for i, x in enumerate(s):
-                if x < 0:
-                    stiff[i] = k * np.exp(x / d_0)
-                    force[i] = k * d_0 * np.exp(x / d_0) - d_0 * k
-                    energy[i] = k * d_0 ** 2 * np.exp(x / d_0) - k * d_0 * x - k * d_0 ** 2
-                elif x < lambda_s:
-                    stiff[i] = k
-                    force[i] = k * x
-                    energy[i] = 0.5 * k * x ** 2
-                else:
-                    stiff[i] = k * np.exp((x - lambda_s) / d_s)
-                    force[i] = k * lambda_s - d_s * k + d_s * k * np.exp((x - lambda_s) / d_s)
-                    energy[i] = - 0.5 * lambda_s ** 2 * k + d_s * k * lambda_s - d2k + d2k * np.exp(
-                        (x - lambda_s) / d_s) - dk * x + sk * x
-
-            return energy.reshape(shape), force.reshape(shape), stiff.reshape(shape)
-
-        return get_all
+        if self.limit_like_table:
+            limits = [self.min, self.max, self.maximal_value]
+        else:
+            limits = [-np.inf, np.inf, np.inf]
+        parameters = np.array([self.k, self.d_0 if buckling else 0, self.lambda_s if strain_stiffening else 0,
+                               self.d_s if strain_stiffening else 0, buckling, strain_stiffening, *limits],
+                              dtype=np.float64)
+        # the material is evaluated analytically and does not need a table
+        return LOOK_UP_SEMI_AFFINE_FIBER, parameters, np.zeros((3, 0))
 
 
 class LinearMaterial(Material):
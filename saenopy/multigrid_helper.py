@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import time
 from numba import njit
+from saenopy.numba_helper import NUMBA_CACHE
 #from nptyping import NDArray, Shape, Float, Int, Bool
 
 
@@ -19,7 +20,7 @@ def create_box_mesh(x, y=None, z=None, tesselation_mode="6"):
 
 
 
-@njit()
+@njit(cache=NUMBA_CACHE)
 def make_box_mesh_tets(nx, ny=None, nz=None, grain=1, tesselation_mode="6"):  # pragma: no cover
     if ny is None:
         ny = nx
@@ -103,6 +104,67 @@ def get_nodes_with_one_face(tetrahedra):
     return np.unique(np.array([single_faces % maxi, (single_faces // maxi) % maxi, (single_faces // maxi ** 2) % maxi]))
 
 
+def _spread_bits(x):
+    # insert two zero bits between the lowest 21 bits of x
+    x = x.astype(np.uint64) & np.uint64(0x1fffff)
+    for shift, mask in [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)]:
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def get_node_order(nodes, tetrahedra, method="rcm"):
+    """
+    A permutation of the nodes that places connected nodes close to each other in memory. Returns the old index of
+    each new node.
+
+    Parameters
+    ----------
+    nodes : ndarray
+        The coordinates of the nodes. Dimensions N_c x 3
+    tetrahedra : ndarray
+        The node indices of the 4 corners of the tetrahedra. Dimensions N_t x 4
+    method : str, optional
+        "rcm" (reverse Cuthill-McKee, reduces the bandwidth of the stiffness matrix) or "morton" (the nodes sorted
+        along a z-order space-filling curve through their coordinates). Default "rcm"
+    """
+    if method == "rcm":
+        import scipy.sparse as ssp
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+        pairs = tetrahedra[:, [[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3]]].reshape(-1, 2)
+        graph = ssp.coo_matrix((np.ones(pairs.shape[0], dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                               shape=(nodes.shape[0], nodes.shape[0])).tocsr()
+        return reverse_cuthill_mckee(graph, symmetric_mode=False).astype(np.int64)
+    if method == "morton":
+        # quantize the coordinates to 21 bits per axis and interleave the bits
+        minimum = np.min(nodes, axis=0)
+        extent = np.max(np.max(nodes, axis=0) - minimum)
+        scaled = ((nodes - minimum) / (extent if extent > 0 else 1) * (2 ** 21 - 1)).astype(np.uint64)
+        code = _spread_bits(scaled[:, 0]) | (_spread_bits(scaled[:, 1]) << np.uint64(1)) | \
+            (_spread_bits(scaled[:, 2]) << np.uint64(2))
+        return np.argsort(code, kind="stable")
+    raise ValueError(f"Unknown node order method '{method}', use 'rcm' or 'morton'.")
+
+
+def get_subdomains(nodes, count):
+    """
+    Partition the nodes into compact subdomains of about the same size by cutting the z-order curve of the node
+    coordinates into count pieces. Returns the subdomain of each node.
+
+    Parameters
+    ----------
+    nodes : ndarray
+        The coordinates of the nodes. Dimensions N_c x 3
+    count : int
+        The number of subdomains.
+    """
+    count = int(max(1, min(count, nodes.shape[0])))
+    order = get_node_order(nodes, None, "morton")
+    labels = np.empty(nodes.shape[0], dtype=np.int64)
+    labels[order] = np.arange(nodes.shape[0]) * count // max(nodes.shape[0], 1)
+    return labels
+
+
 def get_scaling(voxel_in, size_in, size_out, center, a):
     old_settings = np.seterr(all='ignore')  # seterr to known value
 
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The numba kernels are compiled once and the machine code is stored on disk (next to the source files or in the
+# directory given by the environment variable NUMBA_CACHE_DIR), so that new processes do not need to compile them
+# again. Frozen executables have no source files the cache could be keyed on and always compile at runtime. Setting
+# the environment variable SAENOPY_NUMBA_CACHE=0 disables the cache. Note that numba only checks the source file of a
+# kernel itself, when editing a function that is called by kernels of other files, delete the *.nbi/*.nbc files.
+NUMBA_CACHE = not getattr(sys, "frozen", False) and os.environ.get("SAENOPY_NUMBA_CACHE", "1") != "0"
@@ -4,6 +4,7 @@ from pathlib import Path
 from pathlib import PurePath, PureWindowsPath
 import os
 import natsort
+import numpy as np
 from typing import List, Union
 import tifffile
 from PIL import Image
@@ -292,7 +293,11 @@ class MaterialParametersDict(TypedDict):
     lambda_s: float
     d_s: float
 
-class SolveParametersDict(TypedDict):
+class SolveParallelParametersDict(TypedDict, total=False):
+    n_workers: int
+    memory_budget_gb: float
+
+class SolveParametersDict(SolveParallelParametersDict):
     alpha: float
     step_size: float
     max_iterations: int
@@ -607,6 +612,68 @@ class Result(Saveable):
         text += ")" + "\n"
         return text
 
+    def estimate_resources(self, piv_parameters: PivParametersDict = None, mesh_parameters: MeshParametersDict = None,
+                           solve_parameters: SolveParametersDict = None) -> dict:
+        """
+        A rough estimate of the peak memory in bytes and the runtime in seconds of the pipeline (the deformation
+        detection, the mesh interpolation and the regularisation of all time points), computed from the stack shape
+        and the parameters, before anything is computed. Parameters that are not given are taken from the result.
+
+        Returns
+        -------
+        estimate : dict
+            The estimates of one time point for the "piv" (see
+            :py:func:`~.get_deformations.estimate_piv_resources`) and the "solver" (see
+            :py:func:`~.solver.estimate_solver_resources`), the "number_nodes" and "number_tetrahedra" of the mesh, the
+            peak "memory" (of the parallel workers of the regularisation) and the total "runtime".
+        """
+        import numba
+        from saenopy.solver import estimate_solver_resources
+        from saenopy.get_deformations import estimate_piv_resources
+        from saenopy.multigrid_helper import get_scaling
+
+        piv_parameters = piv_parameters or self.piv_parameters
+        mesh_parameters = mesh_parameters or self.mesh_parameters
+        solve_parameters = dict(solve_parameters or self.solve_parameters or {})
+        if not self.stacks or piv_parameters is None or mesh_parameters is None:
+            raise ValueError("The stacks and the piv and mesh parameters are needed to estimate the resources.")
+        count = len(self.mesh_piv)
+        shape = np.array(self.stacks[0].shape[:3])
+        voxel_size = np.array(self.stacks[0].voxel_size)
+
+        piv = estimate_piv_resources(shape, voxel_size, piv_parameters["window_size"], piv_parameters["element_size"])
+
+        # the piv mesh spans the stack without the last window step
+        if mesh_parameters["mesh_size"] == "piv":
+            field_shape = np.maximum(piv["field_shape"], 1)
+            mesh_size = (field_shape - 1) / field_shape * shape * voxel_size
+        else:
+            mesh_size = np.array(mesh_parameters["mesh_size"])
+        element_size = mesh_parameters["element_size"]
+        counts = [len(get_scaling(element_size * 1e-6, mesh_parameters.get("inner_region", mesh_size[0]) * 1e-6,
+                                  size * 1e-6 / 2, 0, mesh_parameters.get("thinning_factor", 0)))
+                  for size in mesh_size]
+        number_nodes = int(np.prod(counts))
+        number_tetrahedra = int(6 * np.prod(np.array(counts) - 1))
+
+        # the regularisation of the time points is split over the workers, which share the cores
+        n_workers = solve_parameters.pop("n_workers", 1) or os.cpu_count() or 1
+        n_workers = max(1, min(n_workers, count))
+        # the memory budget (in GB, 0 for no limit) of all workers together reduces the number of workers (see
+        # solve_regularized_series)
+        memory_budget = (solve_parameters.pop("memory_budget_gb", 0) or 0) * 1e9
+        if memory_budget:
+            memory = estimate_solver_resources(number_nodes, number_tetrahedra, **solve_parameters)["memory"]
+            n_workers = max(1, min(n_workers, int(memory_budget // memory)))
+        num_threads = max(1, numba.config.NUMBA_NUM_THREADS // n_workers)
+        solver = estimate_solver_resources(number_nodes, number_tetrahedra, num_threads=num_threads,
+                                           **solve_parameters)
+
+        memory = max(piv["memory"], n_workers * solver["memory"])
+        runtime = count * piv["runtime"] + int(np.ceil(count / n_workers)) * solver["runtime"]
+        return dict(piv=piv, solver=solver, number_nodes=number_nodes, number_tetrahedra=number_tetrahedra,
+                    memory=int(memory), runtime=float(runtime))
+
     def get_data_structure(self):
         return {
             "dimensions": 3,
@@ -1,22 +1,524 @@
 import sys
 import time
+import hashlib
+import weakref
+import contextlib
+import collections
 
 import numpy as np
 import scipy.sparse as ssp
 
-from numba import njit
+from numba import njit, prange
+from saenopy.numba_helper import NUMBA_CACHE
 #from pyfields import field
 from typing import Union, TypedDict, Tuple
 #from nptyping import NDArray, Shape, Float, Int, Bool
 
-from saenopy.build_beams import build_beams
-from saenopy.materials import Material, SemiAffineFiberMaterial
-from saenopy.conjugate_gradient import cg
+from saenopy.build_beams import build_beams, build_beam_set
+from saenopy.multigrid_helper import create_box_mesh, get_node_order, get_subdomains
+from saenopy.materials import Material, SemiAffineFiberMaterial, numba_look_up
+from saenopy.conjugate_gradient import cg, get_preconditioner, solve_direct, get_element_partition, \
+    ElementStiffnessOperator, RegularizationOperator, SymmetricStiffnessOperator, SubdomainStiffnessOperator
+from saenopy.solver_profiler import SolverProfiler
+from saenopy.convergence_log import ConvergenceLog
 from saenopy.mesh import Mesh, check_tetrahedra_scalar_field, check_node_scalar_field, \
     check_node_vector_field
 from saenopy.saveable import Saveable
 from typing import List
 
+# current scipy versions do not have the sputils anymore
+try:
+    from scipy.sparse._sputils import get_index_dtype
+except ImportError:
+    from scipy.sparse.sputils import get_index_dtype
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def numba_update_glo_f_and_k(look_up_kind, look_up_parameters, look_up_table, displacements, tetrahedra, active,
+                             Phi, volume, s, beam_weights, block_offset, energy, f_glo, K_data,
+                             symmetric):  # pragma: no cover
+    """
+    Fused assembly of the energy, the nodal forces and the stiffness blocks of the tetrahedra with the indices active.
+    The forces are written to f_glo (N_a x 4 x 3) and the stiffness blocks of the rows of movable nodes to K_data at
+    the positions given by block_offset (N_a x 4, -1 for rows of fixed nodes). If symmetric, only the upper triangles
+    of the 10 unique blocks of each tetrahedron are written to K_data (60 values per tetrahedron, the pairs of corners
+    in the order of numba_get_symmetric_pair_coordinates). The material is evaluated with numba_look_up, see
+    Material.generate_look_up_parameters. The beams s are averaged with the beam_weights (summing to 1).
+    """
+    N_a = active.shape[0]
+    N_b = s.shape[0]
+    # the indices of the upper triangle of a symmetric 3x3 matrix
+    upper_i = np.array([0, 0, 0, 1, 1, 2])
+    upper_l = np.array([0, 1, 2, 1, 2, 2])
+    upper_index = np.array([[0, 1, 2], [1, 3, 4], [2, 4, 5]])
+    chunk_size = 256
+    for chunk in prange((N_a + chunk_size - 1) // chunk_size):
+        # scratch memory for one tetrahedron
+        F = np.empty((3, 3))
+        s_bar = np.empty((3, N_b))
+        s_star = np.empty((4, N_b))
+        s_norm = np.empty(N_b)
+        epsilon_b = np.empty(N_b)
+        epsbar_b = np.empty(N_b)
+        epsbarbar_b = np.empty(N_b)
+        M = np.empty(6)
+        K = np.empty((4, 4, 6))
+        for a in range(chunk * chunk_size, min((chunk + 1) * chunk_size, N_a)):
+            t = active[a]
+            tet = tetrahedra[t]
+            # F_ij = d_ij + u_mi * Phi_mj
+            for i in range(3):
+                for j in range(3):
+                    value = 1.0 if i == j else 0.0
+                    for m in range(4):
+                        value += displacements[tet[m], i] * Phi[t, m, j]
+                    F[i, j] = value
+
+            for b in range(N_b):
+                # s'_ib = F_ij * s_bj
+                for i in range(3):
+                    s_bar[i, b] = F[i, 0] * s[b, 0] + F[i, 1] * s[b, 1] + F[i, 2] * s[b, 2]
+                # s*_mb = Phi_mj * s_bj
+                for m in range(4):
+                    s_star[m, b] = Phi[t, m, 0] * s[b, 0] + Phi[t, m, 1] * s[b, 1] + Phi[t, m, 2] * s[b, 2]
+                # s_b = |s'_ib|
+                s_norm[b] = np.sqrt(s_bar[0, b] ** 2 + s_bar[1, b] ** 2 + s_bar[2, b] ** 2)
+                # the energy and its derivatives of the strain of the beam
+                epsilon_b[b], epsbar_b[b], epsbarbar_b[b] = numba_look_up(s_norm[b] - 1, look_up_kind,
+                                                                          look_up_parameters, look_up_table)
+
+            E = 0.0
+            for m in range(4):
+                for i in range(3):
+                    f_glo[a, m, i] = 0
+            K[:] = 0
+            for b in range(N_b):
+                sb = s_norm[b]
+                E += epsilon_b[b] * beam_weights[b]
+                V_w = volume[t] * beam_weights[b]
+
+                #                eps'_tb
+                # dEdsbar_tb = - ------- * w_b * V_t
+                #                 s_tb
+                dEdsbar = - (epsbar_b[b] / sb) * V_w
+                #                  s_tb * eps''_tb - eps'_tb
+                # dEdsbarbar_tb = --------------------------- * w_b * V_t
+                #                         s_tb**3
+                dEdsbarbar = ((sb * epsbarbar_b[b] - epsbar_b[b]) / (sb ** 3)) * V_w
+
+                # f_tmi = s*_tmb * s'_tib * dEds'_tb
+                for m in range(4):
+                    for i in range(3):
+                        f_glo[a, m, i] += s_star[m, b] * s_bar[i, b] * dEdsbar
+
+                # K_tmril = s*_tmb * s*_trb * 0.5 * (dEdsbarbar_tb * s'_tib * s'_tlb - delta_il * dEdsbar_tb)
+                # the part in the parentheses is symmetric in i and l, only the upper triangle is accumulated, and
+                # the blocks are symmetric in m and r, only the blocks with m <= r are accumulated
+                for k in range(6):
+                    M[k] = 0.5 * dEdsbarbar * s_bar[upper_i[k], b] * s_bar[upper_l[k], b]
+                M[0] -= 0.5 * dEdsbar
+                M[3] -= 0.5 * dEdsbar
+                M[5] -= 0.5 * dEdsbar
+                for m in range(4):
+                    for r in range(m, 4):
+                        w = s_star[m, b] * s_star[r, b]
+                        for k in range(6):
+                            K[m, r, k] += w * M[k]
+
+            # E_t = eps_tb * w_b * V_t
+            energy[t] = E * volume[t]
+
+            if symmetric:
+                # write the upper triangles of the blocks with m <= r
+                index = a * 60
+                for m in range(4):
+                    for r in range(m, 4):
+                        for k in range(6):
+                            K_data[index] = K[m, r, k]
+                            index += 1
+                continue
+
+            # write the blocks of the movable rows
+            for m in range(4):
+                offset = block_offset[a, m]
+                if offset < 0:
+                    continue
+                index = offset
+                for r in range(4):
+                    for i in range(3):
+                        for l in range(3):
+                            K_data[index] = K[min(m, r), max(m, r), upper_index[i, l]]
+                            index += 1
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def numba_gather_sum(values, indptr, order, out):  # pragma: no cover
+    """
+    Sum the values into out, out[i] is the sum of values[order[indptr[i]:indptr[i+1]]].
+    """
+    for i in prange(out.shape[0]):
+        total = 0.0
+        for j in range(indptr[i], indptr[i + 1]):
+            total += values[order[j]]
+        out[i] = total
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_get_block_offset(T, var):  # pragma: no cover
+    """
+    The start of the 4x3x3 block of each tetrahedron corner in the list of block values (-1 for fixed nodes).
+    """
+    block_offset = -np.ones((T.shape[0], 4), dtype=np.int64)
+    count = 0
+    for t in range(T.shape[0]):
+        for t1 in range(4):
+            if var[T[t, t1]]:
+                block_offset[t, t1] = count
+                count += 4 * 3 * 3
+    return block_offset, count
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_get_pair_coordinates(T, block_offset, count):  # pragma: no cover
+    """
+    The row and column in K_glo of every value of the stiffness blocks.
+    """
+    rows = np.empty(count, dtype=np.int64)
+    cols = np.empty(count, dtype=np.int64)
+    # iterate over all tetrahedra
+    for t in range(T.shape[0]):
+        tet = T[t]
+        # over all corners
+        for t1 in range(4):
+            c1 = tet[t1]
+
+            if block_offset[t, t1] < 0:
+                continue
+
+            index = block_offset[t, t1]
+            for t2 in range(4):
+                # get two vertices of the tetrahedron
+                c2 = tet[t2]
+
+                for i in range(3):
+                    for j in range(3):
+                        # add the connection to the set
+                        rows[index] = c1*3+i
+                        cols[index] = c2*3+j
+                        index += 1
+    return rows, cols
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_get_symmetric_pair_coordinates(T, movable):  # pragma: no cover
+    """
+    The row and column in the upper block triangle of K_glo (the 3x3 node blocks with row node <= column node) and
+    the index in the symmetric block values of every entry of the stiffness blocks of the tetrahedra. Only blocks with
+    at least one movable node are used.
+    """
+    upper_index = np.array([[0, 1, 2], [1, 3, 4], [2, 4, 5]])
+    # count the entries
+    count = 0
+    for t in range(T.shape[0]):
+        for m in range(4):
+            for r in range(m, 4):
+                if movable[T[t, m]] or movable[T[t, r]]:
+                    count += 9
+    rows = np.empty(count, dtype=np.int64)
+    cols = np.empty(count, dtype=np.int64)
+    values = np.empty(count, dtype=np.int64)
+    index = 0
+    for t in range(T.shape[0]):
+        pair = 0
+        for m in range(4):
+            for r in range(m, 4):
+                c1 = min(T[t, m], T[t, r])
+                c2 = max(T[t, m], T[t, r])
+                if movable[c1] or movable[c2]:
+                    for i in range(3):
+                        for l in range(3):
+                            rows[index] = c1 * 3 + i
+                            cols[index] = c2 * 3 + l
+                            values[index] = t * 60 + pair * 6 + upper_index[i, l]
+                            index += 1
+                pair += 1
+    return rows, cols, values
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_get_node_pattern(T, number_nodes, movable, upper):  # pragma: no cover
+    """
+    The sorted neighbours (including itself) of every node that share a tetrahedron with it, as CSR arrays. Fixed
+    nodes have no neighbours, or if upper, only the neighbours with a larger or equal index where one of both nodes
+    is movable.
+    """
+    # the tetrahedra of each node
+    tet_indptr = np.zeros(number_nodes + 1, dtype=np.int64)
+    for t in range(T.shape[0]):
+        for m in range(4):
+            tet_indptr[T[t, m] + 1] += 1
+    tet_indptr = np.cumsum(tet_indptr)
+    tet_list = np.empty(tet_indptr[-1], dtype=np.int64)
+    fill = tet_indptr[:-1].copy()
+    for t in range(T.shape[0]):
+        for m in range(4):
+            tet_list[fill[T[t, m]]] = t
+            fill[T[t, m]] += 1
+
+    # count and then collect the neighbours, marker stores the last node that a neighbour was added to
+    marker = -np.ones(number_nodes, dtype=np.int64)
+    indptr = np.zeros(number_nodes + 1, dtype=np.int64)
+    for n in range(number_nodes):
+        count = 0
+        for k in range(tet_indptr[n], tet_indptr[n + 1]):
+            for m in range(4):
+                q = T[tet_list[k], m]
+                if marker[q] == n:
+                    continue
+                if (upper and q >= n and (movable[n] or movable[q])) or (not upper and movable[n]):
+                    marker[q] = n
+                    count += 1
+        indptr[n + 1] = indptr[n] + count
+    marker[:] = -1
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    for n in range(number_nodes):
+        index = indptr[n]
+        for k in range(tet_indptr[n], tet_indptr[n + 1]):
+            for m in range(4):
+                q = T[tet_list[k], m]
+                if marker[q] == n:
+                    continue
+                if (upper and q >= n and (movable[n] or movable[q])) or (not upper and movable[n]):
+                    marker[q] = n
+                    indices[index] = q
+                    index += 1
+        indices[indptr[n]:indptr[n + 1]] = np.sort(indices[indptr[n]:indptr[n + 1]])
+    return indptr, indices
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_get_block_pattern(node_indptr, node_indices, indptr, indices):  # pragma: no cover
+    """
+    The CSR pattern of the 3x3 blocks of the node pattern, the entry (3 n + i, 3 q + l) of the j-th neighbour q of
+    node n is at 9 node_indptr[n] + 3 L i + 3 j + l, with L the number of neighbours of n.
+    """
+    for n in range(node_indptr.shape[0] - 1):
+        L = node_indptr[n + 1] - node_indptr[n]
+        for i in range(3):
+            start = 9 * node_indptr[n] + 3 * L * i
+            indptr[3 * n + i + 1] = start + 3 * L
+            for j in range(L):
+                for l in range(3):
+                    indices[start + 3 * j + l] = 3 * node_indices[node_indptr[n] + j] + l
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_add_symmetric_blocks(T, K_data, node_indptr, node_indices, upper, data):  # pragma: no cover
+    """
+    Add the symmetric block values of the tetrahedra (60 per tetrahedron, see numba_update_glo_f_and_k) to the
+    values of the CSR matrix with the pattern of numba_get_block_pattern. Blocks that are not in the pattern (e.g.
+    of fixed rows) are skipped.
+    """
+    upper_index = np.array([[0, 1, 2], [1, 3, 4], [2, 4, 5]])
+    for t in range(T.shape[0]):
+        pair = 0
+        for m in range(4):
+            for r in range(m, 4):
+                for direction in range(2):
+                    if direction == 0:
+                        c1 = min(T[t, m], T[t, r]) if upper else T[t, m]
+                        c2 = max(T[t, m], T[t, r]) if upper else T[t, r]
+                    elif upper or m == r:
+                        break
+                    else:
+                        c1 = T[t, r]
+                        c2 = T[t, m]
+                    # the position of the block in the row of the node
+                    start = node_indptr[c1]
+                    L = node_indptr[c1 + 1] - start
+                    j = np.searchsorted(node_indices[start:start + L], c2)
+                    if j == L or node_indices[start + j] != c2:
+                        continue
+                    for i in range(3):
+                        for l in range(3):
+                            data[9 * start + 3 * L * i + 3 * j + l] += K_data[t * 60 + pair * 6 + upper_index[i, l]]
+                pair += 1
+
+
+@njit(cache=NUMBA_CACHE)
+def numba_add_forces(T, f_glo, forces):  # pragma: no cover
+    """
+    Add the forces of the corners of the tetrahedra (N_T x 4 x 3) to the forces of the nodes.
+    """
+    for t in range(T.shape[0]):
+        for m in range(4):
+            for i in range(3):
+                forces[T[t, m], i] += f_glo[t, m, i]
+
+
+def get_gather_pattern(keys: np.ndarray, values: np.ndarray, N: int) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The CSR pattern (indices, indptr) of a N x N matrix with entries at the keys (row * N + col) and for every entry
+    of the CSR matrix the list of the values that are summed up into it (gather_indptr, gather_order). values are the
+    indices of the values of the keys, None if every key has its own value.
+    """
+    # the sparsity pattern, every distinct (row, col) pair is one entry of the CSR matrix
+    entries, scatter = np.unique(keys, return_inverse=True)
+    index_dtype = get_index_dtype(maxval=max(N, entries.shape[0]))
+    indices = (entries % N).astype(index_dtype)
+    indptr = np.zeros(N + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(entries // N, minlength=N), out=indptr[1:])
+
+    gather_order = np.argsort(scatter, kind="stable")
+    if values is not None:
+        gather_order = values[gather_order]
+    gather_order = gather_order.astype(get_index_dtype(maxval=scatter.shape[0] if values is None else values.max()))
+    gather_indptr = np.zeros(entries.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(scatter, minlength=entries.shape[0]), out=gather_indptr[1:])
+    return indices, indptr, gather_indptr, gather_order
+
+
+class SolverTopology:
+    """
+    The quantities of a mesh that only depend on the nodes, the tetrahedra and the movable nodes: the shape tensors,
+    the volumes, the connection indices and the sparsity pattern of the stiffness matrix. The arrays are shared by all
+    solvers with the same mesh and must not be modified.
+    """
+    def __init__(self, nodes: np.ndarray, tetrahedra: np.ndarray, movable: np.ndarray):
+        self.nodes = nodes
+        self.tetrahedra = tetrahedra
+        self.movable = movable.copy()
+        self.number_nodes = nodes.shape[0]
+
+        self._compute_phi()
+        self._compute_connections()
+
+        # the sparsity pattern is only calculated when the stiffness matrix is assembled
+        self.stiffness_pattern = None
+        self.symmetric_stiffness_pattern = None
+        self.block_patterns = {}
+
+    def _compute_phi(self):
+        """
+        Calculate the shape tensors of the tetrahedra (see page 49)
+        """
+        # define the helper matrix chi
+        Chi = np.zeros((4, 3))
+        Chi[0, :] = [-1, -1, -1]
+        Chi[1, :] = [1, 0, 0]
+        Chi[2, :] = [0, 1, 0]
+        Chi[3, :] = [0, 0, 1]
+
+        # tetrahedron matrix B (linear map of the undeformed tetrahedron T onto the primitive tetrahedron P)
+        B = self.nodes[self.tetrahedra[:, 1:4]] - self.nodes[self.tetrahedra[:, 0]][:, None, :]
+        B = B.transpose(0, 2, 1)
+
+        # calculate the volume of the tetrahedron
+        self.volume = np.abs(np.linalg.det(B)) / 6.0
+        sum_zero = np.sum(self.volume == 0)
+        if sum_zero:
+            print("WARNING: found %d elements with volume of 0. Removing those elements." % sum_zero)
+            self.tetrahedra = self.tetrahedra[self.volume != 0]
+            return self._compute_phi()
+
+        # the shape tensor of the tetrahedron is defined as Chi * B^-1
+        self.Phi = Chi @ np.linalg.inv(B)
+
+    def _compute_connections(self):
+        # only the tetrahedra with at least one movable node are assembled in every iteration, the forces and the
+        # energy of the completely fixed tetrahedra do not change while solving
+        is_active = np.any(self.movable[self.tetrahedra], axis=1)
+        self.active_tetrahedra = np.flatnonzero(is_active)
+        self.fixed_tetrahedra = np.flatnonzero(~is_active)
+        # the corners of the active tetrahedra (the tetrahedra themselves, if all are active)
+        if self.fixed_tetrahedra.shape[0]:
+            self.active_corners = self.tetrahedra[self.active_tetrahedra]
+        else:
+            self.active_corners = self.tetrahedra
+
+        # calculate the indices for "update_K_glo"
+        self.block_offset, self.block_count = numba_get_block_offset(self.active_corners, self.movable)
+
+    def get_stiffness_pattern(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The CSR pattern of K_glo (indices, indptr) and for every entry of the CSR matrix the list of the block values
+        that are summed up into it (gather_indptr, gather_order).
+        """
+        if self.stiffness_pattern is None:
+            rows, cols = numba_get_pair_coordinates(self.active_corners, self.block_offset, self.block_count)
+            keys = rows * (self.number_nodes * 3) + cols
+            del rows, cols
+            self.stiffness_pattern = get_gather_pattern(keys, None, self.number_nodes * 3)
+        return self.stiffness_pattern
+
+    def get_symmetric_stiffness_pattern(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The CSR pattern of the upper block triangle of K_glo (indices, indptr) and for every entry of the CSR matrix
+        the list of the symmetric block values that are summed up into it (gather_indptr, gather_order).
+        """
+        if self.symmetric_stiffness_pattern is None:
+            rows, cols, values = numba_get_symmetric_pair_coordinates(self.active_corners, self.movable)
+            keys = rows * (self.number_nodes * 3) + cols
+            del rows, cols
+            self.symmetric_stiffness_pattern = get_gather_pattern(keys, values, self.number_nodes * 3)
+        return self.symmetric_stiffness_pattern
+
+    def get_block_pattern(self, upper: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The CSR pattern of K_glo (indices, indptr), or if upper of its upper block triangle, built from the
+        neighbours of the nodes (node_indptr, node_indices) without a list of all block values.
+        """
+        if upper not in self.block_patterns:
+            node_indptr, node_indices = numba_get_node_pattern(self.tetrahedra, self.number_nodes, self.movable, upper)
+            N = self.number_nodes * 3
+            index_dtype = get_index_dtype(maxval=max(N, 9 * node_indices.shape[0]))
+            indptr = np.zeros(N + 1, dtype=index_dtype)
+            indices = np.empty(9 * node_indices.shape[0], dtype=index_dtype)
+            numba_get_block_pattern(node_indptr, node_indices, indptr, indices)
+            self.block_patterns[upper] = (indices, indptr, node_indptr, node_indices)
+        return self.block_patterns[upper]
+
+
+# the topologies that are still used by a solver
+_topology_cache = weakref.WeakValueDictionary()
+# the most recently used topologies are kept alive, e.g. while the solvers of a result are replaced one by one
+_topology_recent = collections.deque(maxlen=2)
+
+
+def get_topology_key(nodes: np.ndarray, tetrahedra: np.ndarray, movable: np.ndarray) -> str:
+    """
+    A hash of the content of the mesh arrays that define a topology.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for array in (nodes, tetrahedra, movable):
+        array = np.ascontiguousarray(array)
+        h.update(str((array.dtype.str, array.shape)).encode())
+        h.update(array.data)
+    return h.hexdigest()
+
+
+def get_topology(nodes: np.ndarray, tetrahedra: np.ndarray, movable: np.ndarray) -> SolverTopology:
+    """
+    Get the topology of a mesh. Meshes with the same nodes, tetrahedra and movable nodes share one topology object.
+    """
+    key = get_topology_key(nodes, tetrahedra, movable)
+    topology = _topology_cache.get(key)
+    if topology is None:
+        topology = SolverTopology(nodes, tetrahedra, movable)
+        _topology_cache[key] = topology
+    if topology not in _topology_recent:
+        _topology_recent.append(topology)
+    return topology
+
+
+def clear_topology_cache():
+    """
+    Release the topologies that are only kept alive by the cache.
+    """
+    _topology_recent.clear()
+
+
 class Field:
     def __init__(self, validators, default):
         self.validators = validators
@@ -105,15 +607,38 @@ class Solver(Saveable):
 
     #s: NDArray[Shape["N_b, 3"], Float] = None  # the beams, dimensions N_b x 3
     s: np.ndarray = None  # the beams, dimensions N_b x 3
+    beam_weights: np.ndarray = None  # the weights of the beams (summing to 1), dimensions N_b
     N_b = 0  # the number of beams
 
     material_model: SemiAffineFiberMaterial = None  # the function specifying the material model
+    material_model_look_up_parameters = None  # the arguments of the material for numba_look_up
     material_parameters = None
 
     regularisation_results: List[Tuple[float, float, float]] = None
     regularisation_parameters: RegularisationParameterDict = None 
 
+    topology: "SolverTopology" = None  # the shape tensors and connections, shared between solvers with the same mesh
+
     verbose = False
+    matrix_free = False
+    preconditioner = None
+    linear_solver = "cg"  # "cg" or "direct", the backend of the linear solves
+    recycle_directions = 0
+    profiler: SolverProfiler = None
+    dtype = np.float64  # the precision of the stiffness matrix and the conjugate gradient
+    symmetric_storage = False  # only store the upper triangle of the stiffness matrix
+    memory_budget: float = None  # the bytes that the temporary arrays of the assembly may use
+    _batch_size: int = None  # the number of tetrahedra per batch of the assembly, None to assemble all at once
+    _fixed_forces: np.ndarray = None  # the forces of the tetrahedra that only have fixed nodes
+    acceleration_depth = 5  # the number of previous updates of the Anderson acceleration
+    subdomains: int = None  # the number of subdomains that are multiplied in parallel, None for the serial products
+    _subdomain_labels: np.ndarray = None  # the subdomain of each node
+    _element_partition: tuple = None  # the tetrahedra of each subdomain for the parallel matrix free products
+    preconditioner_refresh = 10  # the iterations of the relaxation after which the factorisations are recomputed
+    _preconditioner_factor = None  # the reused factorisation ("ilu", "lu" or "schwarz") of the preconditioner
+    _preconditioner_pattern: tuple = None  # the shape and the number of entries of the factorised matrix
+    _preconditioner_age = 0  # the number of linear solves that used the factorisation
+    _preconditioner_stalled = False  # whether the last conjugate gradient reached its maximal iterations
 
     preprocessing = None
     '''
@@ -248,7 +773,7 @@ class Solver(Saveable):
         self.mesh.Phi_valid = False
 
         # schedule to recalculate the connections
-        self.connections_valid = False
+        self.mesh.connections_valid = False
 
     def set_material_model(self, material: Material, generate_lookup=True):
         """
@@ -261,10 +786,11 @@ class Solver(Saveable):
         """
         self.material_model = material
         if generate_lookup is True:
-            self.material_model_look_up = self.material_model.generate_look_up_table()
+            self.material_model_look_up_parameters = self.material_model.generate_look_up_parameters()
 
     #def set_beams(self, beams: Union[int, NDArray[Shape["N_b, 3"], Float]] = 300):
-    def set_beams(self, beams: Union[int, np.ndarray] = 300):
+    def set_beams(self, beams: Union[int, np.ndarray] = 300, weights: np.ndarray = None, kind: str = "grid",
+                  hemisphere: bool = True):
         """
         Sets the beams for the calculation over the whole solid angle.
 
@@ -273,138 +799,253 @@ class Solver(Saveable):
         beams : int, ndarray
             Either an integer which defines in how many beams to discretize the whole solid angle or an ndarray providing
             the beams, dimensions Nx3, default 300
+        weights : ndarray, optional
+            The weights of the given beams, dimensions N. Default equal weights
+        kind : str, optional
+            The distribution of the beams if their number is given: "grid", "gauss" or "lebedev", see
+            :py:func:`~.build_beams.build_beam_set`. Default "grid"
+        hemisphere : bool, optional
+            If the number of beams is given, whether to merge the beams s and -s into one beam with twice the weight.
+            Gives the same result with fewer beams. Default True
         """
         if isinstance(beams, int):
-            beams = build_beams(beams)
+            beams, weights = build_beam_set(beams, kind, hemisphere)
+        elif weights is None:
+            weights = np.ones(beams.shape[0]) / beams.shape[0]
+        else:
+            weights = np.asarray(weights, dtype=float) / np.sum(weights)
         self.s = beams
+        self.beam_weights = weights
         self.N_b = beams.shape[0]
 
-    def _compute_connections(self):
-        # current scipy versions do not have the sputils anymore
-        try:
-            from scipy.sparse._sputils import get_index_dtype
-        except ImportError:
-            from scipy.sparse.sputils import get_index_dtype
-
-        # calculate the indices for "update_f_glo"
-        y, x = np.meshgrid(np.arange(3), self.mesh.tetrahedra.ravel())
-        self.mesh.force_distribute_coordinates = (x.ravel(), y.ravel())
-
-        self.mesh.force_distribute_coordinates = tuple(self.mesh.force_distribute_coordinates[i].astype(dtype=get_index_dtype(maxval=max(self.mesh.force_distribute_coordinates[i].shape))) for i in range(2))
-
-        # calculate the indices for "update_K_glo"
-        @njit()
-        def numba_get_pair_coordinates(T, var):
-            stiffness_distribute_coordinates2 = []
-            filter_in = np.zeros((T.shape[0], 4, 4, 3, 3)) == 1
-            # iterate over all tetrahedra
-            for t in range(T.shape[0]):
-                #if t % 1000:
-                #    print(t, T.shape[0])
-                tet = T[t]
-                # over all corners
-                for t1 in range(4):
-                    c1 = tet[t1]
-
-                    if not var[c1]:
-                        continue
-
-                    filter_in[t, t1, :, :, :] = True
-
-                    for t2 in range(4):
-                        # get two vertices of the tetrahedron
-                        c2 = tet[t2]
+    def _set_topology(self, topology: "SolverTopology"):
+        """
+        Use the shape tensors, volumes and connections of the given topology for this solver.
+        """
+        # the topology removed elements with a volume of 0
+        if topology.tetrahedra.shape[0] != self.mesh.tetrahedra.shape[0]:
+            self.set_tetrahedra(topology.tetrahedra)
 
-                        for i in range(3):
-                            for j in range(3):
-                                # add the connection to the set
-                                stiffness_distribute_coordinates2.append((c1*3+i, c2*3+j))
-            stiffness_distribute_coordinates2 = np.array(stiffness_distribute_coordinates2)
-            return filter_in.ravel(), (stiffness_distribute_coordinates2[:, 0], stiffness_distribute_coordinates2[:, 1])
+        self.topology = topology
+        self.mesh.Phi = topology.Phi
+        self.mesh.volume = topology.volume
+        self.mesh.block_offset = topology.block_offset
+        self.stiffness_block_count = topology.block_count
 
-        self.mesh.filter_in, self.stiffness_distribute_coordinates2 = numba_get_pair_coordinates(self.mesh.tetrahedra, self.mesh.movable)
-        self.stiffness_distribute_coordinates2 = np.array(self.stiffness_distribute_coordinates2, dtype=get_index_dtype(maxval=max(self.stiffness_distribute_coordinates2[0].shape)))
+        # the sparse matrix is only set up when it is needed
+        self.K_glo_csr = None
 
-        # remember that for the current configuration the connections have been calculated
+        # remember that for the current configuration the shape tensors and connections have been calculated
+        self.mesh.Phi_valid = True
         self.mesh.connections_valid = True
 
-    def _compute_phi(self):
+    @contextlib.contextmanager
+    def _reordered_nodes(self, method: str):
         """
-        Calculate the shape tensors of the tetrahedra (see page 49)
+        Renumber the nodes (and sort the tetrahedra by their smallest new node index) for the duration of the context.
+        All node and tetrahedron fields are permuted back afterwards.
         """
-        # define the helper matrix chi
-        Chi = np.zeros((4, 3))
-        Chi[0, :] = [-1, -1, -1]
-        Chi[1, :] = [1, 0, 0]
-        Chi[2, :] = [0, 1, 0]
-        Chi[3, :] = [0, 0, 1]
-
-        # tetrahedron matrix B (linear map of the undeformed tetrahedron T onto the primitive tetrahedron P)
-        B = self.mesh.nodes[self.mesh.tetrahedra[:, 1:4]] - self.mesh.nodes[self.mesh.tetrahedra[:, 0]][:, None, :]
-        B = B.transpose(0, 2, 1)
-
-        # calculate the volume of the tetrahedron
-        self.mesh.volume = np.abs(np.linalg.det(B)) / 6.0
-        sum_zero = np.sum(self.mesh.volume == 0)
-        if np.sum(self.mesh.volume == 0):
-            print("WARNING: found %d elements with volume of 0. Removing those elements." % sum_zero)
-            self.set_tetrahedra(self.mesh.tetrahedra[self.mesh.volume != 0])
-            return self._compute_phi()
-
-        # the shape tensor of the tetrahedron is defined as Chi * B^-1
-        self.mesh.Phi = Chi @ np.linalg.inv(B)
+        # the topology of the original order is restored afterwards
+        self._check_relax_ready()
+        topology = self.topology
+
+        order = get_node_order(self.mesh.nodes, self.mesh.tetrahedra, method)
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(order.shape[0])
+        tetrahedra = inverse[self.mesh.tetrahedra]
+        tet_order = np.argsort(np.min(tetrahedra, axis=1), kind="stable")
+        tet_inverse = np.empty_like(tet_order)
+        tet_inverse[tet_order] = np.arange(tet_order.shape[0])
+
+        self._permute_mesh(order, tet_order)
+        self.mesh.tetrahedra = tetrahedra[tet_order]
+        self.mesh.Phi_valid = False
+        try:
+            yield
+        finally:
+            self._permute_mesh(inverse, tet_inverse)
+            self.mesh.tetrahedra = self.mesh.tetrahedra[tet_inverse]
+            self.mesh.tetrahedra = order[self.mesh.tetrahedra]
+            # the stiffness matrix and the state of the conjugate gradient are only valid for the renumbered nodes
+            self.K_glo = None
+            self._reset_cg_history(self.recycle_directions)
+            self._reset_preconditioner()
+            self._set_topology(topology)
+
+    def _permute_mesh(self, order: np.ndarray, tet_order: np.ndarray):
+        """
+        Reorder the node fields and the tetrahedron fields (except the tetrahedra) of the mesh and the solver.
+        """
+        for name in ["nodes", "displacements", "forces", "displacements_fixed", "displacements_target",
+                     "displacements_target_mask", "forces_target", "movable", "cell_boundary_mask",
+                     "regularisation_mask"]:
+            value = getattr(self.mesh, name)
+            if value is not None:
+                setattr(self.mesh, name, value[order])
+        if self.mesh.energy is not None:
+            self.mesh.energy = self.mesh.energy[tet_order]
+        if getattr(self, "localweight", None) is not None:
+            self.localweight = self.localweight[order]
+        if getattr(self, "target_mask", None) is not None:
+            self.target_mask = self.target_mask.reshape(-1, 3)[order].ravel()
+
+    def _compute_stiffness_pattern(self):
+        if self._batch_size is not None:
+            # the batched assembly adds the blocks directly to the matrix
+            indices, indptr = self.topology.get_block_pattern(self.symmetric_storage)[:2]
+        else:
+            if self.symmetric_storage:
+                pattern = self.topology.get_symmetric_stiffness_pattern()
+            else:
+                pattern = self.topology.get_stiffness_pattern()
+            indices, indptr, self.stiffness_gather_indptr, self.stiffness_gather_order = pattern
 
-        # remember that for the current configuration the shape tensors have been calculated
-        self.mesh.Phi_valid = True
+        # the matrix is created once, later iterations only update the values. The index arrays are shared with all
+        # solvers of the same topology, only the values belong to this solver.
+        N = self.mesh.number_nodes * 3
+        self.K_glo_csr = ssp.csr_matrix((np.zeros(indices.shape[0], dtype=self.dtype), indices, indptr), shape=(N, N),
+                                        copy=False)
+        self.K_glo_csr.has_sorted_indices = True
 
     """ relaxation """
 
     def _prepare_temporary_quantities(self):
-        # test if one node of the tetrahedron is variable
-        # only count the energy if not the whole tetrahedron is fixed
-        self._countEnergy = np.any(self.mesh.movable[self.mesh.tetrahedra], axis=1)
-
-        # and the shape tensor with the beam
-        # s*_tmb = Phi_tmj * s_jb  (t in [0, N_T], i,j in {x,y,z}, m in {1,2,3,4}), b in [0, N_b])
-        self._s_star = self.mesh.Phi @ self.s.T
-
-        self._V_over_Nb = np.expand_dims(self.mesh.volume, axis=1) / self.N_b
+        # the tetrahedra with only fixed nodes do not change while solving, their energy and their forces on the
+        # fixed nodes are only calculated once
+        self._fixed_forces = None
+        self._set_batch_size()
+        fixed = self.topology.fixed_tetrahedra
+        if fixed.shape[0] == 0:
+            return
+        self._fixed_forces = np.zeros(self.mesh.forces.shape)
+        batch_size = self._batch_size or fixed.shape[0]
+        f_glo = np.zeros((min(batch_size, fixed.shape[0]), 4, 3))
+        for start in range(0, fixed.shape[0], batch_size):
+            batch = fixed[start:start + batch_size]
+            numba_update_glo_f_and_k(*self.material_model_look_up_parameters, self.mesh.displacements,
+                                     self.mesh.tetrahedra, batch, self.mesh.Phi, self.mesh.volume, self.s,
+                                     self.beam_weights, -np.ones((batch.shape[0], 4), dtype=np.int64),
+                                     self.mesh.energy, f_glo[:batch.shape[0]], np.zeros(0, dtype=self.dtype), False)
+            numba_add_forces(self.mesh.tetrahedra[batch], f_glo[:batch.shape[0]], self._fixed_forces)
+
+    def _set_batch_size(self):
+        """
+        Choose how the stiffness matrix is assembled. Without a memory budget, or if the values of the stiffness
+        blocks of all tetrahedra fit into the budget, they are computed at once and then summed into the matrix.
+        Otherwise the tetrahedra are assembled in batches that fit into the budget and the blocks of each batch are
+        added directly to the matrix.
+        """
+        batch_size = None
+        if self.memory_budget is not None and not self.matrix_free:
+            active = self.topology.active_tetrahedra.shape[0]
+            itemsize = np.dtype(self.dtype).itemsize
+            values = active * 60 if self.symmetric_storage else self.stiffness_block_count
+            # the block values and their index in the gather pattern, the forces of the corners and the row and column
+            # of each value to build the gather pattern
+            if values * (itemsize + 8 + 16) + active * 96 > self.memory_budget:
+                # the symmetric block values and the forces of the corners of each tetrahedron of a batch
+                batch_size = int(max(1024, self.memory_budget // (60 * itemsize + 96)))
+        if (batch_size is None) != (self._batch_size is None):
+            self.K_glo_csr = None
+        self._batch_size = batch_size
 
     def _update_glo_f_and_k(self):
         """
         Calculates the stiffness matrix K_ij, the force F_i and the energy E of each node.
         """
         t_start = time.time()
-        batchsize = 1000
 
-        self.mesh.strain_energy = 0
-        f_glo = np.zeros((self.mesh.number_tetrahedra, 4, 3))
-        K_glo = np.zeros((self.mesh.number_tetrahedra, 4, 4, 3, 3))
-
-        for i in range(int(np.ceil(self.mesh.tetrahedra.shape[0] / batchsize))):
+        if self._batch_size is not None:
+            self._update_glo_f_and_k_batched()
             if self.verbose:
-                print("updating forces and stiffness matrix %d%%" % (i / int(np.ceil(self.mesh.tetrahedra.shape[0] / batchsize)) * 100), end="\r")
-            t = slice(i*batchsize, (i+1)*batchsize)
-
-            s_bar = self._get_s_bar(t)
-
-            epsilon_b, dEdsbar, dEdsbarbar = self._get_applied_epsilon(s_bar, self.material_model_look_up, self._V_over_Nb[t])
-
-            self._update_energy(epsilon_b, t)
-            self._update_f_glo(self._s_star[t], s_bar, dEdsbar, out=f_glo[t])
-            self._update_K_glo(self._s_star[t], s_bar, dEdsbar, dEdsbarbar, out=K_glo[t])
-
-        # store the global forces in self.mesh.f_glo
-        # transform from N_T x 4 x 3 -> N_v x 3
-        ssp.coo_matrix((f_glo.ravel(), self.mesh.force_distribute_coordinates), shape=self.mesh.forces.shape).toarray(out=self.mesh.forces)
+                print("updating forces and stiffness matrix finished %.2fs" % (time.time() - t_start))
+            return
 
-        # store the stiffness matrix K in self.K_glo
-        # transform from N_T x 4 x 4 x 3 x 3 -> N_v * 3 x N_v * 3
-        self.K_glo = ssp.coo_matrix((K_glo.ravel()[self.mesh.filter_in], self.stiffness_distribute_coordinates2),
-                                    shape=(self.mesh.number_nodes * 3, self.mesh.number_nodes * 3)).tocsr()
+        active = self.topology.active_tetrahedra
+        f_glo = np.zeros((active.shape[0], 4, 3))
+        if self.symmetric_storage:
+            K_data = np.zeros(active.shape[0] * 60, dtype=self.dtype)
+        else:
+            K_data = np.zeros(self.stiffness_block_count, dtype=self.dtype)
+
+        with self._profile("assembly"):
+            # calculate energy, forces and stiffness of the tetrahedra with movable nodes in one pass
+            numba_update_glo_f_and_k(*self.material_model_look_up_parameters, self.mesh.displacements,
+                                     self.mesh.tetrahedra, active, self.mesh.Phi, self.mesh.volume, self.s,
+                                     self.beam_weights, self.mesh.block_offset, self.mesh.energy, f_glo, K_data,
+                                     self.symmetric_storage)
+
+            # only count the energy of the tetrahedron to the global energy if the tetrahedron has at least one
+            # variable node
+            self.mesh.strain_energy = np.sum(self.mesh.energy[active])
+
+        with self._profile("sparse_conversion"):
+            # store the global forces in self.mesh.f_glo
+            # transform from N_T x 4 x 3 -> N_v x 3
+            self.mesh.forces[:] = 0
+            numba_add_forces(self.topology.active_corners, f_glo, self.mesh.forces)
+            if self._fixed_forces is not None:
+                self.mesh.forces += self._fixed_forces
+
+            # store the stiffness matrix K in self.K_glo
+            if self.matrix_free:
+                # keep the blocks of the tetrahedra, they are applied element by element in the conjugate gradient
+                self.K_glo = ElementStiffnessOperator(self.topology.active_corners, self.mesh.block_offset, K_data,
+                                                      (self.mesh.number_nodes * 3, self.mesh.number_nodes * 3),
+                                                      self._element_partition)
+            else:
+                if self.K_glo_csr is None:
+                    self._compute_stiffness_pattern()
+                # transform from N_T x 4 x 4 x 3 x 3 -> N_v * 3 x N_v * 3 by summing the blocks into the fixed CSR
+                # pattern
+                numba_gather_sum(K_data, self.stiffness_gather_indptr, self.stiffness_gather_order,
+                                 self.K_glo_csr.data)
+                self._set_stiffness_operator()
         if self.verbose:
             print("updating forces and stiffness matrix finished %.2fs" % (time.time() - t_start))
 
+    def _update_glo_f_and_k_batched(self):
+        """
+        Calculates the stiffness matrix, the forces and the energy in batches of tetrahedra, adding the blocks of each
+        batch directly to the stiffness matrix.
+        """
+        active = self.topology.active_tetrahedra
+        corners = self.topology.active_corners
+        batch_size = min(self._batch_size, active.shape[0])
+        if self.K_glo_csr is None:
+            self._compute_stiffness_pattern()
+        node_indptr, node_indices = self.topology.get_block_pattern(self.symmetric_storage)[2:]
+
+        f_glo = np.zeros((batch_size, 4, 3))
+        K_data = np.zeros(batch_size * 60, dtype=self.dtype)
+        self.K_glo_csr.data[:] = 0
+        self.mesh.forces[:] = 0
+        with self._profile("assembly"):
+            for start in range(0, active.shape[0], batch_size):
+                count = min(batch_size, active.shape[0] - start)
+                numba_update_glo_f_and_k(*self.material_model_look_up_parameters, self.mesh.displacements,
+                                         self.mesh.tetrahedra, active[start:start + count], self.mesh.Phi,
+                                         self.mesh.volume, self.s, self.beam_weights, self.mesh.block_offset,
+                                         self.mesh.energy, f_glo[:count], K_data[:count * 60], True)
+                numba_add_symmetric_blocks(corners[start:start + count], K_data, node_indptr, node_indices,
+                                           self.symmetric_storage, self.K_glo_csr.data)
+                numba_add_forces(corners[start:start + count], f_glo[:count], self.mesh.forces)
+            self.mesh.strain_energy = np.sum(self.mesh.energy[active])
+
+        if self._fixed_forces is not None:
+            self.mesh.forces += self._fixed_forces
+        self._set_stiffness_operator()
+
+    def _set_stiffness_operator(self):
+        if self.symmetric_storage:
+            # only the upper block triangle is stored, the rows of the fixed nodes are removed in the product
+            self.K_glo = SymmetricStiffnessOperator(self.K_glo_csr, np.repeat(self.mesh.movable, 3))
+        elif self._subdomain_labels is not None:
+            # the rows of the subdomains are multiplied in parallel
+            self.K_glo = SubdomainStiffnessOperator(self.K_glo_csr, self._subdomain_labels)
+        else:
+            self.K_glo = self.K_glo_csr
+
     #def get_max_tet_stiffness(self) -> NDArray[Shape["N_t"], Float]:
     def get_max_tet_stiffness(self) -> np.ndarray:
         """
@@ -412,6 +1053,9 @@ class Solver(Saveable):
         """
         t_start = time.time()
         batchsize = 10000
+        if self.memory_budget is not None:
+            # the deformed beams and their stiffness of each tetrahedron of a batch
+            batchsize = int(max(100, self.memory_budget // (self.N_b * 8 * 8)))
 
         tetrahedra_stiffness = np.zeros(self.mesh.tetrahedra.shape[0])
 
@@ -444,54 +1088,6 @@ class Solver(Saveable):
 
         return s_bar
 
-    @staticmethod
-    #@njit()#nopython=True, cache=True)
-    def _get_applied_epsilon(s_bar: np.ndarray, lookUpEpsilon: callable, _V_over_Nb: np.ndarray):
-        # the "deformation" amount # p 54 equ 2 part in the parentheses
-        # s_tb = |s'_tib|  (t in [0, N_T], i in {x,y,z}, b in [0, N_b])
-        s = np.linalg.norm(s_bar, axis=1)
-
-        epsilon_b, epsbar_b, epsbarbar_b = lookUpEpsilon(s - 1)
-
-        #                eps'_tb    1
-        # dEdsbar_tb = - ------- * --- * V_t
-        #                 s_tb     N_b
-        dEdsbar = - (epsbar_b / s) * _V_over_Nb
-
-        #                  s_tb * eps''_tb - eps'_tb     1
-        # dEdsbarbar_tb = --------------------------- * --- * V_t
-        #                         s_tb**3               N_b
-        dEdsbarbar = ((s * epsbarbar_b - epsbar_b) / (s ** 3)) * _V_over_Nb
-
-        return epsilon_b, dEdsbar, dEdsbarbar
-
-    def _update_energy(self, epsilon_b: np.ndarray, t: np.ndarray):
-        # sum the energy of this tetrahedron
-        # E_t = eps_tb * V_t
-        self.mesh.energy[t] = np.mean(epsilon_b, axis=1) * self.mesh.volume[t]
-
-        # only count the energy of the tetrahedron to the global energy if the tetrahedron has at least one
-        # variable node
-        self.mesh.strain_energy += np.sum(self.mesh.energy[t][self._countEnergy[t]])
-
-    def _update_f_glo(self, s_star: np.ndarray, s_bar: np.ndarray, dEdsbar: np.ndarray, out: np.ndarray):
-        # f_tmi = s*_tmb * s'_tib * dEds'_tb  (t in [0, N_T], i in {x,y,z}, m in {1,2,3,4}, b in [0, N_b])
-        np.einsum("tmb,tib,tb->tmi", s_star, s_bar, dEdsbar, out=out)
-
-    def _update_K_glo(self, s_star: np.ndarray, s_bar: np.ndarray, dEdsbar: np.ndarray, dEdsbarbar: np.ndarray, out: np.ndarray):
-        #                              / |  |     \      / |  |     \                   / |    |     \
-        #     ___             /  s'  w"| |s'| - 1 | - w' | |s'| - 1 |                w' | | s' | - 1 |             \
-        # 1   \   *     *     |   b    \ | b|     /      \ | b|     /                   \ |  b |     /             |
-        # -    > s   * s    * | ------------------------------------ * s' * s'  + ---------------------- * delta   |
-        # N   /   bm    br    |                  |s'|³                  ib   lb             |s'  |              li |
-        #  b  ---             \                  | b|                                       |  b |                 /
-        #
-        # (t in [0, N_T], i,l in {x,y,z}, m,r in {1,2,3,4}, b in [0, N_b])
-        s_bar_s_bar = 0.5 * (np.einsum("tb,tib,tlb->tilb", dEdsbarbar, s_bar, s_bar)
-                             - np.einsum("il,tb->tilb", np.eye(3), dEdsbar))
-
-        np.einsum("tmb,trb,tilb->tmril", s_star, s_star, s_bar_s_bar, out=out, optimize=['einsum_path', (0, 1), (0, 1)])
-
     def _check_relax_ready(self):
         """
         Checks whether everything is loaded to start a relaxation process.
@@ -510,20 +1106,40 @@ class Solver(Saveable):
         # check if we have a material model
         if self.material_model is None:
             raise ValueError("No material model has been set. Call setMaterialModel first.")
+        if self.material_model_look_up_parameters is None:
+            self.material_model_look_up_parameters = self.material_model.generate_look_up_parameters()
 
         # if the beams have not been set yet, initialize them with the default configuration
         if self.s is None:
             self.set_beams()
-
-        # if the shape tensors are not valid, calculate them
-        if self.mesh.Phi_valid is False:
-            self._compute_phi()
-
-        # if the connections are not valid, calculate them
-        if self.mesh.connections_valid is False:
-            self._compute_connections()
-
-    def solve_boundarycondition(self, step_size: float = 0.066, max_iterations: int = 300, i_min: int = 12, rel_conv_crit: float = 0.01, relrecname: str = None, verbose: bool = False, callback: callable = None):
+        elif self.beam_weights is None or self.beam_weights.shape[0] != self.s.shape[0]:
+            self.set_beams(self.s)
+
+        # if the shape tensors or the connections are not valid, get them from the topology cache
+        if self.mesh.Phi_valid is False or self.mesh.connections_valid is False or \
+                self.topology is None or not np.array_equal(self.topology.movable, self.mesh.movable):
+            self._set_topology(get_topology(self.mesh.nodes, self.mesh.tetrahedra, self.mesh.movable))
+
+    def solve_boundarycondition(self,
+                                step_size: float = 0.066,
+                                max_iterations: int = 300,
+                                i_min: int = 12,
+                                rel_conv_crit: float = 0.01,
+                                relrecname: str = None,
+                                verbose: bool = False,
+                                callback: callable = None,
+                                matrix_free: bool = False,
+                                preconditioner: str = None,
+                                recycle_directions: int = 0,
+                                line_search: bool = False,
+                                residual_tolerance: float = None,
+                                profiler: SolverProfiler = None,
+                                single_precision: bool = False,
+                                reorder: str = None,
+                                symmetric_storage: bool = False,
+                                memory_budget: float = None,
+                                linear_solver: str = "cg",
+                                subdomains: int = None):
         """
         Solve the displacement of the free nodes constraint to the boundary conditions.
 
@@ -540,73 +1156,190 @@ class Solver(Saveable):
             Default 0.01
         relrecname : string, optional
             If a filename is provided, for every iteration the displacement of the conjugate gradient step, the global
-            energy and the residuum are stored in this file.
+            energy and the residuum are stored in this file. The rows are appended in chunks, the format is chosen by
+            the extension (see :py:class:`~.convergence_log.ConvergenceLog`).
         verbose : bool, optional
             If true print status during optimisation
         callback : callable, optional
             A function to call after each iteration (e.g. for a live plot of the convergence)
+        matrix_free : bool, optional
+            If true the stiffness matrix is not assembled but applied element by element in the conjugate gradient.
+            Needs less memory for large meshes.
+        preconditioner : str, optional
+            The preconditioner of the conjugate gradient: None, "jacobi", "block_jacobi" (3x3 blocks of each node),
+            "ilu" (incomplete LU factorisation) or "schwarz" (additive Schwarz with the LU factorisations of the
+            overlapping subdomains). "ilu" and "schwarz" are not available with matrix_free. Their factorisations are
+            reused for preconditioner_refresh iterations (or until the conjugate gradient stalls). Default None
+        recycle_directions : int, optional
+            The number of previous conjugate gradient solutions that span a subspace in which the start value of the
+            next conjugate gradient is corrected. The conjugate gradient always starts from the part of the previous
+            solution that was not applied. Default 0
+        line_search : bool, optional
+            If true, the step size is chosen by a backtracking line search on the squared force residual instead of
+            the fixed step_size. The search starts from twice the last accepted step size (at most 1) and halves it
+            until the residual decreases. Default False
+        residual_tolerance : float, optional
+            If given, finish the iteration when the norm of the force residual of the free nodes falls below this
+            fraction of its initial value. Default None
+        profiler : :py:class:`~.solver_profiler.SolverProfiler`, optional
+            Records the time and memory of the phases of each iteration.
+        single_precision : bool, optional
+            If true, the stiffness matrix is stored and the conjugate gradient is solved in single precision (with
+            double precision sums). Once converged, the solution is refined with at least 5 more iterations in double
+            precision. Halves the memory of the stiffness matrix. Default False
+        reorder : str, optional
+            Renumber the nodes while solving for a better memory locality of the assembly and the conjugate gradient:
+            "rcm" (reverse Cuthill-McKee) or "morton" (z-order curve of the node coordinates), see
+            :py:func:`~.multigrid_helper.get_node_order`. The original order is restored afterwards. Default None
+        symmetric_storage : bool, optional
+            If true, only the upper triangle of the symmetric stiffness matrix is stored and multiplied with a symmetric
+            kernel. Needs about half the memory of the stiffness matrix, not available with matrix_free. Default False
+        memory_budget : float, optional
+            The bytes that the temporary arrays of the assembly of the stiffness matrix may use (not counting the
+            matrix itself). If the blocks of all tetrahedra do not fit, the tetrahedra are assembled in batches and
+            added directly to the matrix. Not used with matrix_free. Default None (no limit)
+        linear_solver : str, optional
+            How the linear equation of each iteration is solved: "cg" (the conjugate gradient with the given
+            preconditioner), "pcg" (the conjugate gradient with the given preconditioner or by default "block_jacobi"),
+            "direct" (the sparse LU factorisation of the stiffness matrix, not available with matrix_free) or "auto"
+            ("direct" for meshes with at most 300 movable nodes, above the factorisation is slower than the conjugate
+            gradient, otherwise "pcg"). Default "cg"
+        subdomains : int, optional
+            Partition the nodes into this many subdomains (see :py:func:`~.multigrid_helper.get_subdomains`) whose
+            rows of the stiffness matrix are multiplied in parallel threads, the contributions of the tetrahedra at
+            the borders of the subdomains are combined afterwards. Also the subdomains of the "schwarz"
+            preconditioner. Not available with symmetric_storage. Default None (serial products)
         """
+        if reorder is not None:
+            parameters = dict(locals())
+            del parameters["self"]
+            with self._reordered_nodes(reorder):
+                return self.solve_boundarycondition(**dict(parameters, reorder=None))
+
         # set the verbosity level
         self.verbose = verbose
+        self._set_storage(matrix_free, symmetric_storage)
+        self.memory_budget = memory_budget
+        self._set_linear_solver(linear_solver, preconditioner, direct_max_nodes=300)
+        self._reset_cg_history(recycle_directions)
+        self._line_search_step_size = 1
+        self._set_profiler(profiler)
+        self._set_precision(single_precision)
+        self._reset_preconditioner()
 
         # check if everything is prepared
         self._check_relax_ready()
+        self._set_subdomains(subdomains)
 
         self._prepare_temporary_quantities()
 
         # update the forces and stiffness matrix
         self._update_glo_f_and_k()
 
-        relrec = [[0, self.mesh.strain_energy, np.sum(self.mesh.forces[self.mesh.movable] ** 2)]]
-
-        start = time.time()
-        # start the iteration
-        for i in range(max_iterations):
-            # move the displacements in the direction of the forces one step
-            # but while moving the stiffness tensor is kept constant
-            du = self._solve_cg(step_size)
-
-            # update the forces on each tetrahedron and the global stiffness tensor
-            self._update_glo_f_and_k()
-
-            # sum all squared forces of non fixed nodes
-            ff = np.sum((self.mesh.forces[self.mesh.movable] - self.mesh.forces_target[self.mesh.movable]) ** 2)
-            #ff = np.sum(self.mesh.f[self.mesh.var] ** 2)
+        with ConvergenceLog(relrecname, columns=["du", "energy", "residuum"]) as log:
+            relrec = log.rows
+            log.append([0, self.mesh.strain_energy, np.sum(self.mesh.forces[self.mesh.movable] ** 2)])
+
+            start = time.time()
+            # start the iteration
+            # the convergence criteria are only checked after this iteration (to only use double precision iterations)
+            i_double = -1
+            for i in range(max_iterations):
+                if self.profiler is not None:
+                    self.profiler.iteration = i + 1
+                # move the displacements in the direction of the forces one step
+                # but while moving the stiffness tensor is kept constant
+                if line_search:
+                    # the step size that decreases the residual, this also updates the forces and the stiffness tensor
+                    du = self._solve_cg(step_size, merit=self._get_relaxation_residual)
+                else:
+                    du = self._solve_cg(step_size)
+
+                    # update the forces on each tetrahedron and the global stiffness tensor
+                    self._update_glo_f_and_k()
+
+                # sum all squared forces of non fixed nodes
+                with self._profile("energy_update"):
+                    ff = self._get_relaxation_residual()
+                #ff = np.sum(self.mesh.f[self.mesh.var] ** 2)
+
+                # print and store status
+                if self.verbose:
+                    print("Newton ", i, ": du=", du, "  Energy=", self.mesh.strain_energy, "  Residuum=", ff)
+
+                # log and store values (if a target file was provided)
+                log.append([du, self.mesh.strain_energy, ff])
+                if callback is not None:
+                    callback(self, relrec)
+
+                # stop if the force residual has been reduced enough
+                converged = residual_tolerance is not None and i > i_double and \
+                    ff <= residual_tolerance ** 2 * relrec[0][2]
+
+                # if we have passed i_min iterations we calculate average and std of the last 6 iteration
+                if i > i_min and i > i_double:
+                    # if the iterations converge, stop the iteration
+                    # coefficient of variation of the energy of the last iterations below "rel_conv_crit"
+                    if log.coefficient_of_variation(1) < rel_conv_crit:
+                        converged = True
+
+                if converged:
+                    if self.dtype != np.float64:
+                        # refine the solution in double precision
+                        i_double = self._start_double_precision_refinement(i)
+                        continue
+                    break
 
-            # print and store status
+            # print the elapsed time
+            finish = time.time()
             if self.verbose:
-                print("Newton ", i, ": du=", du, "  Energy=", self.mesh.strain_energy, "  Residuum=", ff)
+                print("| time for relaxation was", finish - start)
 
-            # log and store values (if a target file was provided)
-            relrec.append([du, self.mesh.strain_energy, ff])
-            if relrecname is not None:
-                np.savetxt(relrecname, relrec)
-            if callback is not None:
-                callback(self, relrec)
-                
-            # if we have passed i_min iterations we calculate average and std of the last 6 iteration
-            if i > i_min:
-                # calculate the average energy over the last 6 iterations
-                last_Es = np.array(relrec)[:-6:-1, 1]
-                Emean = np.mean(last_Es)
-                Estd = np.std(last_Es)
-
-                # if the iterations converge, stop the iteration
-                # coefficient of variation below "rel_conv_crit"
-                if Estd / Emean < rel_conv_crit:
-                    break
+        self.boundary_results = relrec
+        if self.profiler is not None:
+            self.profiler.save()
+        return relrec
 
-        # print the elapsed time
-        finish = time.time()
+    def _start_double_precision_refinement(self, i: int) -> int:
+        """
+        Continue the iteration in double precision, returns the iteration after which the convergence criteria only
+        use double precision iterations.
+        """
         if self.verbose:
-            print("| time for relaxation was", finish - start)
+            print("refine the solution in double precision")
+        self._set_precision(False)
+        self._update_glo_f_and_k()
+        return i + 5
 
-        self.boundary_results = relrec
-        return relrec
+    def _get_relaxation_residual(self) -> float:
+        """
+        The sum of the squared deviations of the forces from the target forces of the free nodes.
+        """
+        return np.sum((self.mesh.forces[self.mesh.movable] - self.mesh.forces_target[self.mesh.movable]) ** 2)
+
+    def _line_search(self, uu: np.ndarray, merit: callable, min_step_size: float = 1e-3) -> float:
+        """
+        Apply the displacements uu with the largest step size (halving it) that decreases the merit function. The
+        forces and the stiffness tensor are updated for the applied displacements.
+        """
+        step_size = min(self._line_search_step_size * 2, 1)
+        displacements = self.mesh.displacements.copy()
+        merit_start = merit()
+        while True:
+            self.mesh.displacements[:] = displacements + uu * step_size
+            self._update_glo_f_and_k()
+            if merit() < merit_start or step_size / 2 < min_step_size:
+                break
+            step_size /= 2
+        if self.verbose:
+            print("line search step size", step_size)
+        self._line_search_step_size = step_size
+        return step_size
 
-    def _solve_cg(self, step_size: float):
+    def _solve_cg(self, step_size: float, merit: callable = None):
         """
-        Solve the displacements from the current stiffness tensor using conjugate gradient.
+        Solve the displacements from the current stiffness tensor using conjugate gradient. If a merit function is
+        given, the step size is chosen by a line search.
         """
         # calculate the difference between the current forces on the nodes and the desired forces
         ff = self.mesh.forces - self.mesh.forces_target
@@ -616,16 +1349,164 @@ class Solver(Saveable):
 
         # solve the conjugate gradient which solves the equation A x = b for x
         # where A is the stiffness matrix K_glo and b is the vector of the target forces
-        uu = cg(self.K_glo, ff.ravel(), maxiter=3 * self.mesh.number_nodes, tol=0.00001, verbose=self.verbose).reshape(ff.shape)
+        with self._profile("cg") as info:
+            uu = self._solve_linear_system(self.K_glo, ff.ravel().astype(self.dtype, copy=False),
+                                           maxiter=3 * self.mesh.number_nodes, tol=0.00001,
+                                           M=self._get_preconditioner(self.K_glo, self.preconditioner_refresh),
+                                           info=info).reshape(ff.shape)
 
         # add the new displacements to the stored displacements
-        self.mesh.displacements[self.mesh.movable] += uu[self.mesh.movable] * step_size
+        if merit is None:
+            self.mesh.displacements[self.mesh.movable] += uu[self.mesh.movable] * step_size
+        else:
+            uu[~self.mesh.movable] = 0
+            step_size = self._line_search(uu, merit)
+        self._store_cg_solution(uu, step_size)
         # sum the applied displacements
         du = np.sum(uu[self.mesh.movable] ** 2) * step_size * step_size
 
         # return the total applied displacement
         return du
 
+    def _set_precision(self, single_precision: bool):
+        """
+        Set the precision of the stiffness matrix and the conjugate gradient.
+        """
+        dtype = np.float32 if single_precision else np.float64
+        if dtype != self.dtype:
+            self.dtype = dtype
+            self.K_glo_csr = None
+            self._reset_preconditioner()
+
+    def _set_storage(self, matrix_free: bool, symmetric_storage: bool):
+        """
+        Set how the stiffness matrix is stored.
+        """
+        if matrix_free and symmetric_storage:
+            raise ValueError("symmetric_storage cannot be combined with matrix_free.")
+        self.matrix_free = matrix_free
+        if symmetric_storage != self.symmetric_storage:
+            self.symmetric_storage = symmetric_storage
+            self.K_glo_csr = None
+            self._reset_preconditioner()
+
+    def _set_linear_solver(self, linear_solver: str, preconditioner: str, direct_max_nodes: int):
+        """
+        Set the backend of the linear solves, "auto" uses the direct solver for meshes with at most direct_max_nodes
+        movable nodes.
+        """
+        if linear_solver not in ["cg", "pcg", "direct", "auto"]:
+            raise ValueError(f"Unknown linear solver {linear_solver}, use one of ['cg', 'pcg', 'direct', 'auto']")
+        if linear_solver == "auto":
+            if not self.matrix_free and np.count_nonzero(self.mesh.movable) <= direct_max_nodes:
+                linear_solver = "direct"
+            else:
+                linear_solver = "pcg"
+        if linear_solver == "direct" and self.matrix_free:
+            raise ValueError("The direct linear solver cannot be combined with matrix_free.")
+        if linear_solver == "pcg":
+            linear_solver = "cg"
+            if preconditioner is None:
+                preconditioner = "block_jacobi"
+        elif linear_solver == "direct":
+            preconditioner = None
+        self.linear_solver = linear_solver
+        self.preconditioner = preconditioner
+
+    def _set_subdomains(self, subdomains: int):
+        """
+        Partition the nodes into subdomains along the z-order curve of their coordinates. The products with the
+        stiffness matrix are computed for the subdomains in parallel and the "schwarz" preconditioner solves the
+        subdomains. Without subdomains, the "schwarz" preconditioner uses one subdomain per thread or per 1000 movable
+        nodes.
+        """
+        if subdomains is not None and self.symmetric_storage:
+            raise ValueError("subdomains cannot be combined with symmetric_storage.")
+        self.subdomains = subdomains
+        if subdomains is None and self.preconditioner == "schwarz":
+            subdomains = _get_subdomain_count(np.count_nonzero(self.mesh.movable), None)
+        if subdomains is None:
+            self._subdomain_labels = None
+            self._element_partition = None
+            return
+        self._subdomain_labels = get_subdomains(self.mesh.nodes, subdomains)
+        self._element_partition = None
+        if self.matrix_free:
+            self._element_partition = get_element_partition(self.topology.active_corners, self._subdomain_labels)
+
+    def _solve_linear_system(self, A, b: np.ndarray, maxiter: int, tol: float, M=None, info: dict = None) \
+            -> np.ndarray:
+        """
+        Solve A x = b with the conjugate gradient (with the preconditioner M) or the direct solver.
+        """
+        if self.linear_solver == "direct":
+            return solve_direct(A, b, info=info)
+        info = {} if info is None else info
+        x = cg(A, b, maxiter=maxiter, tol=tol, verbose=self.verbose, M=M, info=info, **self._get_cg_start())
+        self._preconditioner_stalled = info["iterations"] >= maxiter
+        return x
+
+    def _get_preconditioner(self, A, refresh: int = None):
+        """
+        The preconditioner of A. The factorisations ("ilu", "lu" and "schwarz") are expensive, they are reused while
+        the sparsity pattern of A is unchanged. If refresh is given, they are recomputed after refresh linear solves
+        or when the conjugate gradient with the reused factorisation reached its maximal iterations.
+        """
+        if self.preconditioner not in ["ilu", "lu", "schwarz"]:
+            return get_preconditioner(A, self.preconditioner)
+        pattern = (A.shape, getattr(A, "nnz", None))
+        if self._preconditioner_factor is None or pattern != self._preconditioner_pattern or \
+                (refresh is not None and (self._preconditioner_age >= refresh or
+                                          (self._preconditioner_age > 1 and self._preconditioner_stalled))):
+            self._reset_preconditioner()
+            self._preconditioner_factor = get_preconditioner(A, self.preconditioner, self._subdomain_labels)
+            self._preconditioner_pattern = pattern
+        self._preconditioner_age += 1
+        return self._preconditioner_factor
+
+    def _reset_preconditioner(self):
+        # the schwarz preconditioner holds a thread pool
+        if getattr(self._preconditioner_factor, "close", None) is not None:
+            self._preconditioner_factor.close()
+        self._preconditioner_factor = None
+        self._preconditioner_pattern = None
+        self._preconditioner_age = 0
+        self._preconditioner_stalled = False
+
+    def _set_profiler(self, profiler: SolverProfiler = None):
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.iteration = 0
+
+    def _profile(self, phase: str):
+        """
+        A context to measure a phase of the iteration with the profiler (if one is set).
+        """
+        if self.profiler is None:
+            return contextlib.nullcontext({})
+        return self.profiler.phase(phase)
+
+    def _reset_cg_history(self, recycle_directions: int = 0):
+        self.recycle_directions = recycle_directions
+        self._cg_start = None
+        self._cg_solutions = collections.deque(maxlen=max(recycle_directions, 1))
+
+    def _get_cg_start(self) -> dict:
+        """
+        The start value and the recycled subspace for the next conjugate gradient.
+        """
+        W = None
+        if self.recycle_directions > 0 and len(self._cg_solutions):
+            W = np.stack(self._cg_solutions, axis=1)
+        return dict(x0=self._cg_start, W=W)
+
+    def _store_cg_solution(self, uu: np.ndarray, step_size: float):
+        # the stiffness changes only slightly between the iterations, the part of the step that was not applied is a
+        # good start value for the next conjugate gradient
+        self._cg_start = uu.ravel() * (1 - step_size)
+        if self.recycle_directions > 0:
+            self._cg_solutions.append(uu.ravel().copy())
+
     """ regularization """
 
     #def set_target_displacements(self, displacement: NDArray[Shape["N_c, 3"], Float], reg_mask: NDArray[Shape["N_c"], Bool] = None):
@@ -707,44 +1588,68 @@ class Solver(Saveable):
             print("total weight: ", counter, "/", counterall)
 
     def _compute_regularization_a_and_b(self, alpha: float):
-        KA = self.K_glo.multiply(np.repeat(self.localweight * alpha, 3)[None, :])
-        self.KAK = KA @ self.K_glo
-        self.A = self.I + self.KAK
-
-        self.b = (KA @ self.mesh.forces.ravel()).reshape(self.mesh.forces.shape)
+        # A = I + K W K is applied as an operator, the product K W K is never formed
+        weight = np.repeat(self.localweight * alpha, 3)
+        self.A = RegularizationOperator(self.K_glo, weight, self.target_mask)
+        self.b = (self.K_glo @ (weight * self.mesh.forces.ravel()).astype(self.dtype, copy=False)
+                  ).reshape(self.mesh.forces.shape)
 
         index = self.mesh.movable & self.mesh.displacements_target_mask
         self.b[index] += self.mesh.displacements_target[index] - self.mesh.displacements[index]
 
-    def _record_regularization_status(self, relrec: list, alpha: float, relrecname: str = None):
+    def _get_regularization_functional(self, alpha: float) -> Tuple[float, float, float]:
+        """
+        The regularised functional L = |u-uf|^2 + alpha*|w*f|^2 and its two terms.
+        """
         indices = self.mesh.movable & self.mesh.displacements_target_mask
         btemp = self.mesh.displacements_target[indices] - self.mesh.displacements[indices]
         uuf2 = np.sum(btemp ** 2)
-        suuf = np.sum(np.linalg.norm(btemp, axis=1))
-        bcount = btemp.shape[0]
-
-        u2 = np.sum(self.mesh.displacements[self.mesh.movable] ** 2)
 
         f = np.zeros((self.mesh.number_nodes, 3))
         f[self.mesh.movable] = self.mesh.forces[self.mesh.movable]
 
         ff = np.sum(np.sum(f**2, axis=1) * self.localweight * self.mesh.movable)
 
-        L = alpha*ff + uuf2
+        return alpha*ff + uuf2, uuf2, ff
+
+    def _record_regularization_status(self, log: ConvergenceLog, alpha: float):
+        with self._profile("energy_update"):
+            L, uuf2, ff = self._get_regularization_functional(alpha)
+
+        u2 = np.sum(self.mesh.displacements[self.mesh.movable] ** 2)
 
         if self.verbose:
             print("|u-uf|^2 =", uuf2)
             print("|w*f|^2  =", ff, "\t\t|u|^2 =", u2)
             print("L = |u-uf|^2 + lambda*|w*f|^2 = ", L)
 
-        relrec.append((L, uuf2, ff))
-
-        if relrecname is not None:
-            np.savetxt(relrecname, relrec)
-
-    def solve_regularized(self, step_size: float = 0.33, solver_precision: float = 1e-18, max_iterations: int = 300,
-                          i_min: int = 12, rel_conv_crit: float = 0.01, alpha: float = 1e10, method: str = "huber",
-                          relrecname: str = None, verbose: bool = False, callback: callable = None):
+        log.append((L, uuf2, ff))
+
+    def solve_regularized(self,
+                          step_size: float = 0.33,
+                          solver_precision: float = 1e-18,
+                          max_iterations: int = 300,
+                          i_min: int = 12,
+                          rel_conv_crit: float = 0.01,
+                          alpha: float = 1e10,
+                          method: str = "huber",
+                          relrecname: str = None,
+                          verbose: bool = False,
+                          callback: callable = None,
+                          matrix_free: bool = False,
+                          preconditioner: str = None,
+                          coarse_levels: int = 0,
+                          recycle_directions: int = 0,
+                          line_search: bool = False,
+                          residual_tolerance: float = None,
+                          profiler: SolverProfiler = None,
+                          single_precision: bool = False,
+                          reorder: str = None,
+                          symmetric_storage: bool = False,
+                          memory_budget: float = None,
+                          linear_solver: str = "cg",
+                          subdomains: int = None,
+                          acceleration: str = None):
         """
         Fit the provided displacements. Displacements can be provided with
         :py:meth:`~.Solver.setTargetDisplacements`.
@@ -772,12 +1677,94 @@ class Solver(Saveable):
                 "cauchy"
                 "singlepoint"
         relrecname : string, optional
-            The filename where to store the output. Default is to not store the output, just to return it.
+            The filename where to store the output. Default is to not store the output, just to return it. The rows
+            are appended in chunks, the format is chosen by the extension (see
+            :py:class:`~.convergence_log.ConvergenceLog`).
         verbose : bool, optional
             If true print status during optimisation
         callback : callable, optional
             A function to call after each iteration (e.g. for a live plot of the convergence)
+        matrix_free : bool, optional
+            If true the stiffness matrix is not assembled but applied element by element in the conjugate gradient.
+            Needs considerably less memory for large meshes. The regularisation matrix A = I + K W K is never
+            assembled, it is always applied as K (W (K x)).
+        preconditioner : str, optional
+            The preconditioner of the conjugate gradient: None, "jacobi", "block_jacobi" (3x3 blocks of each node),
+            "ilu" (incomplete LU factorisation), "lu" (the LU factorisation of A from the first iteration, reused
+            for all following iterations, only for small meshes) or "schwarz" (additive Schwarz with the LU
+            factorisations of the overlapping subdomains of A from the first iteration, reused like "lu"). "ilu",
+            "lu" and "schwarz" assemble A and are not available with matrix_free. Default None
+        coarse_levels : int, optional
+            The number of coarser meshes (each with every second grid line of the previous one) on which the
+            regularisation is solved first. The result of each level is interpolated to the next finer level as the
+            start value. Only available for box meshes (see :py:func:`~.multigrid_helper.create_box_mesh`). Default 0
+        recycle_directions : int, optional
+            The number of previous conjugate gradient solutions that span a subspace in which the start value of the
+            next conjugate gradient is corrected. The conjugate gradient always starts from the part of the previous
+            solution that was not applied. Default 0
+        line_search : bool, optional
+            If true, the step size is chosen by a backtracking line search on L instead of the fixed step_size. The
+            search starts from twice the last accepted step size (at most 1) and halves it until L decreases.
+            Default False
+        residual_tolerance : float, optional
+            If given, finish the iteration when the norm of the right-hand side of the regularisation equation (the
+            gradient of L) falls below this fraction of its initial value. Default None
+        profiler : :py:class:`~.solver_profiler.SolverProfiler`, optional
+            Records the time and memory of the phases of each iteration.
+        single_precision : bool, optional
+            If true, the stiffness matrix is stored and the conjugate gradient is solved in single precision (with
+            double precision sums). Once converged, the solution is refined with at least 5 more iterations in double
+            precision. Halves the memory of the stiffness matrix. Default False
+        reorder : str, optional
+            Renumber the nodes while solving for a better memory locality of the assembly and the conjugate gradient:
+            "rcm" (reverse Cuthill-McKee) or "morton" (z-order curve of the node coordinates), see
+            :py:func:`~.multigrid_helper.get_node_order`. The original order is restored afterwards. The coarse levels
+            are solved in the original order. Default None
+        symmetric_storage : bool, optional
+            If true, only the upper triangle of the symmetric stiffness matrix is stored and multiplied with a symmetric
+            kernel. Needs about half the memory of the stiffness matrix, not available with matrix_free. Default False
+        memory_budget : float, optional
+            The bytes that the temporary arrays of the assembly of the stiffness matrix may use (not counting the
+            matrix itself). If the blocks of all tetrahedra do not fit, the tetrahedra are assembled in batches and
+            added directly to the matrix. Not used with matrix_free. Default None (no limit)
+        linear_solver : str, optional
+            How the linear equation of each iteration is solved: "cg" (the conjugate gradient with the given
+            preconditioner), "pcg" (the conjugate gradient with the given preconditioner or by default "block_jacobi"),
+            "direct" (the sparse LU factorisation of A, not available with matrix_free) or "auto" ("direct" for meshes
+            with at most 150 movable nodes, as A = I + K W K fills in much more than K, otherwise "pcg"). Default "cg"
+        subdomains : int, optional
+            Partition the nodes into this many subdomains (see :py:func:`~.multigrid_helper.get_subdomains`) whose
+            rows of the stiffness matrix are multiplied in parallel threads, the contributions of the tetrahedra at
+            the borders of the subdomains are combined afterwards. Also the subdomains of the "schwarz"
+            preconditioner. Not available with symmetric_storage. Default None (serial products)
+        acceleration : str, optional
+            "anderson" to extrapolate the update of the displacements from the last updates (Anderson mixing of up
+            to acceleration_depth updates). The extrapolation is only applied if it decreases the quadratic model of
+            L more than the update, otherwise the update is applied and the history restarts. Not available with
+            line_search. Default None
         """
+        parameters = dict(locals())
+        del parameters["self"]
+
+        if coarse_levels > 0:
+            coarse = self._get_coarse_solver()
+            # the force term grows with the square of the number of nodes per coarse node relative to the fit term
+            coarse_alpha = alpha / (self.mesh.number_nodes / coarse.mesh.number_nodes) ** 2
+            coarse.solve_regularized(step_size=step_size, solver_precision=solver_precision,
+                                     max_iterations=max_iterations, i_min=i_min, rel_conv_crit=rel_conv_crit,
+                                     alpha=coarse_alpha, method=method, verbose=verbose, matrix_free=matrix_free,
+                                     preconditioner=preconditioner, coarse_levels=coarse_levels - 1,
+                                     recycle_directions=recycle_directions, line_search=line_search,
+                                     residual_tolerance=residual_tolerance, profiler=profiler,
+                                     single_precision=single_precision, reorder=None,
+                                     symmetric_storage=symmetric_storage, memory_budget=memory_budget,
+                                     linear_solver=linear_solver, subdomains=subdomains, acceleration=acceleration)
+            self._set_coarse_displacements(coarse)
+
+        if reorder is not None:
+            with self._reordered_nodes(reorder):
+                return self.solve_regularized(**dict(parameters, coarse_levels=0, reorder=None))
+
         self.regularisation_parameters = {
             "step_size": step_size,
             "solver_precision": solver_precision,
@@ -789,12 +1776,21 @@ class Solver(Saveable):
 
         # set the verbosity level
         self.verbose = verbose
-
-        self.I = ssp.lil_matrix((self.mesh.displacements_target_mask.shape[0] * 3, self.mesh.displacements_target_mask.shape[0] * 3))
-        self.I.setdiag(np.repeat(self.mesh.displacements_target_mask, 3))
+        self._set_storage(matrix_free, symmetric_storage)
+        self.memory_budget = memory_budget
+        self._set_linear_solver(linear_solver, preconditioner, direct_max_nodes=150)
+        self._reset_cg_history(recycle_directions)
+        self._line_search_step_size = 1
+        self._set_profiler(profiler)
+        self._set_precision(single_precision)
+
+        self.target_mask = np.repeat(self.mesh.displacements_target_mask, 3).astype(float)
+        self._reset_preconditioner()
+        self._set_acceleration(acceleration, line_search)
 
         # check if everything is prepared
         self._check_relax_ready()
+        self._set_subdomains(subdomains)
 
         self._prepare_temporary_quantities()
 
@@ -806,63 +1802,264 @@ class Solver(Saveable):
         self._update_glo_f_and_k()
 
         # log and store values (if a target file was provided)
-        relrec = []
-        self.relrec = relrec
-        if callback is not None:
-            callback(self, relrec, 0, max_iterations)
-        self._record_regularization_status(relrec, alpha, relrecname)
+        with ConvergenceLog(relrecname, columns=["L", "uuf2", "ff"]) as log:
+            relrec = log.rows
+            self.relrec = relrec
+            if callback is not None:
+                callback(self, relrec, 0, max_iterations)
+            self._record_regularization_status(log, alpha)
 
-        if self.verbose:
-            print("check before relax !")
-        # start the iteration
-        for i in range(max_iterations):
-            # compute the weight matrix
-            if method != "normal":
-                self._update_local_regularization_weigth(method)
+            if self.verbose:
+                print("check before relax !")
+            # start the iteration
+            # the convergence criteria are only checked after this iteration (to only use double precision iterations)
+            i_double = -1
+            for i in range(max_iterations):
+                if self.profiler is not None:
+                    self.profiler.iteration = i + 1
+
+                # compute the weight matrix
+                if method != "normal":
+                    with self._profile("weight_update"):
+                        self._update_local_regularization_weigth(method)
+
+                # compute A and b for the linear equation that solves the regularisation problem
+                with self._profile("system"):
+                    self._compute_regularization_a_and_b(alpha)
+
+                # stop if the gradient of the functional has been reduced enough
+                if residual_tolerance is not None:
+                    residual = np.linalg.norm(self.b)
+                    if i == 0:
+                        residual_start = residual
+                    elif residual <= residual_tolerance * residual_start and i > i_double:
+                        if self.dtype != np.float64:
+                            # refine the solution in double precision
+                            i_double = self._start_double_precision_refinement(i)
+                            continue
+                        break
+
+                if line_search:
+                    # get the displacements that solve the regularisation term and apply them with the step size that
+                    # decreases L, this also updates the forces and the global stiffness tensor
+                    uu = self._solve_regularization_cg(step_size, solver_precision,
+                                                       merit=lambda: self._get_regularization_functional(alpha)[0])
+                elif acceleration is not None:
+                    # get the displacements that solve the regularisation term and extrapolate them from the previous
+                    # updates
+                    displacements = self.mesh.displacements.copy()
+                    uu = self._solve_regularization_cg(step_size, solver_precision)
+                    self._accelerate_displacements(displacements)
+
+                    # update the forces on each tetrahedron and the global stiffness tensor
+                    self._update_glo_f_and_k()
+                else:
+                    # get and apply the displacements that solve the regularisation term
+                    uu = self._solve_regularization_cg(step_size, solver_precision)
 
-            # compute A and b for the linear equation that solves the regularisation problem
-            self._compute_regularization_a_and_b(alpha)
+                    # update the forces on each tetrahedron and the global stiffness tensor
+                    self._update_glo_f_and_k()
 
-            # get and apply the displacements that solve the regularisation term
-            uu = self._solve_regularization_cg(step_size, solver_precision)
+                if self.verbose:
+                    print("Round", i+1, " |du|=", uu)
 
-            # update the forces on each tetrahedron and the global stiffness tensor
-            self._update_glo_f_and_k()
+                # log and store values (if a target file was provided)
+                self._record_regularization_status(log, alpha)
 
-            if self.verbose:
-                print("Round", i+1, " |du|=", uu)
+                if callback is not None:
+                    callback(self, relrec, i, max_iterations)
 
-            # log and store values (if a target file was provided)
-            self._record_regularization_status(relrec, alpha, relrecname)
+                # if we have passed i_min iterations we calculate average and std of the last 6 iteration
+                if i > i_min and i > i_double:
+                    # if the iterations converge, stop the iteration
+                    # use the coefficient of variation of the last iterations; in saeno there was the additional factor
+                    # "/ np.sqrt(5)"
+                    if log.coefficient_of_variation(1) < rel_conv_crit:
+                        if self.dtype != np.float64:
+                            # refine the solution in double precision
+                            i_double = self._start_double_precision_refinement(i)
+                            continue
+                        break
 
-            if callback is not None:
-                callback(self, relrec, i, max_iterations)
+        self.regularisation_results = relrec
+        if self.profiler is not None:
+            self.profiler.save()
+        return relrec
 
-            # if we have passed i_min iterations we calculate average and std of the last 6 iteration
-            if i > i_min:
-                # calculate the average energy over the last 6 iterations
-                last_Ls = np.array(relrec)[:-6:-1, 1]
-                Lmean = np.mean(last_Ls)
-                Lstd = np.std(last_Ls)       #  Use Coefficient of Variation; in saeno there was the additional factor  "/ np.sqrt(5)" behind 
+    def solve_regularized_sweep(self, alphas: List[float], n_workers: int = 1,
+                                **solve_parameters) -> List[Tuple[float, float, float]]:
+        """
+        Solve the regularisation for several alphas, e.g. for an L-curve. The alphas are solved from the largest to the
+        smallest, each one starting from the displacements of the previous one.
 
-                # if the iterations converge, stop the iteration
-                if Lstd / Lmean < rel_conv_crit:
-                    break
+        Parameters
+        ----------
+        alphas : list of float
+            The regularisation parameters.
+        n_workers : int, optional
+            The number of worker processes. The sorted alphas are split into contiguous chunks, one per worker. The
+            first alpha of each chunk starts from the current displacements of the solver. Default 1
+        solve_parameters
+            The other parameters for :py:meth:`~.Solver.solve_regularized`. A callback or profiler is only used when
+            solving in this process.
+
+        Returns
+        -------
+        results : list of tuple
+            For every alpha (in the given order) the alpha, the norm of the residual |u - u_target| and the norm of
+            the forces |f|. Afterwards, the solver holds the solution of the smallest alpha.
+        """
+        from concurrent.futures import as_completed
+
+        order = [int(i) for i in np.argsort(alphas)[::-1]]
+        n_workers = max(1, min(n_workers, len(order)))
+
+        results = [None] * len(order)
+        # solve in this process
+        if n_workers == 1:
+            for i in order:
+                self.solve_regularized(alpha=alphas[i], **solve_parameters)
+                results[i] = (alphas[i], *self._get_regularization_norms())
+            return results
+
+        # every worker solves a contiguous chunk of the alphas
+        solve_parameters.pop("callback", None)
+        solve_parameters.pop("profiler", None)
+        data_dict = self.to_dict()
+        chunks = [[int(i) for i in chunk] for chunk in np.array_split(order, n_workers)]
+        with get_worker_pool(n_workers) as executor:
+            futures = {executor.submit(_solve_regularized_sweep_chunk, data_dict, [alphas[i] for i in chunk],
+                                       solve_parameters): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk_results, data_dict = future.result()
+                for i, result in zip(futures[future], chunk_results):
+                    results[i] = result
+                # keep the solution of the smallest alpha
+                if futures[future] is chunks[-1]:
+                    self._copy_solution(Solver.from_dict(data_dict))
+        return results
+
+    def _copy_solution(self, solved: "Solver"):
+        """
+        Copy the displacements, the forces and the regularisation results of a solved copy of this solver (e.g. from a
+        worker process) into this solver, so that all references to this solver see the solution.
+        """
+        self.mesh.displacements[:] = solved.mesh.displacements
+        self.mesh.forces[:] = solved.mesh.forces
+        self.mesh.strain_energy = solved.mesh.strain_energy
+        self.regularisation_results = solved.regularisation_results
+        self.regularisation_parameters = solved.regularisation_parameters
 
-        self.regularisation_results = relrec
-        return relrec
+    def _get_regularization_norms(self) -> Tuple[float, float]:
+        """
+        The norm of the residual of the fitted displacements and the norm of the forces.
+        """
+        indices = self.mesh.movable & self.mesh.displacements_target_mask
+        residual = np.linalg.norm(self.mesh.displacements_target[indices] - self.mesh.displacements[indices])
+        force = np.linalg.norm(self.mesh.forces[self.mesh.movable])
+        return float(residual), float(force)
+
+    def _get_coarse_solver(self) -> "Solver":
+        """
+        A solver on the box mesh with every second grid line of this box mesh, with the same material, beams, target
+        displacements and masks.
+        """
+        # the unique coordinates of the grid lines
+        points = [np.unique(self.mesh.nodes[:, i]) for i in range(3)]
+        if np.prod([len(p) for p in points]) != self.mesh.number_nodes or \
+                not np.array_equal(np.array(np.meshgrid(*points, indexing="ij")).reshape(3, -1).T, self.mesh.nodes):
+            raise ValueError("The coarse levels can only be created for box meshes.")
+        if min(len(p) for p in points) < 3:
+            raise ValueError("The mesh is too small to create a coarse level.")
+
+        # every second grid line and the last one
+        lines = [np.unique(np.r_[np.arange(0, len(p), 2), len(p) - 1]) for p in points]
+        index = np.ravel_multi_index(np.meshgrid(*lines, indexing="ij"), [len(p) for p in points]).ravel()
+
+        M = Solver()
+        M.set_nodes(self.mesh.nodes[index])
+        M.set_tetrahedra(create_box_mesh(*[p[l] for p, l in zip(points, lines)])[1])
+        M.set_material_model(self.material_model, generate_lookup=False)
+        M.material_model_look_up_parameters = self.material_model_look_up_parameters
+        if self.s is not None:
+            M.set_beams(self.s, self.beam_weights)
+        M.mesh.movable = self.mesh.movable[index]
+        M.mesh.displacements = self.mesh.displacements[index].copy()
+        M.set_target_displacements(self.mesh.displacements_target[index], self.mesh.regularisation_mask[index])
+        return M
+
+    def _set_coarse_displacements(self, coarse: "Solver"):
+        """
+        Interpolate the displacements of the coarse solver to the movable nodes of this solver.
+        """
+        from saenopy.get_deformations import interpolate_different_mesh
+        displacements = interpolate_different_mesh(coarse.mesh.nodes, coarse.mesh.displacements, self.mesh.nodes)
+        self.mesh.displacements[self.mesh.movable] = displacements[self.mesh.movable]
+
+    def _set_acceleration(self, acceleration: str, line_search: bool):
+        if acceleration not in [None, "anderson"]:
+            raise ValueError(f"Unknown acceleration {acceleration}, use None or 'anderson'")
+        if acceleration is not None and line_search:
+            raise ValueError("acceleration cannot be combined with line_search.")
+        # the displacements before and the updates of the last iterations
+        self._acceleration_history = collections.deque(maxlen=self.acceleration_depth + 1)
+
+    def _accelerate_displacements(self, displacements: np.ndarray):
+        """
+        Replace the update of the displacements (from displacements to the current displacements) by the Anderson
+        extrapolation of the last updates if it decreases the quadratic model of L of the linear equation A x = b more
+        than the update, otherwise keep the update and restart the history. The model only needs two products with the
+        stiffness matrix, the forces and the stiffness tensor are not updated.
+        """
+        update = (self.mesh.displacements - displacements).ravel()
+        history = self._acceleration_history
+        history.append((displacements.ravel(), update))
+        if len(history) < 2:
+            return
+        U = np.array([u for u, f in history])
+        F = np.array([f for u, f in history])
+        dU = np.diff(U, axis=0).T
+        dF = np.diff(F, axis=0).T
+        # the combination of the previous updates that best cancels the current update
+        gamma = np.linalg.lstsq(dF, update, rcond=None)[0]
+        accelerated = update - (dU + dF) @ gamma
+
+        def model(x):
+            # the change of L for the displacements x in the Gauss-Newton model, L(u + x) - L(u) ~ x A x - 2 b x
+            x = x.astype(self.dtype, copy=False)
+            return np.inner(x, self.A @ x) - 2 * np.inner(self.b.ravel(), x)
+
+        if model(accelerated) < model(update):
+            self.mesh.displacements[:] = displacements + accelerated.reshape(displacements.shape)
+        else:
+            if self.verbose:
+                print("acceleration rejected")
+            history.clear()
+            history.append((displacements.ravel(), update))
 
-    def _solve_regularization_cg(self, step_size: float = 0.33, solver_precision: float = 1e-18):
+    def _solve_regularization_cg(self, step_size: float = 0.33, solver_precision: float = 1e-18,
+                                 merit: callable = None):
         """
-        Solve the displacements from the current stiffness tensor using conjugate gradient.
+        Solve the displacements from the current stiffness tensor using conjugate gradient. If a merit function is
+        given, the step size is chosen by a line search.
         """
 
         # solve the conjugate gradient which solves the equation A x = b for x
         # where A is (I - KAK) (K: stiffness matrix, A: weight matrix) and b is (u_meas - u - KAf)
-        uu = cg(self.A, self.b.flatten(), maxiter=25*int(pow(self.mesh.number_nodes, 0.33333) + 0.5), tol=self.mesh.number_nodes * solver_precision).reshape((self.mesh.number_nodes, 3))
+        # the factorisations are computed once and reused as the matrix changes only slowly
+        M = self._get_preconditioner(self.A)
+        with self._profile("cg") as info:
+            uu = self._solve_linear_system(self.A, self.b.flatten(),
+                                           maxiter=25*int(pow(self.mesh.number_nodes, 0.33333) + 0.5),
+                                           tol=self.mesh.number_nodes * solver_precision, M=M,
+                                           info=info).reshape((self.mesh.number_nodes, 3))
 
         # add the new displacements to the stored displacements
-        self.mesh.displacements += uu * step_size
+        if merit is None:
+            self.mesh.displacements += uu * step_size
+        else:
+            step_size = self._line_search(uu, merit)
+        self._store_cg_solution(uu, step_size)
         # sum the applied displacements
         du = np.sum(uu ** 2) * step_size * step_size
 
@@ -871,6 +2068,28 @@ class Solver(Saveable):
 
     """ helper methods """
 
+    def estimate_resources(self, regularized: bool = True, **solve_parameters) -> dict:
+        """
+        A rough estimate of the peak memory in bytes and the runtime in seconds of solving this mesh, see
+        :py:func:`estimate_solver_resources`.
+
+        Parameters
+        ----------
+        regularized : bool, optional
+            Whether to estimate :py:meth:`solve_regularized` or :py:meth:`solve_boundarycondition`. Default True
+        solve_parameters
+            The parameters of the solve method, e.g. matrix_free, preconditioner or memory_budget.
+        """
+        if self.mesh.nodes is None or self.mesh.tetrahedra is None:
+            raise ValueError("The nodes and the tetrahedra need to be set to estimate the resources.")
+        if self.s is not None:
+            number_beams = self.s.shape[0]
+        else:
+            number_beams = build_beam_set(300, "grid", True)[0].shape[0]
+        active = np.count_nonzero(np.any(self.mesh.movable[self.mesh.tetrahedra], axis=1))
+        return estimate_solver_resources(self.mesh.nodes.shape[0], self.mesh.tetrahedra.shape[0], number_beams,
+                                         active, regularized, **solve_parameters)
+
     def get_polarity(self) -> float:
 
         inner = self.mesh.regularisation_mask
@@ -1078,6 +2297,275 @@ def load_results(filename: str) -> List[Result]:
     return [Result.load(file) for file in glob.glob(filename, recursive=True)]
 
 
+def _get_subdomain_count(number_nodes: int, subdomains: int = None) -> int:
+    """ the number of subdomains, by default one per thread or per 1000 nodes """
+    if subdomains is not None:
+        return subdomains
+    import numba
+    return max(numba.get_num_threads(), int(np.ceil(number_nodes / 1000)))
+
+
+def estimate_solver_resources(number_nodes: int, number_tetrahedra: int, number_beams: int = 172,
+                              active_tetrahedra: int = None, regularized: bool = True, max_iterations: int = 300,
+                              matrix_free: bool = False, preconditioner: str = None, recycle_directions: int = 0,
+                              single_precision: bool = False, symmetric_storage: bool = False,
+                              memory_budget: float = None, linear_solver: str = "cg", subdomains: int = None,
+                              num_threads: int = None, **kwargs) -> dict:
+    """
+    A rough estimate of the peak memory and the runtime of a relaxation or regularisation from the size of the mesh
+    and the parameters of :py:meth:`Solver.solve_boundarycondition` or :py:meth:`Solver.solve_regularized` (other
+    parameters are ignored). The sizes of the stiffness matrix are estimated from the number of edges of a
+    tetrahedral mesh (about number_nodes + number_tetrahedra), the runtimes from measured throughputs of the assembly
+    and the sparse matrix vector products. The runtime is the time for max_iterations iterations, the iteration
+    usually converges earlier.
+
+    Parameters
+    ----------
+    number_nodes : int
+        The number of nodes of the mesh.
+    number_tetrahedra : int
+        The number of tetrahedra of the mesh.
+    number_beams : int, optional
+        The number of beams, default 172 (the default beam set).
+    active_tetrahedra : int, optional
+        The number of tetrahedra with at least one movable node. Default all
+    regularized : bool, optional
+        Whether to estimate solve_regularized (with two products with the stiffness matrix per conjugate gradient
+        iteration) or solve_boundarycondition. Default True
+    num_threads : int, optional
+        The number of threads of the assembly (and of the matrix vector products with subdomains). Default the number
+        of numba threads.
+
+    Returns
+    -------
+    estimate : dict
+        The bytes of "mesh" (the arrays of the nodes and tetrahedra), "stiffness_matrix" (the stored stiffness matrix
+        and its sparsity pattern), "assembly" (the temporary arrays of the assembly) and "solve" (the vectors and
+        the preconditioner of the conjugate gradient), their sum "memory" (the predicted peak), and the seconds of
+        "assembly_time" and "solve_time" per iteration and the total "runtime".
+    """
+    if num_threads is None:
+        import numba
+        num_threads = numba.get_num_threads()
+    N = number_nodes
+    T = number_tetrahedra
+    T_a = T if active_tetrahedra is None else active_tetrahedra
+    itemsize = 4 if single_precision else 8
+    # a tetrahedral mesh has about N + T edges, every edge gives two off-diagonal blocks
+    active_fraction = T_a / max(T, 1)
+    blocks = (3 * N + 2 * T) * active_fraction
+    if symmetric_storage:
+        blocks = (2 * N + T) * active_fraction
+    nnz = 9 * blocks
+
+    # the coordinates, displacements, forces, targets and weights per node, the indices, shape tensors, volumes,
+    # energies and block offsets per tetrahedron
+    mesh = 200 * N + 200 * T
+    # the 4x4 blocks of 3x3 values of each active tetrahedron (only the upper 10 blocks with symmetric storage) and
+    # the entries of the blocks that are summed into the matrix
+    values = T_a * (60 if symmetric_storage else 144)
+    entries = T_a * (90 if symmetric_storage else 144)
+    batch_size = None
+    if memory_budget is not None and not matrix_free and values * (itemsize + 24) + T_a * 96 > memory_budget:
+        batch_size = min(T_a, int(max(1024, memory_budget // (60 * itemsize + 96))))
+
+    if matrix_free:
+        # the blocks of the tetrahedra are kept, the new blocks are computed while the old ones are still stored
+        stiffness_matrix = T_a * 144 * itemsize
+        assembly = T_a * 144 * itemsize + T_a * 96
+        # the operator applies the blocks, about as expensive as a product with a matrix with these entries
+        nnz_product = T_a * 144
+    elif batch_size is not None:
+        # the matrix with the pattern from the neighbours of the nodes, the batches are added directly to the matrix
+        stiffness_matrix = nnz * (itemsize + 4) + blocks * 8 + 3 * N * 8
+        assembly = batch_size * (60 * itemsize + 96) + blocks * 16
+        nnz_product = nnz
+    else:
+        # the matrix with the gather pattern of the block values, the block values and the forces of the corners and
+        # (only in the first iteration) the sorting of the entries to build the pattern
+        stiffness_matrix = nnz * (itemsize + 4 + 8) + entries * 4 + 3 * N * 8
+        assembly = values * itemsize + T_a * 96 + entries * 48
+        nnz_product = nnz
+    if symmetric_storage:
+        # the symmetric product reads every off-diagonal entry twice
+        nnz_product = 2 * nnz_product - 9 * N
+
+    # the backend of the linear solves, see Solver._set_linear_solver
+    if linear_solver == "auto":
+        linear_solver = "direct" if not matrix_free and N <= (150 if regularized else 300) else "pcg"
+    if linear_solver == "pcg" and preconditioner is None:
+        preconditioner = "block_jacobi"
+    elif linear_solver == "direct":
+        preconditioner = "lu"
+
+    # the vectors of the conjugate gradient and the regularisation, the recycled directions
+    solve = (12 + 2 * recycle_directions) * 3 * N * 8
+    # the regularisation matrix K W K couples the neighbours of the neighbours
+    nnz_system = nnz * 4 if regularized else nnz
+    if preconditioner == "jacobi":
+        solve += 3 * N * 8
+    elif preconditioner == "block_jacobi":
+        solve += 2 * 9 * N * 8
+    elif preconditioner == "ilu":
+        # the assembled matrix in two formats and the incomplete factors
+        solve += nnz_system * 12 * 4
+    elif preconditioner == "lu":
+        # the fill-in of a complete factorisation of a 3D mesh grows faster than the matrix
+        solve += nnz_system * 12 * (2 + 4 * N ** (1 / 3))
+    elif preconditioner == "schwarz":
+        # the factorisations of the subdomains, enlarged by about half by the overlap
+        subdomain_nodes = N / _get_subdomain_count(N, subdomains)
+        solve += nnz_system * 12 * 1.5 * (2 + 4 * subdomain_nodes ** (1 / 3))
+
+    # 1.4e-7 s per tetrahedron and beam and 1.5e-9 s per entry of a matrix vector product on a single core
+    assembly_time = T_a * number_beams * 1.4e-7 / num_threads
+    if regularized:
+        cg_iterations = 25 * int(N ** (1 / 3) + 0.5)
+        products = 2
+    else:
+        cg_iterations = min(3 * N, 25 * int(N ** (1 / 3) + 0.5))
+        products = 1
+    product_time = products * nnz_product * 1.5e-9
+    if subdomains is not None or preconditioner == "schwarz":
+        # the subdomains are multiplied in parallel
+        product_time /= num_threads
+    solve_time = cg_iterations * (product_time + 3 * N * 10 * 1e-9)
+    if linear_solver == "direct":
+        # the factorisation of each iteration, measured on box meshes
+        solve_time = (1e-6 if regularized else 1.3e-7) * N ** 2
+
+    return dict(mesh=int(mesh), stiffness_matrix=int(stiffness_matrix), assembly=int(assembly), solve=int(solve),
+                memory=int(mesh + stiffness_matrix + max(assembly, solve)), assembly_time=assembly_time,
+                solve_time=solve_time, runtime=max_iterations * (assembly_time + solve_time))
+
+
+def _init_worker(num_threads: int):
+    import numba
+    numba.set_num_threads(num_threads)
+
+
+def get_worker_pool(n_workers: int):
+    """
+    A pool of spawned worker processes that share the cores for their numba kernels.
+    """
+    import numba
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    num_threads = max(1, numba.config.NUMBA_NUM_THREADS // n_workers)
+    return ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(num_threads,))
+
+
+def _solve_regularized_chunk(solver_dicts: List[dict], material: Material, prev_t_as_start: bool,
+                             solve_parameters: dict) -> List[dict]:
+    """
+    Solve the regularisation of a list of solvers one after another in a worker process.
+    """
+    results = []
+    previous = None
+    for data_dict in solver_dicts:
+        M = Solver.from_dict(data_dict)
+        if previous is not None and prev_t_as_start:
+            M.mesh.displacements[:] = previous.mesh.displacements
+        if material is not None:
+            M.set_material_model(material)
+        M.solve_regularized(**solve_parameters)
+        results.append(M.to_dict())
+        previous = M
+    return results
+
+
+def _solve_regularized_sweep_chunk(data_dict: dict, alphas: List[float],
+                                   solve_parameters: dict) -> Tuple[List[Tuple[float, float, float]], dict]:
+    """
+    Solve the regularisation for a list of alphas one after another in a worker process.
+    """
+    M = Solver.from_dict(data_dict)
+    results = []
+    for alpha in alphas:
+        M.solve_regularized(alpha=alpha, **solve_parameters)
+        results.append((alpha, *M._get_regularization_norms()))
+    return results, M.to_dict()
+
+
+def solve_regularized_series(solvers: List[Solver], material: Material = None, n_workers: int = 1,
+                             memory_budget: float = None, prev_t_as_start: bool = False,
+                             finished_callback: callable = None, **solve_parameters) -> List[Solver]:
+    """
+    Solve the regularisation of several solvers, e.g. the time points of a :py:class:`~.result_file.Result`, in
+    parallel worker processes. The workers are spawned, therefore scripts that use more than one worker need to
+    protect their entry point with ``if __name__ == "__main__":``.
+
+    Parameters
+    ----------
+    solvers : list of Solver
+        The solvers to solve. The solutions of the worker processes are copied into the solvers.
+    material : :py:class:`~.materials.Material`, optional
+        If given, the material model of all solvers.
+    n_workers : int, optional
+        The number of worker processes. 1 solves the solvers in this process, None uses one process per core.
+    memory_budget : float, optional
+        The memory in bytes that all workers together may use. Reduces the number of workers if needed.
+    prev_t_as_start : bool, optional
+        Start each solver from the displacements of the previous one. Then the solvers are split into contiguous chunks,
+        one per worker, which are solved in order. The first solver of each chunk starts from its own displacements,
+        therefore the results (within the convergence criteria) depend on the number of workers.
+    finished_callback : callable, optional
+        Called with the index and the solver every time a solver has finished.
+    solve_parameters
+        The parameters for :py:meth:`Solver.solve_regularized`. A callback or profiler is only used when solving in
+        this process.
+
+    Returns
+    -------
+    solvers : list of Solver
+        The solved solvers.
+    """
+    import os
+    from concurrent.futures import as_completed
+
+    indices = [i for i, M in enumerate(solvers) if M is not None]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if memory_budget is not None and len(indices):
+        memory = max(solvers[i].estimate_resources(**solve_parameters)["memory"] for i in indices)
+        n_workers = min(n_workers, int(memory_budget // memory))
+    n_workers = max(1, min(n_workers, len(indices)))
+
+    # solve in this process
+    if n_workers == 1:
+        for index, i in enumerate(indices):
+            M = solvers[i]
+            if index > 0 and prev_t_as_start:
+                M.mesh.displacements[:] = solvers[indices[index - 1]].mesh.displacements.copy()
+            if material is not None:
+                M.set_material_model(material)
+            M.solve_regularized(**solve_parameters)
+            if finished_callback is not None:
+                finished_callback(i, solvers[i])
+        return solvers
+
+    # with warm starts every worker solves a contiguous chunk, otherwise every solver is an independent task
+    if prev_t_as_start:
+        chunks = [[int(i) for i in chunk] for chunk in np.array_split(indices, n_workers)]
+    else:
+        chunks = [[i] for i in indices]
+
+    solve_parameters.pop("callback", None)
+    solve_parameters.pop("profiler", None)
+    with get_worker_pool(n_workers) as executor:
+        futures = {executor.submit(_solve_regularized_chunk, [solvers[i].to_dict() for i in chunk], material,
+                                   prev_t_as_start, solve_parameters): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            for i, data_dict in zip(futures[future], future.result()):
+                if material is not None:
+                    solvers[i].set_material_model(material)
+                solvers[i]._copy_solution(Solver.from_dict(data_dict))
+                if finished_callback is not None:
+                    finished_callback(i, solvers[i])
+    return solvers
+
+
 def subtract_reference_state(mesh_piv, mode):
     U = [M.displacements_measured for M in mesh_piv]
     # correct for the different modes
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def get_resident_memory() -> int:
+    """ the resident set size of the process in bytes, None if it is not available (only on Linux) """
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class SolverProfiler:
+    """
+    Records the wall time and the peak memory of the phases of each iteration of a solver, e.g.
+    solver.solve_regularized(profiler=SolverProfiler("trace.json")).
+
+    The phases are "assembly" (energy, forces and stiffness of the tetrahedra), "sparse_conversion" (summing them
+    into the global forces and stiffness matrix), "weight_update" (the regularisation weights), "system" (A and b of
+    the regularisation equation), "cg" (the linear solve with the conjugate gradient or the direct solver, with its
+    number of iterations and relative residual) and "energy_update" (the energy, residual or functional L that is
+    logged). Iteration 0 is the setup before the first iteration.
+
+    The peak memory ("memory_peak") of tracemalloc only counts the allocations of Python and numpy, it does not see
+    the arrays that are allocated inside the numba kernels or by native libraries (e.g. the factorisations of
+    scipy.sparse.linalg.splu), therefore it can understate the real memory usage. On Linux, the resident set size of
+    the process at the end of each phase ("memory_rss") is recorded as well, it includes all allocations (but is not
+    a peak within the phase).
+
+    Parameters
+    ----------
+    filename : str, optional
+        The file to store the events in. Files ending in ".jsonl" get one JSON object per event and line, written while
+        solving. Other files get a Chrome trace (to be opened with chrome://tracing or https://ui.perfetto.dev), written
+        at the end of each solve.
+    callback : callable, optional
+        A function that is called with the dictionary of each event.
+    trace_memory : bool, optional
+        Whether to record the peak memory of each phase with tracemalloc and the resident set size. Slows down the
+        memory allocations. Default True
+    """
+    def __init__(self, filename: str = None, callback: callable = None, trace_memory: bool = True):
+        self.filename = filename
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.events = []
+        self.iteration = 0
+        self._start = time.perf_counter()
+        self._file = None
+        self._started_tracing = False
+        if filename is not None and str(filename).endswith(".jsonl"):
+            self._file = open(filename, "w")
+
+    @contextmanager
+    def phase(self, name: str, **info):
+        """ measure a phase, information added to the yielded dictionary is stored with the event """
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            event = dict(iteration=self.iteration, phase=name, start=start - self._start,
+                         duration=time.perf_counter() - start)
+            if self.trace_memory:
+                event["memory_peak"] = tracemalloc.get_traced_memory()[1]
+                rss = get_resident_memory()
+                if rss is not None:
+                    event["memory_rss"] = rss
+            event.update(info)
+            self.add_event(event)
+
+    def add_event(self, event: dict):
+        self.events.append(event)
+        if self._file is not None:
+            self._file.write(json.dumps(event) + "\n")
+        if self.callback is not None:
+            self.callback(event)
+
+    def save(self):
+        """ write the events to the file """
+        if self._file is not None:
+            self._file.flush()
+        elif self.filename is not None:
+            with open(self.filename, "w") as fp:
+                json.dump(self.get_chrome_trace(), fp)
+
+    def get_chrome_trace(self) -> dict:
+        """ the events in the Chrome trace event format """
+        trace_events = []
+        for event in self.events:
+            args = {key: value for key, value in event.items() if key not in ["phase", "start", "duration"]}
+            trace_events.append(dict(name=event["phase"], ph="X", ts=event["start"] * 1e6,
+                                     dur=event["duration"] * 1e6, pid=0, tid=0, args=args))
+        return dict(traceEvents=trace_events)
+
+    def close(self):
+        self.save()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def summary(self) -> dict:
+        """ the total time, the maximal peak memory and the maximal resident set size of each phase """
+        result = {}
+        for event in self.events:
+            phase = result.setdefault(event["phase"], dict(count=0, duration=0, memory_peak=0, memory_rss=0))
+            phase["count"] += 1
+            phase["duration"] += event["duration"]
+            phase["memory_peak"] = max(phase["memory_peak"], event.get("memory_peak", 0))
+            phase["memory_rss"] = max(phase["memory_rss"], event.get("memory_rss", 0))
+        return result
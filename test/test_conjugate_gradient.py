@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.sparse as ssp
+import pytest
+from saenopy.conjugate_gradient import cg, get_preconditioner, get_block_diagonal, RegularizationOperator, solve_direct, \
+    SubdomainStiffnessOperator
+
+
+def get_matrix(n=30, seed=0):
+    # a sparse symmetric positive definite matrix with 3x3 node blocks
+    rng = np.random.default_rng(seed)
+    A = ssp.random(n * 3, n * 3, density=0.05, random_state=seed)
+    A = A @ A.T + ssp.diags(rng.uniform(1, 10, n * 3))
+    return ssp.csr_matrix(A)
+
+
+@pytest.mark.parametrize("method", [None, "jacobi", "block_jacobi", "ilu", "lu", "schwarz"])
+def test_cg_preconditioner(method):
+    A = get_matrix()
+    x_true = np.random.default_rng(1).normal(size=A.shape[0])
+    b = A @ x_true
+
+    x = cg(A, b, maxiter=1000, tol=1e-14, M=get_preconditioner(A, method))
+    np.testing.assert_allclose(x, x_true, rtol=1e-5, atol=1e-5)
+
+
+def test_solve_direct():
+    A = get_matrix()
+    x_true = np.random.default_rng(1).normal(size=A.shape[0])
+    info = {}
+    np.testing.assert_allclose(solve_direct(A, A @ x_true, info=info), x_true, rtol=1e-8)
+    assert info["iterations"] == 0 and info["residual"] < 1e-10
+
+    # rows and columns without entries keep the value of the right-hand side
+    A = A.tolil()
+    A[:3, :] = 0
+    A[:, :3] = 0
+    b = A @ x_true
+    b[:3] = 1
+    x = solve_direct(ssp.csr_matrix(A), b)
+    np.testing.assert_allclose(x[:3], 1)
+    np.testing.assert_allclose(x[3:], x_true[3:], rtol=1e-8)
+
+
+def test_subdomains():
+    A = get_matrix()
+    x_true = np.random.default_rng(1).normal(size=A.shape[0])
+    subdomains = np.random.default_rng(2).integers(0, 4, A.shape[0] // 3)
+
+    # the rows of the subdomains give the same product as the matrix
+    operator = SubdomainStiffnessOperator(A, subdomains)
+    np.testing.assert_allclose(operator @ x_true, A @ x_true)
+    np.testing.assert_allclose(operator.block_diagonal(), get_block_diagonal(A))
+
+    # the additive Schwarz preconditioner of the subdomains
+    b = A @ x_true
+    M = get_preconditioner(operator, "schwarz", subdomains)
+    x = cg(operator, b, maxiter=1000, tol=1e-14, M=M)
+    np.testing.assert_allclose(x, x_true, rtol=1e-5, atol=1e-5)
+    # the threads are reused for every product and can be stopped
+    np.testing.assert_allclose(M @ b, M @ b)
+    M.close()
+    M.close()
+    np.testing.assert_allclose(cg(operator, b, maxiter=1000, tol=1e-14, M=M), x_true, rtol=1e-5, atol=1e-5)
+
+
+def test_cg_start_value():
+    A = get_matrix()
+    rng = np.random.default_rng(1)
+    x_true = rng.normal(size=A.shape[0])
+    b = A @ x_true
+
+    # starting from the solution needs no iteration
+    np.testing.assert_allclose(cg(A, b, maxiter=0, x0=x_true), x_true)
+    # the solution is found in the subspace
+    W = np.stack([x_true + rng.normal(size=A.shape[0]) * 1e-3, rng.normal(size=A.shape[0])], axis=1)
+    x = cg(A, b, maxiter=0, W=W)
+    assert np.linalg.norm(x - x_true) < 1e-2 * np.linalg.norm(x_true)
+    x = cg(A, b, maxiter=1000, tol=1e-14, x0=np.zeros_like(b), W=W)
+    np.testing.assert_allclose(x, x_true, rtol=1e-5, atol=1e-5)
+
+
+def test_cg_single_precision():
+    A = get_matrix()
+    x_true = np.random.default_rng(1).normal(size=A.shape[0])
+    b = A @ x_true
+
+    info = {}
+    x = cg(A.astype(np.float32), b.astype(np.float32), maxiter=1000, tol=1e-12, info=info)
+    assert x.dtype == np.float32
+    assert info["iterations"] > 0
+    np.testing.assert_allclose(x, x_true, rtol=1e-3, atol=1e-3)
+
+
+def test_preconditioner_unknown():
+    with pytest.raises(ValueError):
+        get_preconditioner(get_matrix(), "unknown")
+
+
+def test_block_diagonal():
+    A = get_matrix()
+    blocks = get_block_diagonal(A)
+    dense = A.toarray()
+    for n in range(A.shape[0] // 3):
+        np.testing.assert_allclose(blocks[n], dense[n * 3:n * 3 + 3, n * 3:n * 3 + 3])
+
+    # the blocks of the regularisation matrix I + K W K
+    rng = np.random.default_rng(2)
+    weight = rng.uniform(0, 1, A.shape[0])
+    mask = (rng.uniform(0, 1, A.shape[0]) > 0.5).astype(float)
+    operator = RegularizationOperator(A, weight, mask)
+    dense = np.diag(mask) + dense @ np.diag(weight) @ dense
+    np.testing.assert_allclose(operator.diagonal(), np.diag(dense))
+    blocks = get_block_diagonal(operator)
+    for n in range(A.shape[0] // 3):
+        np.testing.assert_allclose(blocks[n], dense[n * 3:n * 3 + 3, n * 3:n * 3 + 3])
+    x = rng.normal(size=A.shape[0])
+    np.testing.assert_allclose(operator @ x, dense @ x)
+    np.testing.assert_allclose(operator.tocsr().toarray(), dense)
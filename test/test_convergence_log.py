@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pytest
+from saenopy.convergence_log import ConvergenceLog
+
+
+def get_rows(n=23):
+    rng = np.random.default_rng(0)
+    return rng.uniform(1, 2, size=(n, 3))
+
+
+@pytest.mark.parametrize("extension", ["txt", "csv", "npy", "jsonl"])
+def test_convergence_log_formats(tmp_path, extension):
+    rows = get_rows()
+    filename = tmp_path / f"relrec.{extension}"
+    log = ConvergenceLog(filename, columns=["a", "b", "c"], flush_rows=10, flush_interval=1e6)
+    for i, row in enumerate(rows):
+        log.append(row)
+        # the rows are written in chunks
+        if i == 9 and extension != "npy":
+            assert len(filename.read_text().strip().split("\n")) == 10 + (extension == "csv")
+        if i == 9 and extension == "npy":
+            assert np.load(filename).shape == (10, 3)
+    log.close()
+
+    if extension == "txt":
+        loaded = np.loadtxt(filename)
+    elif extension == "csv":
+        assert filename.read_text().split("\n")[0] == "a,b,c"
+        loaded = np.loadtxt(filename, delimiter=",", skiprows=1)
+    elif extension == "npy":
+        loaded = np.load(filename)
+    else:
+        loaded = np.array([[line["a"], line["b"], line["c"]] for line in map(json.loads, filename.open())])
+    np.testing.assert_allclose(loaded, rows)
+    assert len(log) == len(rows)
+
+
+def test_convergence_log_statistics():
+    rows = get_rows()
+    log = ConvergenceLog(window=5)
+    for row in rows:
+        log.append(row)
+    last = rows[-5:, 1]
+    np.testing.assert_allclose(log.coefficient_of_variation(1), np.std(last) / np.mean(last))
+
+
+def test_convergence_log_exception(tmp_path):
+    rows = get_rows()
+    filename = tmp_path / "relrec.txt"
+    # the buffered rows are written when the context is left with an exception
+    with pytest.raises(RuntimeError):
+        with ConvergenceLog(filename, flush_rows=10, flush_interval=1e6) as log:
+            for row in rows:
+                log.append(row)
+            raise RuntimeError
+    assert log._file is None
+    np.testing.assert_allclose(np.loadtxt(filename), rows)
@@ -38,3 +38,64 @@ def test_material():
         np.testing.assert_almost_equal(np.log(f), np.log(e_prime), decimal=3)
         np.testing.assert_almost_equal(np.log(s), np.log(f_prime), decimal=3)
 
+
+
+def test_look_up_table():
+    from saenopy.materials import Material, numba_look_up_array
+
+    class TabulatedMaterial(Material):
+        def __init__(self, material):
+            self.material = material
+            self.parameters = dict(material=str(material))
+
+        def stiffness(self, s):
+            return self.material.stiffness(s)
+
+    gamma = np.arange(-0.5, 0.3, 0.0001)
+    for material in [SemiAffineFiberMaterial(900, 0.0004, 0.0075, 0.033),
+                     SemiAffineFiberMaterial(900, None, 0.0075, 0.033),
+                     SemiAffineFiberMaterial(900)]:
+        tabulated = TabulatedMaterial(material)
+        kind, parameters, table = tabulated.generate_look_up_parameters()
+        # the table is only as fine as needed
+        assert table.shape[1] < (material.max - material.min) / material.step / 5
+
+        # the tabulated material is close to the analytic one
+        exact = material.generate_look_up_table()(gamma)
+        approximated = numba_look_up_array(gamma, kind, parameters, table)
+        for a, e in zip(approximated, exact):
+            np.testing.assert_allclose(a, e, rtol=2 * tabulated.tolerance, atol=1e-9 * np.abs(e).max())
+
+        # materials with the same parameters share the table
+        assert TabulatedMaterial(material).generate_look_up_parameters()[2] is table
+
+
+def test_look_up_large_strains():
+    from saenopy.materials import Material, numba_look_up_array
+
+    class TabulatedMaterial(Material):
+        def __init__(self, material):
+            self.material = material
+            self.parameters = dict(material=str(material))
+
+        def stiffness(self, s):
+            return self.material.stiffness(s)
+
+    # by default the analytic evaluation has no limits
+    gamma = np.array([-2, -1, -0.5, 0, 0.01, 0.1, 0.5, 0.62, 0.7, 1, 2, 4, 10])
+    for material in [SemiAffineFiberMaterial(900, 0.0004, 0.0075, 0.033), SemiAffineFiberMaterial(900)]:
+        exact = material.generate_look_up_table()(gamma)
+        np.testing.assert_allclose(exact[0], material.energy(gamma), rtol=1e-12)
+        np.testing.assert_allclose(exact[1], material.force(gamma), rtol=1e-12)
+        np.testing.assert_allclose(exact[2], material.stiffness(gamma), rtol=1e-12)
+
+    # optionally, the analytic evaluation is clamped and capped like the table
+    gamma = np.array([-30, -2, -1, -0.5, 0, 0.01, 0.1, 0.5, 1, 2, 3.9, 4, 30])
+    for material in [SemiAffineFiberMaterial(900, 0.0004, 0.0075, 0.033), SemiAffineFiberMaterial(900)]:
+        material.limit_like_table = True
+        exact = material.generate_look_up_table()(gamma)
+        approximated = numba_look_up_array(gamma, *TabulatedMaterial(material).generate_look_up_parameters())
+        for a, e in zip(approximated, exact):
+            assert np.all(np.isfinite(e))
+            np.testing.assert_allclose(e, a, rtol=1e-3, atol=1e-9 * np.abs(a).max())
+        assert np.max(exact[2]) <= material.maximal_value
@@ -0,0 +1,578 @@
+import numpy as np
+import sys
+import tracemalloc
+import pytest
+from saenopy import Solver
+from saenopy.multigrid_helper import create_box_mesh
+from saenopy.materials import SemiAffineFiberMaterial
+
+
+def get_solver(n=5, fixed_border=True, border_width=0):
+    R, T = create_box_mesh(np.linspace(-0.5, 0.5, n))
+
+    M = Solver()
+    M.set_nodes(R)
+    M.set_tetrahedra(T)
+    M.set_material_model(SemiAffineFiberMaterial(900, 0.0004, 0.0075, 0.033))
+
+    rng = np.random.default_rng(1234)
+    U = rng.normal(size=R.shape) * 0.01
+    displacements = np.zeros(R.shape) * np.nan
+    if fixed_border:
+        border = np.any(np.abs(R) >= 0.5 - border_width, axis=1)
+        displacements[border] = U[border]
+    M.set_boundary_condition(displacements, np.zeros(R.shape))
+    M.set_initial_displacements(U)
+    return M
+
+
+def get_regularized_solver(n=5, target=None, decay=1):
+    # all nodes are free and fitted to the target displacements (by default a decaying contraction to the center)
+    M = get_solver(n=n, fixed_border=False)
+    R = M.mesh.nodes
+    if target is None:
+        target = -R * np.exp(-np.linalg.norm(R, axis=1) * decay)[:, None] * 0.01
+    M.set_target_displacements(target)
+    M.set_initial_displacements(np.zeros(R.shape))
+    return M
+
+
+def reference_assembly(M):
+    # the einsum formulation of the energy, force and stiffness of each tetrahedron
+    F = np.eye(3) + np.einsum("tmi,tmj->tij", M.mesh.displacements[M.mesh.tetrahedra], M.mesh.Phi)
+    s_bar = F @ M.s.T
+    s_star = M.mesh.Phi @ M.s.T
+    V_over_Nb = M.mesh.volume[:, None] * M.beam_weights[None, :]
+
+    s = np.linalg.norm(s_bar, axis=1)
+    epsilon_b, epsbar_b, epsbarbar_b = M.material_model.generate_look_up_table()(s - 1)
+    dEdsbar = - (epsbar_b / s) * V_over_Nb
+    dEdsbarbar = ((s * epsbarbar_b - epsbar_b) / (s ** 3)) * V_over_Nb
+
+    energy = (epsilon_b @ M.beam_weights) * M.mesh.volume
+    f = np.einsum("tmb,tib,tb->tmi", s_star, s_bar, dEdsbar)
+    s_bar_s_bar = 0.5 * (np.einsum("tb,tib,tlb->tilb", dEdsbarbar, s_bar, s_bar)
+                         - np.einsum("il,tb->tilb", np.eye(3), dEdsbar))
+    K = np.einsum("tmb,trb,tilb->tmril", s_star, s_star, s_bar_s_bar)
+
+    forces = np.zeros(M.mesh.nodes.shape)
+    np.add.at(forces, M.mesh.tetrahedra, f)
+
+    N = M.mesh.number_nodes * 3
+    rows = (M.mesh.tetrahedra[:, :, None, None, None] * 3 + np.arange(3)[None, None, None, :, None])
+    cols = (M.mesh.tetrahedra[:, None, :, None, None] * 3 + np.arange(3)[None, None, None, None, :])
+    rows, cols = np.broadcast_arrays(rows, cols, K)[:2]
+    K_glo = np.zeros((N, N))
+    np.add.at(K_glo, (rows.ravel(), cols.ravel()), K.ravel())
+    K_glo[np.repeat(~M.mesh.movable, 3)] = 0
+
+    return energy, forces, K_glo
+
+
+@pytest.mark.parametrize("border_width", [0, 0.25])
+def test_assembly(border_width):
+    M = get_solver(border_width=border_width)
+    M._check_relax_ready()
+    M._prepare_temporary_quantities()
+    M._update_glo_f_and_k()
+
+    # only the tetrahedra with movable nodes are assembled in the iterations
+    is_active = np.any(M.mesh.movable[M.mesh.tetrahedra], axis=1)
+    np.testing.assert_equal(M.topology.active_tetrahedra, np.flatnonzero(is_active))
+    if border_width:
+        assert M.topology.fixed_tetrahedra.shape[0] > M.topology.active_tetrahedra.shape[0]
+
+    energy, forces, K_glo = reference_assembly(M)
+
+    np.testing.assert_allclose(M.mesh.energy, energy, rtol=1e-10)
+    np.testing.assert_allclose(M.mesh.forces, forces, rtol=1e-8, atol=1e-8 * np.abs(forces).max())
+    np.testing.assert_allclose(M.K_glo.toarray(), K_glo, rtol=1e-8, atol=1e-8 * np.abs(K_glo).max())
+    np.testing.assert_allclose(M.mesh.strain_energy, np.sum(energy[is_active]), rtol=1e-10)
+
+    M.matrix_free = True
+    M._update_glo_f_and_k()
+    x = np.random.default_rng(0).normal(size=K_glo.shape[0])
+    np.testing.assert_allclose(M.K_glo @ x, K_glo @ x, rtol=1e-8, atol=1e-8 * np.abs(K_glo @ x).max())
+
+
+def test_beam_sets():
+    from saenopy.build_beams import build_beam_set
+
+    def assemble(*args, **kwargs):
+        M = get_solver()
+        M.set_beams(*args, **kwargs)
+        M._check_relax_ready()
+        M._prepare_temporary_quantities()
+        M._update_glo_f_and_k()
+        return M
+
+    # merging the beams s and -s gives the same result with fewer beams
+    M = assemble(300, hemisphere=False)
+    M2 = assemble(300)
+    assert M2.N_b < M.N_b
+    np.testing.assert_allclose(M2.mesh.energy, M.mesh.energy, rtol=1e-10)
+    np.testing.assert_allclose(M2.mesh.forces, M.mesh.forces, rtol=1e-10, atol=1e-10 * np.abs(M.mesh.forces).max())
+    np.testing.assert_allclose(M2.K_glo.toarray(), M.K_glo.toarray(), rtol=1e-10, atol=1e-10 * np.abs(M.K_glo).max())
+
+    # the quadratures are exact for polynomials of the beam coordinates
+    for n, kind in [(300, "gauss"), (26, "lebedev"), (50, "lebedev")]:
+        beams, weights = build_beam_set(n, kind)
+        np.testing.assert_allclose(np.sum(weights), 1)
+        np.testing.assert_allclose(weights @ beams[:, 0] ** 4, 1 / 5)
+        np.testing.assert_allclose(weights @ (beams[:, 0] ** 2 * beams[:, 1] ** 2), 1 / 15)
+    with pytest.raises(ValueError):
+        build_beam_set(20, "lebedev")
+
+    # the energy of a quadrature with fewer beams is close to the one of many beams
+    M = assemble(2000, kind="gauss")
+    M2 = assemble(50, kind="lebedev")
+    assert M2.N_b == 25
+    np.testing.assert_allclose(np.sum(M2.mesh.energy), np.sum(M.mesh.energy), rtol=1e-2)
+
+
+def test_matrix_free():
+    M = get_solver()
+    M._check_relax_ready()
+    M._prepare_temporary_quantities()
+    M._update_glo_f_and_k()
+    K_glo = M.K_glo.copy()
+
+    M.matrix_free = True
+    M._update_glo_f_and_k()
+
+    x = np.random.default_rng(0).normal(size=K_glo.shape[0])
+    np.testing.assert_allclose(M.K_glo @ x, K_glo @ x, rtol=1e-8, atol=1e-8 * np.abs(K_glo @ x).max())
+    np.testing.assert_allclose(M.K_glo.diagonal(), K_glo.diagonal(), rtol=1e-8)
+
+    # the relaxation gives the same result with and without assembling the matrix
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20)
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, matrix_free=True)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+
+
+@pytest.mark.parametrize("border_width", [0, 0.25])
+def test_symmetric_storage(border_width):
+    M = get_solver(border_width=border_width)
+    M._check_relax_ready()
+    M._prepare_temporary_quantities()
+    M._update_glo_f_and_k()
+    K_glo = M.K_glo.copy()
+
+    M._set_storage(False, True)
+    M._update_glo_f_and_k()
+    # only the upper triangle is stored (and the entries of fixed rows with movable columns)
+    assert M.K_glo.upper.nnz <= K_glo.nnz
+    np.testing.assert_allclose(M.K_glo.tocsr().toarray(), K_glo.toarray(), rtol=1e-8,
+                               atol=1e-8 * np.abs(K_glo).max())
+    x = np.random.default_rng(0).normal(size=K_glo.shape[0])
+    np.testing.assert_allclose(M.K_glo @ x, K_glo @ x, rtol=1e-8, atol=1e-8 * np.abs(K_glo @ x).max())
+    np.testing.assert_allclose(M.K_glo.diagonal(), K_glo.diagonal(), rtol=1e-8)
+    from saenopy.conjugate_gradient import get_block_diagonal
+    np.testing.assert_allclose(M.K_glo.block_diagonal(), get_block_diagonal(K_glo), rtol=1e-8,
+                               atol=1e-8 * np.abs(K_glo).max())
+    with pytest.raises(ValueError):
+        M._set_storage(True, True)
+
+    # the relaxation and the regularisation give the same result
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20)
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, symmetric_storage=True)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+
+    M = get_regularized_solver()
+    M.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="block_jacobi")
+    M2 = get_regularized_solver()
+    M2.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="block_jacobi", symmetric_storage=True)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+    assert M2.K_glo.upper.nnz < 0.6 * M.K_glo.nnz
+
+
+@pytest.mark.parametrize("symmetric_storage", [False, True])
+def test_memory_budget(symmetric_storage):
+    def assemble(memory_budget):
+        M = get_solver(n=9, border_width=0.125)
+        M._set_storage(False, symmetric_storage)
+        M.memory_budget = memory_budget
+        M._check_relax_ready()
+        M._prepare_temporary_quantities()
+        M._update_glo_f_and_k()
+        return M
+
+    M = assemble(None)
+    assert M._batch_size is None
+    # the assembly in batches of 1024 tetrahedra gives the same result
+    M2 = assemble(1)
+    assert M2._batch_size == 1024 < M2.topology.active_tetrahedra.shape[0]
+    np.testing.assert_allclose(M2.mesh.energy, M.mesh.energy, rtol=1e-10)
+    np.testing.assert_allclose(M2.mesh.forces, M.mesh.forces, rtol=1e-8, atol=1e-8 * np.abs(M.mesh.forces).max())
+    K, K2 = M.K_glo.tocsr(), M2.K_glo.tocsr()
+    np.testing.assert_allclose(K2.toarray(), K.toarray(), rtol=1e-8, atol=1e-8 * np.abs(K).max())
+
+    # a large budget assembles all tetrahedra at once
+    assert assemble(1e12)._batch_size is None
+
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20, symmetric_storage=symmetric_storage)
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, symmetric_storage=symmetric_storage, memory_budget=1)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+
+
+@pytest.mark.parametrize("parameters", [{}, dict(symmetric_storage=True), dict(memory_budget=1e5),
+                                        dict(matrix_free=True)])
+def test_estimate_resources(parameters):
+    M = get_solver(n=9, fixed_border=False)
+    estimate = M.estimate_resources(**parameters)
+    M._set_storage(parameters.get("matrix_free", False), parameters.get("symmetric_storage", False))
+    M.memory_budget = parameters.get("memory_budget")
+    M._check_relax_ready()
+    M._prepare_temporary_quantities()
+
+    # the predicted peak memory of the first assembly matches the measured one within a factor of 2
+    tracemalloc.start()
+    M._update_glo_f_and_k()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    predicted = estimate["assembly"] + estimate["stiffness_matrix"]
+    assert 0.5 < predicted / peak < 2
+    if not M.matrix_free:
+        # the matrix and its gather pattern
+        stored = [M.K_glo_csr.data, M.K_glo_csr.indices, M.K_glo_csr.indptr]
+        if M._batch_size is None:
+            stored += [M.stiffness_gather_indptr, M.stiffness_gather_order]
+        assert 0.5 < estimate["stiffness_matrix"] / sum(array.nbytes for array in stored) < 2
+    assert estimate["memory"] >= predicted
+    assert estimate["runtime"] == 300 * (estimate["assembly_time"] + estimate["solve_time"])
+
+
+def test_linear_solver():
+    # the relaxation with the direct solver gives the same result as the conjugate gradient
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20)
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, linear_solver="direct")
+    assert M2.linear_solver == "direct" and M2.preconditioner is None
+    # the exact linear solves take slightly different steps than the conjugate gradient
+    np.testing.assert_allclose(M2.mesh.strain_energy, M.mesh.strain_energy, rtol=1e-4)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-3)
+
+    # the regularisation with the direct solver gives the same result as the preconditioned conjugate gradient
+    M = get_regularized_solver()
+    M.solve_regularized(max_iterations=10, alpha=1e2, linear_solver="pcg")
+    assert M.linear_solver == "cg" and M.preconditioner == "block_jacobi"
+    M2 = get_regularized_solver()
+    M2.solve_regularized(max_iterations=10, alpha=1e2, linear_solver="auto")
+    assert M2.linear_solver == "direct"
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        get_solver().solve_boundarycondition(linear_solver="cholesky")
+    with pytest.raises(ValueError):
+        get_solver().solve_boundarycondition(linear_solver="direct", matrix_free=True)
+
+
+def test_subdomains():
+    from saenopy.conjugate_gradient import ElementStiffnessOperator, get_element_partition
+    from saenopy.multigrid_helper import get_subdomains
+
+    # the products of the subdomains give the same result as the serial products
+    M = get_solver(n=6)
+    M.solve_boundarycondition(max_iterations=20)
+    M2 = get_solver(n=6)
+    M2.solve_boundarycondition(max_iterations=20, subdomains=4)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements)
+    np.testing.assert_allclose(M2.K_glo @ M.mesh.displacements.ravel(), M.K_glo @ M.mesh.displacements.ravel())
+
+    # the halo contributions of the matrix free products
+    M = get_solver(n=6)
+    M.solve_boundarycondition(max_iterations=2, matrix_free=True)
+    K = M.K_glo
+    subdomains = get_subdomains(M.mesh.nodes, 4)
+    assert np.all(np.bincount(subdomains) >= M.mesh.number_nodes // 4)
+    K2 = ElementStiffnessOperator(K.tetrahedra, K.block_offset, K.K_data, K.shape,
+                                  get_element_partition(K.tetrahedra, subdomains))
+    x = np.random.default_rng(1).normal(size=K.shape[0])
+    np.testing.assert_allclose(K2 @ x, K @ x, atol=1e-10)
+
+    # the additive Schwarz preconditioner
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20, preconditioner="block_jacobi")
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, preconditioner="schwarz", subdomains=3)
+    np.testing.assert_allclose(M2.mesh.strain_energy, M.mesh.strain_energy, rtol=1e-4)
+
+    with pytest.raises(ValueError):
+        get_solver().solve_boundarycondition(subdomains=2, symmetric_storage=True)
+
+
+def test_acceleration():
+    M = get_solver()
+    M.solve_boundarycondition()
+    displacements = M.mesh.displacements
+
+    # the Anderson acceleration decreases L faster than the plain updates
+    M = get_regularized_solver(target=displacements)
+    M.solve_regularized(max_iterations=20, rel_conv_crit=0, alpha=1e3, method="normal")
+    M2 = get_regularized_solver(target=displacements)
+    M2.solve_regularized(max_iterations=20, rel_conv_crit=0, alpha=1e3, method="normal", acceleration="anderson")
+    L_start = M.regularisation_results[0][0]
+    assert L_start - M2.regularisation_results[-1][0] > 2 * (L_start - M.regularisation_results[-1][0])
+
+    with pytest.raises(ValueError):
+        get_regularized_solver(target=displacements).solve_regularized(acceleration="broyden")
+    with pytest.raises(ValueError):
+        get_regularized_solver(target=displacements).solve_regularized(acceleration="anderson", line_search=True)
+
+
+def test_regularization_factor():
+    # the cached factorisation of the first iteration converges to the same result as a fresh preconditioner
+    M = get_regularized_solver()
+    M.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="block_jacobi")
+    M2 = get_regularized_solver()
+    M2.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="lu")
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+
+    # the factorisation needs the assembled stiffness matrix
+    with pytest.raises(ValueError):
+        get_regularized_solver().solve_regularized(max_iterations=2, preconditioner="lu", matrix_free=True)
+
+
+def test_boundary_preconditioner_reuse(monkeypatch):
+    import saenopy.solver
+    from saenopy.conjugate_gradient import AdditiveSchwarzPreconditioner
+    factors = []
+    closed = []
+
+    def get_preconditioner(*args):
+        factors.append(saenopy.solver.get_preconditioner.__wrapped__(*args))
+        return factors[-1]
+    get_preconditioner.__wrapped__ = saenopy.solver.get_preconditioner
+    monkeypatch.setattr(saenopy.solver, "get_preconditioner", get_preconditioner)
+
+    def close(self):
+        closed.append(self)
+        close.__wrapped__(self)
+    close.__wrapped__ = AdditiveSchwarzPreconditioner.close
+    monkeypatch.setattr(AdditiveSchwarzPreconditioner, "close", close)
+
+    # the factorisation is reused for preconditioner_refresh iterations and converges like a fresh preconditioner
+    M = get_solver()
+    M.solve_boundarycondition(max_iterations=20, rel_conv_crit=0, preconditioner="schwarz", subdomains=3)
+    assert len(factors) == 20 // M.preconditioner_refresh
+    # the replaced factorisations are closed
+    assert closed == factors[:-1]
+    M2 = get_solver()
+    M2.solve_boundarycondition(max_iterations=20, rel_conv_crit=0, preconditioner="block_jacobi")
+    np.testing.assert_allclose(M.mesh.strain_energy, M2.mesh.strain_energy, rtol=1e-4)
+
+
+def test_line_search():
+    M = get_solver()
+    relrec = M.solve_boundarycondition(max_iterations=100)
+    M2 = get_solver()
+    relrec2 = M2.solve_boundarycondition(max_iterations=100, line_search=True)
+    assert len(relrec2) < len(relrec)
+    assert relrec2[-1][2] <= relrec[-1][2]
+
+    # the residual criterion finishes the iteration once the force residual has been reduced enough
+    M3 = get_solver()
+    relrec3 = M3.solve_boundarycondition(max_iterations=100, line_search=True, residual_tolerance=0.1)
+    assert len(relrec3) < len(relrec2)
+    assert relrec3[-1][2] <= 0.1 ** 2 * relrec3[0][2]
+
+
+def test_profiler(tmp_path):
+    import json
+    from saenopy import SolverProfiler
+
+    events = []
+    profiler = SolverProfiler(tmp_path / "trace.jsonl", callback=events.append)
+    M = get_solver(fixed_border=False)
+    R = M.mesh.nodes
+    M.set_target_displacements(-R * np.exp(-np.linalg.norm(R, axis=1))[:, None] * 0.01)
+    M.solve_regularized(max_iterations=3, alpha=1e2, profiler=profiler)
+    profiler.close()
+
+    phases = {event["phase"] for event in events}
+    assert phases == {"assembly", "sparse_conversion", "weight_update", "system", "cg", "energy_update"}
+    cg_events = [event for event in events if event["phase"] == "cg"]
+    assert [event["iteration"] for event in cg_events] == [1, 2, 3]
+    assert all(event["iterations"] > 0 and event["memory_peak"] > 0 for event in cg_events)
+    if sys.platform.startswith("linux"):
+        assert all(event["memory_rss"] > 0 for event in cg_events)
+    with open(tmp_path / "trace.jsonl") as fp:
+        assert [json.loads(line) for line in fp] == events
+
+    # the chrome trace is written at the end of the solve
+    profiler = SolverProfiler(tmp_path / "trace.json", trace_memory=False)
+    get_solver().solve_boundarycondition(max_iterations=3, profiler=profiler)
+    with open(tmp_path / "trace.json") as fp:
+        trace = json.load(fp)["traceEvents"]
+    assert len(trace) == len(profiler.events)
+    assert {event["name"] for event in trace} == {"assembly", "sparse_conversion", "cg", "energy_update"}
+
+
+def test_single_precision():
+    M = get_regularized_solver()
+    M._set_precision(True)
+    M._check_relax_ready()
+    M._prepare_temporary_quantities()
+    M._update_glo_f_and_k()
+    assert M.K_glo.dtype == np.float32
+
+    # the single precision solution is refined in double precision
+    M = get_regularized_solver()
+    M.solve_regularized(max_iterations=20, alpha=1e2, single_precision=True)
+    assert M.K_glo.dtype == np.float64
+
+    M = get_solver()
+    M.solve_boundarycondition(rel_conv_crit=1e-4)
+    M2 = get_solver()
+    M2.solve_boundarycondition(rel_conv_crit=1e-4, single_precision=True)
+    assert M2.K_glo.dtype == np.float64
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-3)
+
+
+@pytest.mark.parametrize("method", ["rcm", "morton"])
+def test_reorder(method):
+    from saenopy.multigrid_helper import get_node_order
+
+    M = get_solver()
+    order = get_node_order(M.mesh.nodes, M.mesh.tetrahedra, method)
+    np.testing.assert_equal(np.sort(order), np.arange(M.mesh.number_nodes))
+
+    # the relaxation in the renumbered mesh gives the same result in the original order
+    M.solve_boundarycondition(max_iterations=20)
+    M2 = get_solver()
+    nodes, tetrahedra = M2.mesh.nodes.copy(), M2.mesh.tetrahedra.copy()
+    M2.solve_boundarycondition(max_iterations=20, reorder=method)
+    np.testing.assert_equal(M2.mesh.nodes, nodes)
+    np.testing.assert_equal(M2.mesh.tetrahedra, tetrahedra)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+    np.testing.assert_allclose(M2.mesh.energy, M.mesh.energy, rtol=1e-6)
+
+    M = get_regularized_solver()
+    M.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="block_jacobi")
+    M2 = get_regularized_solver()
+    M2.solve_regularized(max_iterations=10, alpha=1e2, preconditioner="block_jacobi", reorder=method)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-6)
+    np.testing.assert_allclose(M2.localweight, M.localweight, rtol=1e-3)
+    with pytest.raises(ValueError):
+        M2.solve_regularized(max_iterations=1, reorder="hilbert")
+
+
+def test_shared_topology():
+    M = get_solver()
+    M._check_relax_ready()
+    M2 = get_solver()
+    M2._check_relax_ready()
+    assert M2.topology is M.topology
+
+    # the stiffness matrices share the pattern but not the values
+    for S in [M, M2]:
+        S._prepare_temporary_quantities()
+        S._update_glo_f_and_k()
+    assert np.shares_memory(M.K_glo.indices, M2.K_glo.indices)
+    assert not np.shares_memory(M.K_glo.data, M2.K_glo.data)
+
+    # a different set of movable nodes needs a new topology
+    M3 = get_solver(fixed_border=False)
+    M3._check_relax_ready()
+    assert M3.topology is not M.topology
+
+    # changing the boundary condition of a solver updates its topology
+    M2.set_boundary_condition(np.zeros(M2.mesh.nodes.shape) * np.nan, np.zeros(M2.mesh.nodes.shape))
+    M2._check_relax_ready()
+    assert M2.topology is M3.topology
+
+
+def test_material_arguments():
+    from saenopy.solver import numba_update_glo_f_and_k
+    from saenopy.materials import LinearMaterial
+
+    # the material parameters are passed as arguments, different materials do not compile the kernel again
+    for material in [SemiAffineFiberMaterial(900, 0.0004, 0.0075, 0.033), SemiAffineFiberMaterial(1645, None),
+                     LinearMaterial(900)]:
+        M = get_solver()
+        M.set_material_model(material)
+        M._check_relax_ready()
+        M._prepare_temporary_quantities()
+        M._update_glo_f_and_k()
+
+        energy, forces, K_glo = reference_assembly(M)
+        np.testing.assert_allclose(M.mesh.energy, energy, rtol=1e-10)
+    # only one double precision version of the kernel (single precision compiles another one)
+    assert len([sig for sig in numba_update_glo_f_and_k.signatures if str(sig[13].dtype) == "float64"]) == 1
+
+
+def test_solve_regularized_series():
+    from saenopy import solve_regularized_series
+
+    def get_solvers():
+        solvers = []
+        for scale in [0.5, 1, 2]:
+            M = get_solver(fixed_border=False)
+            R = M.mesh.nodes
+            M.set_target_displacements(-R * np.exp(-np.linalg.norm(R, axis=1))[:, None] * 0.01 * scale)
+            solvers.append(M)
+        return solvers
+
+    finished = []
+    solvers = solve_regularized_series(get_solvers(), max_iterations=5, alpha=1e3)
+    solvers_input = get_solvers()
+    solvers_parallel = solve_regularized_series(solvers_input, n_workers=2, max_iterations=5, alpha=1e3,
+                                                finished_callback=lambda i, M: finished.append(i))
+    assert sorted(finished) == [0, 1, 2]
+    # the solutions are copied into the given solvers
+    for M, M2 in zip(solvers_input, solvers_parallel):
+        assert M is M2 and M.regularisation_results is not None
+    for M, M2 in zip(solvers, solvers_parallel):
+        np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements)
+
+    # the memory budget limits the number of workers
+    solvers = get_solvers()
+    solve_regularized_series(solvers, n_workers=2, memory_budget=1, max_iterations=5, alpha=1e3,
+                             callback=lambda M, relrec, i, imax: finished.append(i))
+    assert len(finished) > 3
+
+
+def test_solve_regularized_sweep():
+    alphas = [1e1, 1e3, 1e2]
+    M = get_regularized_solver()
+    results = M.solve_regularized_sweep(alphas, max_iterations=20)
+    assert [r[0] for r in results] == alphas
+    # a stronger regularisation fits the target worse with smaller forces
+    (_, res_1, force_1), (_, res_3, force_3), (_, res_2, force_2) = results
+    assert res_1 < res_2 < res_3
+    assert force_1 > force_2 > force_3
+
+    M2 = get_regularized_solver()
+    results_parallel = M2.solve_regularized_sweep(alphas, n_workers=2, max_iterations=20)
+    # the chunks are [1e3, 1e2] and [1e1], each one starts from the initial displacements
+    np.testing.assert_allclose(results_parallel[1:], results[1:])
+    M3 = get_regularized_solver()
+    np.testing.assert_allclose(results_parallel[0], M3.solve_regularized_sweep([1e1], max_iterations=20)[0])
+    np.testing.assert_allclose(M2.mesh.displacements, M3.mesh.displacements)
+
+
+def test_coarse_levels():
+    M = get_regularized_solver(n=9, decay=4)
+    coarse = M._get_coarse_solver()
+    for i in range(3):
+        np.testing.assert_equal(np.unique(coarse.mesh.nodes[:, i]), np.linspace(-0.5, 0.5, 5))
+
+    # the coarse start converges to the same solution
+    relrec = M.solve_regularized(alpha=1e-4, max_iterations=100, rel_conv_crit=1e-4)
+    M2 = get_regularized_solver(n=9, decay=4)
+    relrec2 = M2.solve_regularized(alpha=1e-4, max_iterations=100, rel_conv_crit=1e-4, coarse_levels=1)
+    np.testing.assert_allclose(M2.mesh.displacements, M.mesh.displacements, atol=1e-4 * np.abs(M.mesh.displacements).max())
+    assert len(relrec2) < len(relrec)
+
+    # only box meshes can be coarsened
+    M3 = get_regularized_solver(n=9, decay=4)
+    M3.set_nodes(M3.mesh.nodes + np.random.default_rng(0).normal(size=M3.mesh.nodes.shape) * 0.01)
+    with pytest.raises(ValueError):
+        M3.solve_regularized(coarse_levels=1)